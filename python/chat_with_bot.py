@@ -9,8 +9,8 @@ import copy
 import json
 import time
 import sampling
-from rwkv_cpp import rwkv_cpp_shared_library, rwkv_cpp_model
-from tokenizer_util import add_tokenizer_argument, get_tokenizer
+from rwkv_cpp import rwkv_cpp_shared_library, rwkv_cpp_model, rwkv_cpp_penalty, rwkv_streaming_detokenizer
+from tokenizer_util import add_tokenizer_argument, get_tokenizer, get_tokenizer_decode_bytes
 from typing import List, Dict, Optional
 
 # ======================================== Script settings ========================================
@@ -60,7 +60,8 @@ print(f'System info: {library.rwkv_get_system_info_string()}')
 print('Loading RWKV model')
 model = rwkv_cpp_model.RWKVModel(library, args.model_path, gpu_layer_count=args.num_gpu_layers)
 
-tokenizer_decode, tokenizer_encode = get_tokenizer(args.tokenizer, model.n_vocab)
+_, tokenizer_encode = get_tokenizer(args.tokenizer, model.n_vocab)
+tokenizer_decode_bytes = get_tokenizer_decode_bytes(args.tokenizer, model.n_vocab)
 
 # =================================================================================================
 
@@ -238,42 +239,30 @@ Below is an instruction that describes a task. Write a response that appropriate
         # Print assistant response
         print(f'> {assistant}{separator}', end='')
 
-    start_index: int = len(processed_tokens)
-    accumulated_tokens: List[int] = []
-    token_counts: Dict[int, int] = {}
+    # In chat mode, the reply ends with an empty line.
+    detokenizer: rwkv_streaming_detokenizer.RWKVStreamingDetokenizer = rwkv_streaming_detokenizer.RWKVStreamingDetokenizer(tokenizer_decode_bytes, ['\n\n'] if thread == 'chat' else [])
+    penalty: rwkv_cpp_penalty.RWKVTokenPenalty = rwkv_cpp_penalty.RWKVTokenPenalty(model.n_vocab, PRESENCE_PENALTY, FREQUENCY_PENALTY)
 
     for i in range(MAX_GENERATION_LENGTH):
-        for n in token_counts:
-            logits[n] -= PRESENCE_PENALTY + token_counts[n] * FREQUENCY_PENALTY
+        penalty.apply(logits, logits)
 
         token: int = sampling.sample_logits(logits, temperature, top_p)
 
         if token == END_OF_TEXT_TOKEN:
-            print()
+            print(detokenizer.flush())
             break
 
-        if token not in token_counts:
-            token_counts[token] = 1
-        else:
-            token_counts[token] += 1
+        penalty.add(token)
 
         process_tokens([token])
 
-        # Avoid UTF-8 display issues
-        accumulated_tokens += [token]
-
-        decoded: str = tokenizer_decode(accumulated_tokens)
-
-        if '\uFFFD' not in decoded:
-            print(decoded, end='', flush=True)
+        print(detokenizer.add(token), end='', flush=True)
 
-            accumulated_tokens = []
-
-        if thread == 'chat':
-            if '\n\n' in tokenizer_decode(processed_tokens[start_index:]):
-                break
+        if detokenizer.stopped:
+            print(detokenizer.stop_string, end='')
+            break
 
         if i == MAX_GENERATION_LENGTH - 1:
-            print()
+            print(detokenizer.flush())
 
     save_thread_state(thread)
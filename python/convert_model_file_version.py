@@ -0,0 +1,31 @@
+# Rewrites rwkv.cpp model file in another version of the file format.
+# Version 102 aligns tensor data, so that the model can be memory-mapped without copying; versions 100 and 101 can be read by older versions of rwkv.cpp.
+# Usage: python convert_model_file_version.py C:\rwkv.cpp-169M-Q5_1.bin C:\rwkv.cpp-169M-Q5_1-v102.bin --version 102
+
+import argparse
+from rwkv_cpp import rwkv_cpp_shared_library
+
+def parse_args():
+    versions = rwkv_cpp_shared_library.FILE_VERSIONS
+
+    parser = argparse.ArgumentParser(description='Rewrite rwkv.cpp model file in another file format version')
+    parser.add_argument('src_path', help='Path to model file in ggml format')
+    parser.add_argument('dest_path', help='Path to resulting model file, will be overwritten')
+    parser.add_argument('--version', help='File format version, one of ' + ', '.join(map(str, versions)), type=int, choices=versions, default=versions[-1])
+    return parser.parse_args()
+
+def main() -> None:
+    args = parse_args()
+
+    library = rwkv_cpp_shared_library.load_rwkv_shared_library()
+
+    library.rwkv_convert_model_file_version(
+        args.src_path,
+        args.dest_path,
+        args.version
+    )
+
+    print('Done')
+
+if __name__ == "__main__":
+    main()
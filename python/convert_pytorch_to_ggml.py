@@ -1,21 +1,139 @@
-# Converts an RWKV model checkpoint in PyTorch format to an rwkv.cpp compatible file.
+# Converts an RWKV model checkpoint in PyTorch or safetensors format to an rwkv.cpp compatible file.
 # Usage: python convert_pytorch_to_ggml.py C:\RWKV-4-Pile-169M-20220807-8023.pth C:\rwkv.cpp-169M-FP16.bin FP16
 # Get model checkpoints from https://huggingface.co/BlinkDL
 # See FILE_FORMAT.md for the documentation on the file format.
-
+#
+# Tensors are read, converted and written one at a time: PyTorch checkpoints are memory-mapped, and safetensors files are read tensor by tensor,
+# so memory usage is bounded by a few copies of the largest tensor instead of the size of the model.
+#
+# If the data type is one of quantized formats, tensors are converted to FP16 and quantized in the same pass, without writing an intermediate file.
+# The result is identical to converting the model to FP16 and then quantizing it with quantize.py. Independent tensors are quantized on a thread pool;
+# this requires the rwkv.cpp shared library.
+
+import os
+import sys
 import argparse
 import struct
+import pickle
+import collections
+import concurrent.futures
 import torch
-from typing import Dict
+from rwkv_cpp import rwkv_cpp_shared_library
+from typing import Deque, Dict, List, Mapping, Iterable, Iterator, Optional, Tuple
+
+# Values of rwkv_type enum in rwkv_file_format.inc, which are written into model files.
+DATA_TYPE_IDS: Dict[str, int] = {
+    'FP32': 0,
+    'FP16': 1,
+    'Q4_0': 2,
+    'Q4_1': 3,
+    'Q5_0': 7,
+    'Q5_1': 8,
+    'Q8_0': 9,
+    'Q4_K': 13,
+    'Q5_K': 14
+}
+
+# Alignment of tensor data in files of version 102, see RWKV_FILE_DATA_ALIGNMENT in rwkv_file_format.inc.
+FILE_DATA_ALIGNMENT: int = 64
 
 def parse_args():
-    parser = argparse.ArgumentParser(description='Convert an RWKV model checkpoint in PyTorch format to an rwkv.cpp compatible file')
-    parser.add_argument('src_path', help='Path to PyTorch checkpoint file')
+    parser = argparse.ArgumentParser(description='Convert an RWKV model checkpoint in PyTorch or safetensors format to an rwkv.cpp compatible file')
+    parser.add_argument('src_path', help='Path to PyTorch checkpoint file, or to .safetensors file')
     parser.add_argument('dest_path', help='Path to rwkv.cpp checkpoint file, will be overwritten')
-    parser.add_argument('data_type', help='Data type, FP16 or FP32', type=str, choices=['FP16', 'FP32', 'float16', 'float32'], default='FP16')
+    parser.add_argument(
+        'data_type',
+        help='Data type, FP16 or FP32; or one of quantized formats, which quantizes the model in the same pass',
+        type=str,
+        choices=['FP16', 'FP32', 'float16', 'float32', *rwkv_cpp_shared_library.QUANTIZED_FORMAT_NAMES],
+        default='FP16'
+    )
+    parser.add_argument('--thread_count', help='Count of threads that quantize tensors, each holding a few copies of a tensor in memory; defaults to CPU count', type=int, default=None)
     return parser.parse_args()
 
-def get_layer_count(state_dict: Dict[str, torch.Tensor]) -> int:
+class SafetensorsStateDict(Mapping[str, torch.Tensor]):
+    """
+    Read-only state dict backed by a safetensors file; each tensor is read from the file when it is accessed.
+    Requires the safetensors package.
+    """
+
+    def __init__(self, path: str) -> None:
+        try:
+            from safetensors import safe_open
+        except ModuleNotFoundError:
+            raise ValueError('safetensors package is required to read .safetensors files, install it with "pip install safetensors"')
+
+        self._file = safe_open(path, framework='pt', device='cpu')
+        self._keys: List[str] = list(self._file.keys())
+        self._key_set = set(self._keys)
+
+    def __getitem__(self, key: str) -> torch.Tensor:
+        if key not in self._key_set:
+            raise KeyError(key)
+
+        return self._file.get_tensor(key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+def load_state_dict(src_path: str) -> Mapping[str, torch.Tensor]:
+    """
+    Opens a checkpoint without reading all of its tensors into memory.
+    """
+
+    if src_path.endswith('.safetensors'):
+        return SafetensorsStateDict(src_path)
+
+    try:
+        return torch.load(src_path, map_location='cpu', mmap=True, weights_only=True)
+    except pickle.UnpicklingError:
+        # Checkpoints with objects other than tensors can not be loaded with weights_only; since PyTorch 2.6, it is the default of torch.load too.
+        print('The checkpoint contains objects other than tensors, reading it into memory with weights_only=False; convert only trusted checkpoints')
+
+        return torch.load(src_path, map_location='cpu', weights_only=False)
+    except (RuntimeError, TypeError) as e:
+        # Only checkpoints in the zip format, used by torch.save since PyTorch 1.6, can be memory-mapped;
+        # PyTorch before 2.1 does not support the mmap argument at all and raises TypeError.
+        print(f'Can not memory-map the checkpoint ({e}), reading it into memory')
+
+        return torch.load(src_path, map_location='cpu')
+
+def get_peak_rss() -> Optional[int]:
+    """
+    Returns peak resident set size of the process in bytes, or None if it is not available on the platform.
+    Pages of a memory-mapped checkpoint are counted too, while they are in the page cache.
+    """
+
+    try:
+        import resource
+    except ModuleNotFoundError:
+        return None
+
+    peak_rss: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Linux reports kilobytes, macOS reports bytes.
+    return peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+
+def get_anonymous_rss() -> Optional[int]:
+    """
+    Returns current anonymous resident memory of the process in bytes, which excludes pages of memory-mapped files;
+    or None if it is not available on the platform.
+    """
+
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('RssAnon:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    return None
+
+def get_layer_count(state_dict: Mapping[str, torch.Tensor]) -> int:
     n_layer: int = 0
 
     while f'blocks.{n_layer}.ln1.weight' in state_dict:
@@ -25,13 +143,118 @@ def get_layer_count(state_dict: Dict[str, torch.Tensor]) -> int:
 
     return n_layer
 
-def write_state_dict(state_dict: Dict[str, torch.Tensor], dest_path: str, data_type: str) -> None:
+def get_tensor_sources(state_dict: Mapping[str, torch.Tensor], is_v7_0: bool) -> List[Tuple[str, List[str]]]:
+    """
+    Returns names of tensors of the rwkv.cpp model in the order of the checkpoint, each with keys of checkpoint tensors it is made of.
+    Does not read any tensor data.
+    """
+
+    # In v7, att.x_[r, w, k, v, a, g] vectors of each layer are concatenated into att.x_rwkvag to reduce some cpu overhead during ggml inference.
+    # It is written in place of the first of these vectors.
+    sources: Dict[str, List[str]] = {}
+
+    for k in state_dict.keys():
+        if is_v7_0 and 'att.x_' in k:
+            l = int(k.split('.')[1].split('.')[0])
+            sources.setdefault(f'blocks.{l}.att.x_rwkvag', []).append(k)
+        else:
+            sources[k] = [k]
+
+    return list(sources.items())
+
+def iterate_tensors(state_dict: Mapping[str, torch.Tensor], is_v7_0: bool) -> Iterator[Tuple[str, torch.Tensor]]:
+    """
+    Yields names and tensors of the rwkv.cpp model in the order of the checkpoint, reading one tensor at a time.
+    """
+
+    for name, keys in get_tensor_sources(state_dict, is_v7_0):
+        if keys == [name]:
+            yield name, state_dict[name]
+        else:
+            yield name, torch.cat([state_dict[key] for key in keys], dim=0)
+
+def convert_tensor(k: str, tensor: torch.Tensor, is_FP16: bool, is_v5_1_or_2: bool, is_v5_2: bool, is_v6_0: bool, is_v7_0: bool, n_head: int) -> torch.Tensor:
+    """
+    Converts a tensor from the checkpoint into the rwkv.cpp representation.
+    Shape changes are views; the tensor is copied only when its values or data type change, so large matrices are copied at most once.
+    """
+
+    if '.time_' in k:
+        tensor = tensor.squeeze()
+
+    if is_v7_0:
+        if any(s in k for s in [
+            '.w1', '.w2',
+            '.a1', '.a2',
+            '.v1', '.v2',
+            '.g1', '.g2',
+        ]):
+            tensor = tensor.transpose(0, 1)
+
+    elif is_v6_0:
+        if '.time_faaaa' in k:
+            tensor = tensor.unsqueeze(-1)
+        if '.time_maa_w1' in k or '.time_decay_w' in k:
+            tensor = tensor.transpose(0, 1)
+        if '.time_maa_w2' in k:
+            tensor = tensor.transpose(1, 2)
+        if '.time_decay' in k and '_w' not in k:
+            tensor = tensor.reshape(n_head, -1, 1)
+
+    elif is_v5_1_or_2:
+        if '.time_decay' in k:
+            if is_v5_2:
+                tensor = torch.exp(-torch.exp(tensor.float())).unsqueeze(-1)
+            else:
+                tensor = torch.exp(-torch.exp(tensor.float())).reshape(-1, 1, 1)
+
+        if '.time_first' in k:
+            tensor = torch.exp(tensor.float()).reshape(-1, 1, 1)
+
+        if '.time_faaaa' in k:
+            tensor = tensor.unsqueeze(-1)
+    else:
+        if '.time_decay' in k:
+            tensor = -torch.exp(tensor.float())
+
+    # Keep 1-dim vectors and small matrices in FP32
+    if is_FP16 and len(tensor.shape) > 1 and all(
+        s not in k for s in [
+            '.time_',
+            '.k_k', '.k_a', '.r_k',
+            '.x_rwkvag', '.x_k',
+            '.w0', '.a0', '.v0',
+        ]
+    ):
+        return tensor.to(torch.float16)
+
+    return tensor.to(torch.float32)
+
+def write_state_dict(
+        state_dict: Mapping[str, torch.Tensor],
+        dest_path: str,
+        data_type: str,
+        library: Optional[rwkv_cpp_shared_library.RWKVSharedLibrary] = None,
+        thread_count: Optional[int] = None
+) -> Optional[int]:
+    """
+    Converts and writes tensors one at a time.
+    If data_type is one of QUANTIZED_FORMAT_NAMES, tensors are converted to FP16 and quantized in the same pass, see write_quantized_tensors.
+
+    Returns
+    -------
+    Optional[int]
+        Peak anonymous resident memory in bytes, sampled after each tensor is written, or None if it is not available on the platform.
+    """
+
     emb_weight: torch.Tensor = state_dict['emb.weight']
 
     n_layer: int = get_layer_count(state_dict)
     n_vocab: int = emb_weight.shape[0]
     n_embed: int = emb_weight.shape[1]
 
+    del emb_weight
+
     is_v5_1_or_2: bool = 'blocks.0.att.ln_x.weight' in state_dict
     is_v5_2: bool = 'blocks.0.att.gate.weight' in state_dict
     is_v6_0: bool = 'blocks.0.att.time_maa_x' in state_dict
@@ -48,124 +271,207 @@ def write_state_dict(state_dict: Dict[str, torch.Tensor], dest_path: str, data_t
     else:
         print('Detected RWKV v4')
 
-    if is_v7_0:
-        # concat to reduce some cpu overhead during ggml inference
-        state_dict_new = {}
-        for k in state_dict.keys():
-            if 'att.x_' in k:
-                l = int(k.split('.')[1].split('.')[0])
-                try:
-                    state_dict_new[f'blocks.{l}.att.x_rwkvag'] = torch.cat(
-                        [state_dict_new[f'blocks.{l}.att.x_rwkvag'], state_dict[k]], dim=0)
-                except KeyError:
-                    state_dict_new[f'blocks.{l}.att.x_rwkvag'] = state_dict[k]
-            else:
-                state_dict_new[k] = state_dict[k]
+    n_head: int = state_dict['blocks.0.att.time_faaaa'].shape[0] if is_v6_0 else 0
 
-        del state_dict[k]
-        state_dict = state_dict_new
+    is_quantized: bool = data_type in rwkv_cpp_shared_library.QUANTIZED_FORMAT_NAMES
+    is_FP16: bool = is_quantized or data_type == 'FP16' or data_type == 'float16'
 
-    with open(dest_path, 'wb') as out_file:
-        is_FP16: bool = data_type == 'FP16' or data_type == 'float16'
+    tensors: Iterator[Tuple[str, torch.Tensor]] = (
+        (k, convert_tensor(k, tensor, is_FP16, is_v5_1_or_2, is_v5_2, is_v6_0, is_v7_0, n_head))
+        for k, tensor in iterate_tensors(state_dict, is_v7_0)
+    )
+
+    header: Tuple[int, int, int] = (n_vocab, n_embed, n_layer)
+    names: List[str] = [name for name, _ in get_tensor_sources(state_dict, is_v7_0)]
+
+    if is_quantized:
+        return write_quantized_tensors(
+            tensors,
+            names,
+            header,
+            dest_path,
+            data_type,
+            library if library is not None else rwkv_cpp_shared_library.load_rwkv_shared_library(),
+            thread_count if thread_count is not None else (os.cpu_count() or 1)
+        )
+
+    return write_tensors(tensors, names, header, dest_path, is_FP16)
+
+def update_peak_anonymous_rss(peak_anonymous_rss: Optional[int]) -> Optional[int]:
+    anonymous_rss: Optional[int] = get_anonymous_rss()
+
+    if anonymous_rss is None:
+        return peak_anonymous_rss
+
+    return max(peak_anonymous_rss or 0, anonymous_rss)
+
+def write_tensors(tensors: Iterable[Tuple[str, torch.Tensor]], names: List[str], header: Tuple[int, int, int], dest_path: str, is_FP16: bool) -> Optional[int]:
+    """
+    Writes converted tensors into a file of version 102, in the same layout as write_quantized_tensors.
+    """
 
+    def records() -> Iterator[Tuple[str, torch.Size, torch.Tensor, str]]:
+        for k, tensor in tensors:
+            yield k, tensor.shape, tensor, 'FP16' if tensor.dtype == torch.float16 else 'FP32'
+
+            # The tensor is released before the next one is read.
+            del tensor
+
+    return write_aligned_tensors(records(), names, header, dest_path, 'FP16' if is_FP16 else 'FP32')
+
+def write_aligned_tensors(
+        records: Iterable[Tuple[str, torch.Size, torch.Tensor, str]],
+        names: List[str],
+        header: Tuple[int, int, int],
+        dest_path: str,
+        file_type_name: str
+) -> Optional[int]:
+    """
+    Writes tensors into a file of version 102, in which tensor data is aligned, so that the model can be memory-mapped without copying.
+    Each record is a tensor name, its shape, its data in row-major order and the name of its data type.
+
+    Since the tensor directory precedes the data, space for it is reserved using tensor names, and it is written after all tensor data.
+    """
+
+    directory_size: int = sum(32 + len(name.encode('utf-8')) for name in names)
+    data_offset: int = 24 + 16 + directory_size
+    directory: List[bytes] = []
+    peak_anonymous_rss: Optional[int] = None
+
+    with open(dest_path, 'wb') as out_file:
         out_file.write(struct.pack(
             # Disable padding with '='
             '=iiiiii',
             # Magic: 'ggmf' in hex
             0x67676d66,
-            101,
-            n_vocab,
-            n_embed,
-            n_layer,
-            1 if is_FP16 else 0
+            102,
+            *header,
+            DATA_TYPE_IDS[file_type_name]
         ))
 
-        if is_v6_0:
-            n_head: int = state_dict['blocks.0.att.time_faaaa'].shape[0]
-        for k in state_dict.keys():
-            tensor: torch.Tensor = state_dict[k].float()
-
-            if '.time_' in k:
-                tensor = tensor.squeeze()
-
-            if is_v7_0:
-                if any(s in k for s in [
-                    '.w1', '.w2',
-                    '.a1', '.a2',
-                    '.v1', '.v2',
-                    '.g1', '.g2',
-                ]):
-                    tensor = tensor.transpose(0, 1)
-
-            elif is_v6_0:
-                if '.time_faaaa' in k:
-                    tensor = tensor.unsqueeze(-1)
-                if '.time_maa_w1' in k or '.time_decay_w' in k:
-                    tensor = tensor.transpose(0, 1)
-                if '.time_maa_w2' in k:
-                    tensor = tensor.transpose(1, 2)
-                if '.time_decay' in k and '_w' not in k:
-                    tensor = tensor.reshape(n_head, -1, 1)
-
-            elif is_v5_1_or_2:
-                if '.time_decay' in k:
-                    if is_v5_2:
-                        tensor = torch.exp(-torch.exp(tensor)).unsqueeze(-1)
-                    else:
-                        tensor = torch.exp(-torch.exp(tensor)).reshape(-1, 1, 1)
-
-                if '.time_first' in k:
-                    tensor = torch.exp(tensor).reshape(-1, 1, 1)
-
-                if '.time_faaaa' in k:
-                    tensor = tensor.unsqueeze(-1)
-            else:
-                if '.time_decay' in k:
-                    tensor = -torch.exp(tensor)
+        out_file.write(struct.pack('=IIQ', FILE_DATA_ALIGNMENT, len(names), directory_size))
 
-            # Keep 1-dim vectors and small matrices in FP32
-            if is_FP16 and len(tensor.shape) > 1 and all(
-                s not in k for s in [
-                    '.time_',
-                    '.k_k', '.k_a', '.r_k',
-                    '.x_rwkvag', '.x_k',
-                    '.w0', '.a0', '.v0',
-                ]
-            ):
-                tensor = tensor.half()
+        # The directory is written in place of these zeros once offsets and sizes of all tensors are known.
+        out_file.write(bytes(directory_size))
 
-            shape = tensor.shape
+        for k, shape, data, type_name in records:
+            print(f'Writing {k}, shape {shape}, type {type_name}')
 
-            print(f'Writing {k}, shape {shape}, type {tensor.dtype}')
+            # Padding aligns the data.
+            padding: int = -data_offset % FILE_DATA_ALIGNMENT
+            out_file.write(bytes(padding))
+            data_offset += padding
 
             k_encoded: bytes = k.encode('utf-8')
 
-            out_file.write(struct.pack(
-                '=iii',
-                len(shape),
-                len(k_encoded),
-                1 if tensor.dtype == torch.float16 else 0
-            ))
-
             # Dimension order is reversed here:
             # * PyTorch shape is (x rows, y columns)
             # * ggml shape is (y elements in a row, x elements in a column)
-            # Both shapes represent the same tensor.
-            for dim in reversed(tensor.shape):
-                out_file.write(struct.pack('=i', dim))
+            # Both shapes represent the same tensor. Sizes of missing dimensions are 1.
+            sizes: List[int] = list(reversed(shape)) + [1] * (3 - len(shape))
+
+            directory.append(struct.pack('=IIIIIIQ', len(shape), len(k_encoded), DATA_TYPE_IDS[type_name], *sizes, data_offset) + k_encoded)
+
+            # Data is written in row-major order, even if the tensor is a transposed view.
+            data.detach().numpy().tofile(out_file)
+            data_offset = out_file.tell()
+
+            peak_anonymous_rss = update_peak_anonymous_rss(peak_anonymous_rss)
+
+            del data
+
+        if [entry[32:].decode('utf-8') for entry in directory] != names:
+            raise ValueError('Written tensors do not match tensor names of the checkpoint')
+
+        out_file.seek(24 + 16)
+        out_file.write(b''.join(directory))
+
+    return peak_anonymous_rss
+
+def quantize_tensor(library: rwkv_cpp_shared_library.RWKVSharedLibrary, format_name: str, tensor: torch.Tensor) -> torch.Tensor:
+    """
+    Quantizes a matrix; runs on a worker thread, since the library releases the GIL while quantizing.
+    FP16 values are converted to FP32 exactly, as rwkv_quantize_model_file does when it reads an FP16 file.
+    """
+
+    data: torch.Tensor = tensor.detach().to(torch.float32).contiguous()
+    row_count, row_length = data.shape
+
+    size: int = library.rwkv_quantize_tensor_data(format_name, None, None, row_count, row_length)
+    quantized: torch.Tensor = torch.empty(size, dtype=torch.uint8)
+
+    library.rwkv_quantize_tensor_data(format_name, data.data_ptr(), quantized.data_ptr(), row_count, row_length)
+
+    return quantized
+
+def write_quantized_tensors(
+        tensors: Iterable[Tuple[str, torch.Tensor]],
+        names: List[str],
+        header: Tuple[int, int, int],
+        dest_path: str,
+        format_name: str,
+        library: rwkv_cpp_shared_library.RWKVSharedLibrary,
+        thread_count: int
+) -> Optional[int]:
+    """
+    Quantizes tensors that rwkv_quantize_model_file would quantize and writes all tensors into a file of version 102,
+    the same file rwkv_quantize_model_file writes from an FP16 file.
 
-            out_file.write(k_encoded)
+    Tensors are converted in order on the calling thread, and quantized on thread_count worker threads.
+    At most thread_count tensors wait to be written, so memory usage is bounded by a few copies of thread_count largest tensors.
+    """
 
-            tensor.detach().numpy().tofile(out_file)
+    if thread_count <= 0:
+        raise ValueError(f'Thread count must be positive, got {thread_count}')
+
+    def records() -> Iterator[Tuple[str, torch.Size, torch.Tensor, str]]:
+        with concurrent.futures.ThreadPoolExecutor(thread_count) as executor:
+            # Tensors in the order of the checkpoint, each with its quantized data, if it is being quantized.
+            pending: Deque[Tuple[str, torch.Tensor, Optional[concurrent.futures.Future]]] = collections.deque()
+
+            def take_first_pending() -> Tuple[str, torch.Size, torch.Tensor, str]:
+                k, tensor, future = pending.popleft()
+
+                if future is None:
+                    return k, tensor.shape, tensor, 'FP16' if tensor.dtype == torch.float16 else 'FP32'
+
+                return k, tensor.shape, future.result(), format_name
+
+            for k, tensor in tensors:
+                future: Optional[concurrent.futures.Future] = None
+
+                if library.rwkv_tensor_needs_quantization(k, len(tensor.shape)):
+                    future = executor.submit(quantize_tensor, library, format_name, tensor)
+
+                pending.append((k, tensor, future))
+
+                # Tensors are written in order; a tensor waits for its quantization while the next ones are being quantized.
+                if len(pending) > thread_count:
+                    yield take_first_pending()
+
+                del tensor
+
+            while len(pending) > 0:
+                yield take_first_pending()
+
+    return write_aligned_tensors(records(), names, header, dest_path, format_name)
 
 def main() -> None:
     args = parse_args()
 
     print(f'Reading {args.src_path}')
 
-    state_dict: Dict[str, torch.Tensor] = torch.load(args.src_path, map_location='cpu')
+    state_dict: Mapping[str, torch.Tensor] = load_state_dict(args.src_path)
+
+    peak_anonymous_rss: Optional[int] = write_state_dict(state_dict, args.dest_path, args.data_type, thread_count=args.thread_count)
+
+    peak_rss: Optional[int] = get_peak_rss()
+
+    if peak_rss is not None:
+        print(f'Peak RSS: {peak_rss / 1024 / 1024:.1f} MB, including pages of the memory-mapped checkpoint, which the OS can reclaim')
 
-    write_state_dict(state_dict, args.dest_path, args.data_type)
+    if peak_anonymous_rss is not None:
+        print(f'Peak anonymous RSS: {peak_anonymous_rss / 1024 / 1024:.1f} MB')
 
     print('Done')
 
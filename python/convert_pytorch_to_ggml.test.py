@@ -1,7 +1,9 @@
 import os
 import struct
+import argparse
 import torch
 import convert_pytorch_to_ggml
+from rwkv_cpp import rwkv_cpp_shared_library
 from typing import Dict
 
 def test() -> None:
@@ -18,33 +20,111 @@ def test() -> None:
         with open(test_file_path, 'rb') as test_file:
             actual_bytes: bytes = test_file.read()
 
+        # Version 102: the tensor directory follows the header, and tensor data is aligned to 64 bytes.
         expected_bytes: bytes = struct.pack(
-            '=iiiiii' + 'iiiii10sffffff' + 'iiii19sf',
+            '=iiiiii' + 'IIQ' + 'IIIIIIQ10s' + 'IIIIIIQ19s',
             0x67676d66,
-            101,
+            102,
             3,
             2,
             1,
             0,
+            64,
+            2,
+            32 + 10 + 32 + 19,
             # emb.weight
             2,
             10,
             0,
-            2, 3,
+            2, 3, 1,
+            192,
             'emb.weight'.encode('utf-8'),
-            1.0, 2.0, 3.0,
-            4.0, 5.0, 6.0,
             # blocks.0.ln1.weight
             1,
             19,
             0,
-            1,
-            'blocks.0.ln1.weight'.encode('utf-8'),
-            1.0
+            1, 1, 1,
+            256,
+            'blocks.0.ln1.weight'.encode('utf-8')
         )
 
+        expected_bytes += bytes(192 - len(expected_bytes)) + struct.pack('=ffffff', 1.0, 2.0, 3.0, 4.0, 5.0, 6.0)
+        expected_bytes += bytes(256 - len(expected_bytes)) + struct.pack('=f', 1.0)
+
         assert list(actual_bytes) == list(expected_bytes), f'\nActual: {list(actual_bytes)}\nExpected: {list(expected_bytes)}'
 
+        # A memory-mapped checkpoint is converted tensor by tensor into the same file; BF16 values are converted without intermediate copies.
+        checkpoint_path: str = test_file_path + '.pth'
+        torch.save({k: v.to(torch.bfloat16) for k, v in state_dict.items()}, checkpoint_path)
+
+        try:
+            convert_pytorch_to_ggml.write_state_dict(convert_pytorch_to_ggml.load_state_dict(checkpoint_path), dest_path=test_file_path, data_type='FP32')
+
+            # PyTorch before 2.1 does not accept the mmap argument; then the checkpoint is read into memory.
+            torch_load = torch.load
+
+            def legacy_torch_load(f, map_location=None):
+                return torch_load(f, map_location=map_location)
+
+            torch.load = legacy_torch_load
+
+            try:
+                loaded_state_dict = convert_pytorch_to_ggml.load_state_dict(checkpoint_path)
+            finally:
+                torch.load = torch_load
+
+            assert all(torch.equal(loaded_state_dict[k], v.to(torch.bfloat16)) for k, v in state_dict.items())
+
+            # Checkpoints with objects other than tensors can not be loaded with weights_only; then they are read into memory too.
+            torch.save({**{k: v.to(torch.bfloat16) for k, v in state_dict.items()}, 'args': argparse.Namespace(n_layer=1)}, checkpoint_path)
+
+            loaded_state_dict = convert_pytorch_to_ggml.load_state_dict(checkpoint_path)
+
+            assert all(torch.equal(loaded_state_dict[k], v.to(torch.bfloat16)) for k, v in state_dict.items())
+            assert loaded_state_dict['args'].n_layer == 1
+        finally:
+            os.remove(checkpoint_path)
+
+        with open(test_file_path, 'rb') as test_file:
+            actual_bytes = test_file.read()
+
+        assert list(actual_bytes) == list(expected_bytes), f'\nActual: {list(actual_bytes)}\nExpected: {list(expected_bytes)}'
+
+        # Quantizing in the same pass gives the same file as converting to FP16 and quantizing it.
+        library: rwkv_cpp_shared_library.RWKVSharedLibrary = rwkv_cpp_shared_library.load_rwkv_shared_library()
+
+        generator: torch.Generator = torch.Generator().manual_seed(42)
+
+        state_dict = {
+            'emb.weight': torch.randn(3, 64, generator=generator),
+            'blocks.0.ln1.weight': torch.randn(64, generator=generator),
+            'blocks.0.att.key.weight': torch.randn(64, 64, generator=generator),
+            'blocks.0.ffn.value.weight': torch.randn(64, 256, generator=generator),
+            'head.weight': torch.randn(3, 64, generator=generator)
+        }
+
+        fp16_file_path: str = test_file_path + '.fp16'
+        quantized_file_path: str = test_file_path + '.q5_1'
+
+        try:
+            convert_pytorch_to_ggml.write_state_dict(state_dict, dest_path=fp16_file_path, data_type='FP16')
+            library.rwkv_quantize_model_file(fp16_file_path, quantized_file_path, 'Q5_1')
+
+            with open(quantized_file_path, 'rb') as quantized_file:
+                expected_bytes = quantized_file.read()
+        finally:
+            for path in [fp16_file_path, quantized_file_path]:
+                if os.path.isfile(path):
+                    os.remove(path)
+
+        for thread_count in [1, 2]:
+            convert_pytorch_to_ggml.write_state_dict(state_dict, dest_path=test_file_path, data_type='Q5_1', library=library, thread_count=thread_count)
+
+            with open(test_file_path, 'rb') as test_file:
+                actual_bytes = test_file.read()
+
+            assert actual_bytes == expected_bytes, f'Quantized files are not identical with {thread_count} threads'
+
         print('All tests pass')
     finally:
         if os.path.isfile(test_file_path):
@@ -49,7 +49,8 @@ prompt_tokens: List[int] = tokenizer_encode(prompt)
 prompt_token_count: int = len(prompt_tokens)
 print(f'{prompt_token_count} tokens in prompt')
 
-init_logits, init_state = model.eval_sequence_in_chunks(prompt_tokens, None, None, None, use_numpy=True)
+# All tokens except the last one are processed once; the last one is processed by each generation, starting from the shared state.
+_, init_state = model.eval_sequence_in_chunks(prompt_tokens[:-1], None, None, None, use_numpy=True) if prompt_token_count > 1 else (None, None)
 
 for GENERATION in range(generation_count):
     print(f'\n--- Generation {GENERATION} ---\n')
@@ -57,14 +58,14 @@ for GENERATION in range(generation_count):
 
     start: float = time.time()
 
-    logits, state = init_logits.copy(), init_state.copy()
-
-    for i in range(tokens_per_generation):
-        token: int = sampling.sample_logits(logits, temperature, top_p)
-
-        print(tokenizer_decode([token]), end='', flush=True)
-
-        logits, state = model.eval(token, state, state, logits, use_numpy=True)
+    for step in model.generate(
+            prompt_tokens[-1:],
+            init_state,
+            max_tokens=tokens_per_generation,
+            sampler=lambda logits: sampling.sample_logits(logits, temperature, top_p),
+            decode=tokenizer_decode
+    ):
+        print(step.text, end='', flush=True)
 
     delay: float = time.time() - start
 
@@ -25,18 +25,16 @@ tokenizer_decode, tokenizer_encode = get_tokenizer(args.tokenizer, model.n_vocab
 prompt: str = """One upon a time,"""
 prompt_tokens: List[int] = tokenizer_encode(prompt)
 
-# Process the prompt.
-logits, state = model.eval_sequence_in_chunks(prompt_tokens, None, None, None, use_numpy=True)
-
 # Generate and print the completion.
 print(prompt, end='')
 
-for i in range(32):
-    token: int = sampling.sample_logits(logits, temperature=0.8, top_p=0.5)
-
-    print(tokenizer_decode([token]), end='', flush=True)
-
-    logits, state = model.eval(token, state, state, logits, use_numpy=True)
+for step in model.generate(
+        prompt_tokens,
+        max_tokens=32,
+        sampler=lambda logits: sampling.sample_logits(logits, temperature=0.8, top_p=0.5),
+        decode=tokenizer_decode
+):
+    print(step.text, end='', flush=True)
 
 # Don't forget to free the memory after you are done working with the model!
 model.free()
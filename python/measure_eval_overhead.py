@@ -0,0 +1,60 @@
+# Measures Python wrapper overhead of token-by-token evaluation: RWKVModel.eval versus RWKVSession.step.
+# Best used with a tiny model, so that native evaluation time does not hide the overhead.
+# Usage: python measure_eval_overhead.py C:\rwkv.cpp-169M.bin
+
+import time
+import argparse
+from rwkv_cpp import rwkv_cpp_shared_library, rwkv_cpp_model
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Measure Python wrapper overhead of token-by-token evaluation')
+    parser.add_argument('model_path', help='Path to model checkpoint file', type=str)
+    parser.add_argument('token_count', help='How many tokens to evaluate in each measurement', nargs='?', type=int, default=2000)
+    parser.add_argument('--use_pytorch', help='Use PyTorch tensors instead of numpy arrays', action='store_true')
+    return parser.parse_args()
+
+args = parse_args()
+
+library: rwkv_cpp_shared_library.RWKVSharedLibrary = rwkv_cpp_shared_library.load_rwkv_shared_library()
+
+print('Loading model')
+model: rwkv_cpp_model.RWKVModel = rwkv_cpp_model.RWKVModel(library, args.model_path, thread_count=1)
+
+use_numpy: bool = not args.use_pytorch
+tokens = [i % model.n_vocab for i in range(args.token_count)]
+
+def measure_eval() -> float:
+    logits, state = model.eval(tokens[0], None, use_numpy=use_numpy)
+
+    start: float = time.perf_counter()
+
+    for token in tokens:
+        logits, state = model.eval(token, state, state, logits)
+
+    return (time.perf_counter() - start) / len(tokens)
+
+def measure_session() -> float:
+    session: rwkv_cpp_model.RWKVSession = model.create_session(use_numpy=use_numpy)
+    session.step(tokens[0])
+
+    step = session.step
+
+    start: float = time.perf_counter()
+
+    for token in tokens:
+        step(token)
+
+    return (time.perf_counter() - start) / len(tokens)
+
+# Warm up.
+measure_eval()
+measure_session()
+
+eval_time: float = min(measure_eval() for _ in range(3))
+session_time: float = min(measure_session() for _ in range(3))
+
+print(f'RWKVModel.eval:   {eval_time * 1e6:.1f} us per token')
+print(f'RWKVSession.step: {session_time * 1e6:.1f} us per token')
+print(f'Wrapper overhead removed: {(eval_time - session_time) * 1e6:.1f} us per token ({100.0 * (eval_time - session_time) / eval_time:.1f}%)')
+
+model.free()
@@ -1,109 +1,131 @@
-# Measures perplexity and per-token latency of an RWKV model on a given text file.
+# Measures perplexity and throughput of an RWKV model on given text files.
 # Perplexity is defined here as exp() of average cross-entropy loss.
-# Usage: python measure_pexplexity.py C:\rwkv.cpp-169M.bin C:\text.txt 1024
+# Documents are ingested with the sequence graph and evaluated concurrently on cloned contexts; the report is printed as JSON.
+# Usage: python measure_pexplexity.py C:\rwkv.cpp-169M.bin C:\text1.txt C:\text2.txt --ignore_first_n_tokens 1024
 
 import os
+import sys
+import json
+import math
 import time
 import argparse
-# TODO Get rid of this PyTorch dependency by writing a cross_entropy impl for numpy
-import torch
-from rwkv_cpp import rwkv_cpp_shared_library, rwkv_cpp_model
-from tokenizer_util import add_tokenizer_argument, get_tokenizer
-from typing import List
+import multiprocessing
+import numpy as np
+from rwkv_cpp import rwkv_cpp_shared_library, rwkv_cpp_model, rwkv_cpp_context_pool
+from tokenizer_util import get_tokenizer
+from typing import List, Dict, Any
 
 def parse_args():
-    parser = argparse.ArgumentParser(description='Measure perplexity and per-token latency of an RWKV model on a given text file')
+    parser = argparse.ArgumentParser(description='Measure perplexity and throughput of an RWKV model on given text files')
     parser.add_argument('model_path', help='Path to model checkpoint file', type=str)
-    parser.add_argument('text_path', help='Path to text file in UTF-8 encoding', type=str)
-    parser.add_argument('ignore_first_n_tokens', help='How many tokens should be skipped before loss is measured', type=int)
-    parser.add_argument('token_limit', help='How many tokens to process; set to -1 to process all text', nargs='?', type=int, default=-1)
-    add_tokenizer_argument(parser)
+    parser.add_argument('text_paths', help='Paths to text files in UTF-8 encoding; each file is evaluated as a separate document', type=str, nargs='+')
+    parser.add_argument('--ignore_first_n_tokens', help='How many tokens of each document should be skipped before loss is measured', type=int, default=0)
+    parser.add_argument('--token_limit', help='How many tokens of each document to process; set to -1 to process all text', type=int, default=-1)
+    parser.add_argument('--tokenizer', help='Tokenizer to use; supported tokenizers: auto (guess from n_vocab), 20B, world', type=str, default='auto')
+    parser.add_argument('--chunk_size', help='Count of tokens evaluated in one sequence graph execution', type=int, default=16)
+    parser.add_argument('--workers', help='Count of documents evaluated concurrently', type=int, default=max(1, multiprocessing.cpu_count() // 2))
+    parser.add_argument('--thread_count', help='Thread count of each worker', type=int, default=1)
+    parser.add_argument('--output', help='Path to a file to write the JSON report to, in addition to stdout', type=str, default=None)
     return parser.parse_args()
 
-args = parse_args()
+def evaluate_document(model: rwkv_cpp_model.RWKVModel, tokens: np.ndarray, chunk_size: int) -> Dict[str, Any]:
+    """
+    Returns log-probability of each token of the document, except the first one, and evaluation duration in seconds.
+    """
 
-print('Loading model')
-model: rwkv_cpp_model.RWKVModel = rwkv_cpp_model.RWKVModel(
-    rwkv_cpp_shared_library.load_rwkv_shared_library(),
-    args.model_path
-)
+    start: float = time.perf_counter()
 
-print('Loading text')
-text: str = open(args.text_path, encoding='utf-8').read()
+    logprobs, _, _ = model.eval_sequence_logprobs_in_chunks(tokens[:-1], tokens[1:], None, chunk_size=chunk_size, use_numpy=True)
 
-_, tokenizer_encode = get_tokenizer(args.tokenizer, model.n_vocab)
+    return {'logprobs': logprobs, 'duration': time.perf_counter() - start}
 
-tokens: List[int] = tokenizer_encode(text)
+def format_result(token_count: int, losses: np.ndarray, duration: float) -> Dict[str, Any]:
+    loss: float = float(losses.astype(np.float64).mean())
 
-token_count: int = len(tokens)
-print(f'{token_count} tokens in the text')
+    return {
+        'tokens': token_count,
+        'scored_tokens': int(losses.size),
+        'loss': round(loss, 6),
+        'perplexity': round(math.exp(loss), 6),
+        'tokens_per_second': round(token_count / duration, 3),
+        'ms_per_token': round(duration * 1000 / token_count, 6),
+        'duration_seconds': round(duration, 6)
+    }
 
-token_limit: int = args.token_limit
+args = parse_args()
 
-if not (token_limit == -1 or token_limit > 0):
+if not (args.token_limit == -1 or args.token_limit > 0):
     raise ValueError('Invalid token_limit')
 
-if token_limit != -1 and token_count > token_limit:
-    tokens = tokens[0:token_limit]
-    token_count = token_limit
-    print(f'Text was limited to {token_limit} tokens')
+if not (args.chunk_size > 0):
+    raise ValueError('Chunk size must be > 0')
+
+if not (args.workers > 0):
+    raise ValueError('Worker count must be > 0')
+
+print('Loading model', file=sys.stderr)
+model: rwkv_cpp_model.RWKVModel = rwkv_cpp_model.RWKVModel(
+    rwkv_cpp_shared_library.load_rwkv_shared_library(),
+    args.model_path,
+    thread_count=args.thread_count
+)
+
+_, tokenizer_encode = get_tokenizer(args.tokenizer, model.n_vocab)
+
+documents: List[np.ndarray] = []
 
-if not (token_count - args.ignore_first_n_tokens > 1):
-    raise ValueError('Need at least 2 tokens for evaluation')
+for text_path in args.text_paths:
+    print(f'Loading {text_path}', file=sys.stderr)
 
-# ---
+    with open(text_path, encoding='utf-8') as f:
+        tokens: List[int] = tokenizer_encode(f.read())
 
-def format_loss(loss: torch.Tensor) -> str:
-    return str(['%.3f' % (loss[i].item(),) for i in range(len(loss))]).replace('\'', '')[1:-1]
+    if args.token_limit != -1 and len(tokens) > args.token_limit:
+        tokens = tokens[0:args.token_limit]
 
-def format_loss_with_perplexity(loss: torch.Tensor) -> str:
-    return f'loss [{format_loss(loss)}], perplexity {"%.3f" % (torch.exp(loss[0]).item(),)}'
+    if not (len(tokens) - args.ignore_first_n_tokens > 1):
+        raise ValueError(f'Need at least 2 tokens for evaluation in {text_path}')
 
-# ---
+    documents.append(np.array(tokens, dtype=np.uint32))
 
-logits, state = None, None
+print(f'Evaluating {len(documents)} documents with {sum(len(tokens) for tokens in documents)} tokens using {args.workers} workers', file=sys.stderr)
 
-loss_sum: torch.Tensor = torch.tensor([0.0])
-loss_count: int = 0
+start: float = time.perf_counter()
 
-start: float = time.time()
+with rwkv_cpp_context_pool.RWKVContextPool(model, args.workers, args.thread_count) as pool:
+    results: List[Dict[str, Any]] = list(pool.map(lambda m, tokens: evaluate_document(m, tokens, args.chunk_size), documents))
 
-run_count: int = token_count - 1
+duration: float = time.perf_counter() - start
 
-for i in range(run_count):
-    token: int = tokens[i]
-    target: int = tokens[i + 1]
+# Loss for a position is counted if the target token is not among the first ignored tokens.
+first_scored: int = max(0, args.ignore_first_n_tokens - 1)
 
-    logits, state = model.eval(token, state, state, logits)
+files: Dict[str, Any] = {}
+all_losses: List[np.ndarray] = []
 
-    if args.ignore_first_n_tokens == 0 or i + 1 >= args.ignore_first_n_tokens:
-        losses = torch.tensor([
-            torch.nn.functional.cross_entropy(logits, torch.tensor(target, dtype=torch.long), reduction='none').item()
-        ])
+for text_path, tokens, result in zip(args.text_paths, documents, results):
+    losses: np.ndarray = -result['logprobs'][first_scored:]
+    all_losses.append(losses)
 
-        loss_sum += losses
-        loss_count += 1
+    files[text_path] = format_result(len(tokens) - 1, losses, result['duration'])
 
-    if run_count <= 5 or i % (run_count // 10) == 0:
-        avg_loss_so_far = loss_sum / loss_count
+report: Dict[str, Any] = {
+    'model': os.path.basename(args.model_path),
+    'chunk_size': args.chunk_size,
+    'workers': args.workers,
+    'thread_count': args.thread_count,
+    'ignore_first_n_tokens': args.ignore_first_n_tokens,
+    'files': files,
+    # Throughput is measured over wall time of all concurrently evaluated documents.
+    'overall': format_result(sum(len(tokens) - 1 for tokens in documents), np.concatenate(all_losses), duration)
+}
 
-        duration: float = time.time() - start
-        duration_per_token: float = duration / (i + 1)
-        runs_remaining: int = run_count - i - 1
-        duration_remaining: int = int(runs_remaining * duration_per_token)
+report_json: str = json.dumps(report, indent=2)
 
-        print(f'Token #{i}/{token_count}, '
-              f'{int(100.0 * i / token_count)}%, '
-              f'ETA {duration_remaining // 60} m {duration_remaining % 60} s', end='')
+print(report_json)
 
-        if loss_count > 0:
-            print(f', averages so far: {format_loss_with_perplexity(avg_loss_so_far)}')
-        else:
-            print()
+if args.output is not None:
+    with open(args.output, 'w', encoding='utf-8') as f:
+        f.write(report_json)
 
-print()
-print(f'Model: {os.path.basename(args.model_path)}, '
-      f'data: {os.path.basename(args.text_path)} with {token_count} tokens, '
-      f'skipped {args.ignore_first_n_tokens} tokens, '
-      f'averages: {format_loss_with_perplexity(loss_sum / loss_count)}, '
-      f'latency {int((time.time() - start) * 1000 / run_count)} ms per token')
+model.free()
@@ -0,0 +1,59 @@
+# Measures per-token cost of sampling with sample_logits and sample_logits_batch on random logits.
+# Usage: python measure_sampling.py --n_vocab 65536 --batch_sizes 1 8 32
+
+import time
+import argparse
+import numpy as np
+import sampling
+from typing import Callable
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Measure per-token cost of sampling')
+    parser.add_argument('--n_vocab', help='Vocabulary size', type=int, default=65536)
+    parser.add_argument('--batch_sizes', help='Batch sizes for sample_logits_batch', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--temperature', help='Sampling temperature', type=float, default=0.8)
+    parser.add_argument('--top_p', help='Top-p threshold', type=float, default=0.5)
+    parser.add_argument('--iterations', help='Count of sampled tokens per measurement', type=int, default=256)
+    return parser.parse_args()
+
+def measure(fn: Callable[[], None], token_count: int, iterations: int) -> float:
+    """
+    Returns the best of several runs, in microseconds per token.
+    """
+
+    best: float = float('inf')
+
+    for _ in range(3):
+        start: float = time.perf_counter()
+
+        for _ in range(iterations):
+            fn()
+
+        best = min(best, (time.perf_counter() - start) / (iterations * token_count))
+
+    return best * 1_000_000
+
+args = parse_args()
+
+rng: np.random.Generator = np.random.default_rng(0)
+
+# Real logits are peaked; scaled normal noise gives a similar nucleus size.
+logits: np.ndarray = (rng.standard_normal((max(args.batch_sizes), args.n_vocab)) * 4).astype(np.float32)
+
+print(f'n_vocab = {args.n_vocab}, temperature = {args.temperature}, top_p = {args.top_p}')
+
+# sample_logits modifies its input, so it receives a copy; copying is included in the measurement.
+baseline: float = measure(lambda: sampling.sample_logits(logits[0].copy(), args.temperature, args.top_p), 1, args.iterations)
+print(f'sample_logits:                  {baseline:10.1f} us/token')
+
+for batch_size in args.batch_sizes:
+    batch: np.ndarray = logits[:batch_size]
+    generators = sampling.make_generators(range(batch_size))
+
+    cost: float = measure(
+        lambda: sampling.sample_logits_batch(batch, args.temperature, args.top_p, rng=generators),
+        batch_size,
+        max(1, args.iterations // batch_size)
+    )
+
+    print(f'sample_logits_batch, B = {batch_size:3}: {cost:10.1f} us/token, {baseline / cost:5.1f}x')
@@ -0,0 +1,72 @@
+# Measures speed of speculative decoding against decoding with the target model alone.
+# With a draft model, RWKVSpeculativeDecoder is measured; without it, RWKVPromptLookupDecoder is measured.
+# Usage: python measure_speculative_decoding.py C:\rwkv.cpp-7B.bin C:\rwkv.cpp-169M.bin --draft_lengths 2 4 8
+#        python measure_speculative_decoding.py C:\rwkv.cpp-7B.bin --prompt_path C:\article.txt
+
+import time
+import argparse
+from rwkv_cpp import rwkv_cpp_shared_library, rwkv_cpp_model, rwkv_cpp_speculative
+from tokenizer_util import get_tokenizer
+from typing import List, Optional
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Measure speed of speculative decoding')
+    parser.add_argument('target_path', help='Path to target model checkpoint file', type=str)
+    parser.add_argument('draft_path', help='Path to draft model checkpoint file; if not set, prompt lookup decoding is measured', nargs='?', type=str, default=None)
+    parser.add_argument('--draft_lengths', help='Counts of drafted tokens per round to measure', type=int, nargs='+', default=[2, 4, 8])
+    parser.add_argument('--max_tokens', help='Count of tokens to generate', type=int, default=128)
+    parser.add_argument('--temperature', help='Sampling temperature; 0 is greedy decoding', type=float, default=0.0)
+    parser.add_argument('--prompt', help='Prompt text', type=str, default='\nIn a shocking finding, scientist discovered a herd of dragons living in a remote, previously unexplored valley, in Tibet.')
+    parser.add_argument('--prompt_path', help='Path to prompt text file in UTF-8 encoding; overrides --prompt', type=str, default=None)
+    parser.add_argument('--tokenizer', help='Tokenizer to use; supported tokenizers: auto (guess from n_vocab), 20B, world', type=str, default='auto')
+    return parser.parse_args()
+
+args = parse_args()
+
+library: rwkv_cpp_shared_library.RWKVSharedLibrary = rwkv_cpp_shared_library.load_rwkv_shared_library()
+
+print('Loading models')
+target: rwkv_cpp_model.RWKVModel = rwkv_cpp_model.RWKVModel(library, args.target_path)
+draft: Optional[rwkv_cpp_model.RWKVModel] = None if args.draft_path is None else rwkv_cpp_model.RWKVModel(library, args.draft_path)
+
+_, tokenizer_encode = get_tokenizer(args.tokenizer, target.n_vocab)
+
+if args.prompt_path is not None:
+    with open(args.prompt_path, 'r', encoding='utf-8') as prompt_file:
+        args.prompt = prompt_file.read()
+
+prompt_tokens: List[int] = tokenizer_encode(args.prompt)
+
+# The baseline is decoding with the target model alone, with prompt processing excluded like in speculative decoding stats.
+session: rwkv_cpp_model.RWKVSession = target.create_session(use_numpy=True)
+session.feed(prompt_tokens)
+
+start: float = time.perf_counter()
+
+for _ in target.generate([], max_tokens=args.max_tokens, session=session):
+    pass
+
+baseline: float = args.max_tokens / (time.perf_counter() - start)
+
+print(f'Target only:       {baseline:8.2f} tokens/s')
+
+for draft_length in args.draft_lengths:
+    if draft is None:
+        decoder = rwkv_cpp_speculative.RWKVPromptLookupDecoder(target, draft_length, temperature=args.temperature, seed=0)
+    else:
+        decoder = rwkv_cpp_speculative.RWKVSpeculativeDecoder(target, draft, draft_length, args.temperature, seed=0)
+
+    for _ in decoder.generate(prompt_tokens, max_tokens=args.max_tokens):
+        pass
+
+    stats = decoder.get_stats()
+
+    print(
+        f'Draft length {draft_length:4}: {stats["tokens_per_second"]:8.2f} tokens/s, {stats["tokens_per_second"] / baseline:5.2f}x, '
+        f'accept rate {stats["accept_rate"]:.3f}, {stats["tokens_per_round"]:.2f} tokens per target call'
+    )
+
+target.free()
+
+if draft is not None:
+    draft.free()
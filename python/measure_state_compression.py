@@ -0,0 +1,93 @@
+# Measures the effect of lossy state formats on perplexity of an RWKV model.
+# The text is evaluated in chunks; after each chunk, the state is encoded and decoded, as if the session was saved and restored.
+# Usage: python measure_state_compression.py C:\rwkv.cpp-169M.bin C:\text.txt --chunk_size 16
+
+import os
+import sys
+import json
+import math
+import argparse
+import numpy as np
+from rwkv_cpp import rwkv_cpp_shared_library, rwkv_cpp_model, rwkv_cpp_state_store
+from tokenizer_util import get_tokenizer
+from typing import List, Dict, Any
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Measure the effect of lossy state formats on perplexity of an RWKV model')
+    parser.add_argument('model_path', help='Path to model checkpoint file', type=str)
+    parser.add_argument('text_path', help='Path to text file in UTF-8 encoding', type=str)
+    parser.add_argument('--token_limit', help='How many tokens to process; set to -1 to process all text', type=int, default=-1)
+    parser.add_argument('--tokenizer', help='Tokenizer to use; supported tokenizers: auto (guess from n_vocab), 20B, world', type=str, default='auto')
+    parser.add_argument('--chunk_size', help='Count of tokens evaluated between state round-trips', type=int, default=16)
+    return parser.parse_args()
+
+def measure_loss(model: rwkv_cpp_model.RWKVModel, tokens: np.ndarray, codec: rwkv_cpp_state_store.RWKVStateCodec, chunk_size: int) -> float:
+    run_count: int = len(tokens) - 1
+    logprobs: np.ndarray = np.zeros(run_count, dtype=np.float32)
+    state = None
+
+    for offset in range(0, run_count, chunk_size):
+        length: int = min(chunk_size, run_count - offset)
+
+        _, _, state = model.eval_sequence_logprobs(
+            tokens[offset:offset + length],
+            tokens[offset + 1:offset + length + 1],
+            state,
+            state_out=state,
+            logprobs_out=logprobs[offset:offset + length]
+        )
+
+        codec.decode(codec.encode(state), state)
+
+    return float(-logprobs.astype(np.float64).mean())
+
+args = parse_args()
+
+if not (args.chunk_size > 0):
+    raise ValueError('Chunk size must be > 0')
+
+print('Loading model', file=sys.stderr)
+model: rwkv_cpp_model.RWKVModel = rwkv_cpp_model.RWKVModel(rwkv_cpp_shared_library.load_rwkv_shared_library(), args.model_path)
+
+_, tokenizer_encode = get_tokenizer(args.tokenizer, model.n_vocab)
+
+with open(args.text_path, encoding='utf-8') as f:
+    token_list: List[int] = tokenizer_encode(f.read())
+
+if args.token_limit != -1:
+    token_list = token_list[0:args.token_limit]
+
+if not (len(token_list) > 1):
+    raise ValueError('Need at least 2 tokens for evaluation')
+
+tokens: np.ndarray = np.array(token_list, dtype=np.uint32)
+
+formats: Dict[str, Any] = {}
+reference_loss: float = 0.0
+
+for state_format in rwkv_cpp_state_store.STATE_FORMATS:
+    print(f'Evaluating with {state_format} state', file=sys.stderr)
+
+    codec: rwkv_cpp_state_store.RWKVStateCodec = rwkv_cpp_state_store.RWKVStateCodec(model, state_format)
+
+    loss: float = measure_loss(model, tokens, codec, args.chunk_size)
+
+    # FP32 round-trip is lossless and serves as the reference.
+    if state_format == rwkv_cpp_state_store.STATE_FORMAT_FP32:
+        reference_loss = loss
+
+    formats[state_format] = {
+        'encoded_bytes': codec.encoded_size,
+        'loss': round(loss, 6),
+        'perplexity': round(math.exp(loss), 6),
+        'perplexity_change_percent': round((math.exp(loss - reference_loss) - 1) * 100, 6)
+    }
+
+print(json.dumps({
+    'model': os.path.basename(args.model_path),
+    'tokens': len(tokens),
+    'chunk_size': args.chunk_size,
+    'formats': formats
+}, indent=2))
+
+model.free()
@@ -0,0 +1,75 @@
+# Measures encoding throughput of the World tokenizer, in MB/s, for inputs of different sizes.
+# With --reference, the original pointer-based trie is measured too, and outputs are compared.
+# Usage: python measure_tokenizer_speed.py C:\text.txt --sizes 64 4096 1048576 --reference
+
+import time
+import pathlib
+import argparse
+from rwkv_cpp import rwkv_world_tokenizer
+from typing import List, Callable
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Measure encoding throughput of the World tokenizer')
+    parser.add_argument('text_path', help='Path to text file in UTF-8 encoding; it is repeated or truncated to each size', type=str)
+    parser.add_argument('--sizes', help='Input sizes in bytes', type=int, nargs='+', default=[64, 1024, 4096, 65536, 1048576])
+    parser.add_argument('--reference', help='Also measure the reference trie and compare outputs', action='store_true')
+    return parser.parse_args()
+
+def measure(fn: Callable[[bytes], List[int]], src: bytes) -> float:
+    """
+    Returns the best of several runs, in MB/s.
+    """
+
+    iterations: int = max(1, 1_000_000 // len(src))
+    best: float = float('inf')
+
+    for _ in range(3):
+        start: float = time.perf_counter()
+
+        for _ in range(iterations):
+            fn(src)
+
+        best = min(best, (time.perf_counter() - start) / iterations)
+
+    return len(src) / best / 1_000_000
+
+args = parse_args()
+
+with open(args.text_path, 'rb') as f:
+    text: bytes = f.read()
+
+start: float = time.perf_counter()
+tokenizer: rwkv_world_tokenizer.WorldTokenizer = rwkv_world_tokenizer.WorldTokenizer(pathlib.Path(rwkv_world_tokenizer.__file__).parent / 'rwkv_vocab_v20230424.txt')
+print(f'Tokenizer loaded in {time.perf_counter() - start:.2f} s')
+
+reference_encode = None
+
+if args.reference:
+    reference_trie: rwkv_world_tokenizer.Trie = rwkv_world_tokenizer.Trie()
+
+    for token_bytes, token in tokenizer.token_to_index.items():
+        reference_trie.add(token_bytes, val=(token_bytes, token))
+
+    def reference_encode(src: bytes) -> List[int]:
+        idx: int = 0
+        tokens: List[int] = []
+
+        while idx < len(src):
+            idx, _, values = reference_trie.find_longest(src, idx)
+            tokens.append(next(iter(values))[1])
+
+        return tokens
+
+for size in args.sizes:
+    src: bytes = (text * (size // len(text) + 1))[:size]
+
+    throughput: float = measure(tokenizer.encode_bytes, src)
+    line: str = f'{size:10} bytes: {throughput:8.2f} MB/s'
+
+    if reference_encode is not None:
+        assert tokenizer.encode_bytes(src) == reference_encode(src), f'Output differs from the reference for size {size}'
+
+        reference_throughput: float = measure(reference_encode, src)
+        line += f', reference {reference_throughput:8.2f} MB/s, {throughput / reference_throughput:5.2f}x'
+
+    print(line)
@@ -62,6 +62,8 @@ def main() -> None:
 
         if header[0] != 0x67676d66:
             raise ValueError(f'Invalid magic value {header[0]:x}')
+        if header[1] == 102:
+            raise ValueError('File version 102 is not supported, convert the model to version 101 with convert_model_file_version.py first')
         if not (100 <= header[1] <= 101):
             raise ValueError(f'Invalid version number {header[1]}')
         if not (header[5] == 0 or header[5] == 1):
@@ -0,0 +1,325 @@
+import asyncio
+import functools
+import contextlib
+import concurrent.futures
+
+# I'm sure this is not strictly correct, but let's keep this crutch for now.
+try:
+    import rwkv_cpp_model
+    import rwkv_cpp_shared_library
+except ModuleNotFoundError:
+    from . import rwkv_cpp_model
+    from . import rwkv_cpp_shared_library
+
+from typing import TypeVar, Optional, Tuple, List, Callable, Iterable, Iterator, AsyncIterator
+
+NumpyArrayOrPyTorchTensor = rwkv_cpp_model.NumpyArrayOrPyTorchTensor
+
+T = TypeVar('T')
+
+class _Worker:
+    """
+    A cloned context together with the single thread that runs all native calls on it.
+    """
+
+    def __init__(self, model: rwkv_cpp_model.RWKVModel) -> None:
+        self.model: rwkv_cpp_model.RWKVModel = model
+        self.executor: concurrent.futures.ThreadPoolExecutor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        # The native call that is submitted to the executor and not yet completed, if any.
+        self.running: Optional[asyncio.Future] = None
+
+class AsyncRWKVModel:
+    """
+    An asyncio front-end for RWKVModel, which does not block the event loop while the model is evaluated.
+
+    The model's context is cloned once per worker; each clone is used by its own dedicated thread, and all clones share model weights.
+    A request waits asynchronously until a worker is free, which limits the count of concurrent native calls to the worker count
+    and applies backpressure to callers without spawning a thread per request.
+
+    Long sequences are evaluated chunk by chunk, and the worker is returned to the pool between requests only.
+    When a task is cancelled, the chunk that is already running completes, but the next chunk is not started.
+
+    Usage:
+
+    async with AsyncRWKVModel(model, size=4) as async_model:
+        logits, state = await async_model.eval_sequence_in_chunks(prompt_tokens, None, use_numpy=True)
+
+        async for step in async_model.generate(prompt_tokens, decode=tokenizer_decode):
+            await connection.send(step.text)
+    """
+
+    def __init__(
+            self,
+            model: rwkv_cpp_model.RWKVModel,
+            size: int = 1,
+            thread_count_per_context: int = 1
+    ) -> None:
+        """
+        Creates workers by cloning the context of the model.
+        In case of any error, this method will throw an exception.
+
+        Parameters
+        ----------
+        model : RWKVModel
+            Model to clone. It is not used by this object itself and may be freed independently.
+        size : int
+            Count of workers, which is also the max count of concurrently evaluated requests. Must be positive.
+        thread_count_per_context : int
+            Thread count for each cloned context, must be positive.
+            Total thread count used is size * thread_count_per_context; it should not exceed the CPU count.
+        """
+
+        if not (size > 0):
+            raise ValueError('Worker count must be > 0')
+
+        if not (thread_count_per_context > 0):
+            raise ValueError('Thread count must be > 0')
+
+        self._workers: List[_Worker] = []
+
+        try:
+            for _ in range(size):
+                self._workers.append(_Worker(model.clone(thread_count_per_context)))
+        except Exception:
+            for worker in self._workers:
+                worker.executor.shutdown(wait=False)
+                worker.model.free()
+
+            raise
+
+        self._available: asyncio.Queue = asyncio.Queue()
+
+        for worker in self._workers:
+            self._available.put_nowait(worker)
+
+        self._valid: bool = True
+
+    @property
+    def size(self) -> int:
+        return len(self._workers)
+
+    @property
+    def n_vocab(self) -> int:
+        return self._workers[0].model.n_vocab
+
+    @property
+    def n_embed(self) -> int:
+        return self._workers[0].model.n_embed
+
+    @property
+    def n_layer(self) -> int:
+        return self._workers[0].model.n_layer
+
+    @contextlib.asynccontextmanager
+    async def _acquire(self) -> AsyncIterator[_Worker]:
+        if not self._valid:
+            raise ValueError('Model was closed')
+
+        worker: _Worker = await self._available.get()
+
+        try:
+            yield worker
+        finally:
+            # When a request is cancelled, the worker may still be running its native call;
+            # then it is returned to the queue only when the call completes.
+            if worker.running is not None and not worker.running.done():
+                worker.running.add_done_callback(lambda _: self._available.put_nowait(worker))
+            else:
+                self._available.put_nowait(worker)
+
+    async def _run(self, worker: _Worker, fn: Callable[..., T], *args, **kwargs) -> T:
+        """
+        Runs fn(*args, **kwargs) on the thread of the worker.
+        If the awaiting task is cancelled, the call still runs to completion, and the worker stays busy until then.
+        """
+
+        future: asyncio.Future = asyncio.get_running_loop().run_in_executor(worker.executor, functools.partial(fn, *args, **kwargs))
+
+        worker.running = future
+
+        try:
+            return await asyncio.shield(future)
+        finally:
+            if future.done():
+                worker.running = None
+
+    async def eval(
+            self,
+            token: int,
+            state_in: Optional[NumpyArrayOrPyTorchTensor],
+            state_out: Optional[NumpyArrayOrPyTorchTensor] = None,
+            logits_out: Optional[NumpyArrayOrPyTorchTensor] = None,
+            use_numpy: bool = False
+    ) -> Tuple[NumpyArrayOrPyTorchTensor, NumpyArrayOrPyTorchTensor]:
+        """
+        Like `RWKVModel.eval`, but runs on a worker thread.
+
+        Returns
+        -------
+        logits, state
+        """
+
+        async with self._acquire() as worker:
+            return await self._run(worker, worker.model.eval, token, state_in, state_out, logits_out, use_numpy)
+
+    async def eval_sequence(
+            self,
+            tokens: rwkv_cpp_shared_library.Tokens,
+            state_in: Optional[NumpyArrayOrPyTorchTensor],
+            state_out: Optional[NumpyArrayOrPyTorchTensor] = None,
+            logits_out: Optional[NumpyArrayOrPyTorchTensor] = None,
+            use_numpy: bool = False
+    ) -> Tuple[NumpyArrayOrPyTorchTensor, NumpyArrayOrPyTorchTensor]:
+        """
+        Like `RWKVModel.eval_sequence`, but runs on a worker thread. The sequence is evaluated in a single native call.
+
+        Returns
+        -------
+        logits, state
+        """
+
+        async with self._acquire() as worker:
+            return await self._run(worker, worker.model.eval_sequence, tokens, state_in, state_out, logits_out, use_numpy)
+
+    async def eval_sequence_in_chunks(
+            self,
+            tokens: rwkv_cpp_shared_library.Tokens,
+            state_in: Optional[NumpyArrayOrPyTorchTensor],
+            state_out: Optional[NumpyArrayOrPyTorchTensor] = None,
+            logits_out: Optional[NumpyArrayOrPyTorchTensor] = None,
+            chunk_size: int = 16,
+            use_numpy: bool = False
+    ) -> Tuple[NumpyArrayOrPyTorchTensor, NumpyArrayOrPyTorchTensor]:
+        """
+        Like `RWKVModel.eval_sequence_in_chunks`, but runs on a worker thread, one native call per chunk.
+        The event loop is free between chunks, and cancellation takes effect before the next chunk.
+        On cancellation, state_out contains the state after some prefix of the sequence.
+
+        Returns
+        -------
+        logits, state
+        """
+
+        if not (chunk_size > 0):
+            raise ValueError('Chunk size must be > 0')
+
+        if len(tokens) == 0:
+            raise ValueError('Sequence must not be empty')
+
+        async with self._acquire() as worker:
+            for offset in range(0, len(tokens), chunk_size):
+                # The last chunk may be shorter; it is evaluated in one pass.
+                logits_out, state_out = await self._run(
+                    worker,
+                    worker.model.eval_sequence_in_chunks,
+                    tokens[offset:offset + chunk_size],
+                    state_in if offset == 0 else state_out,
+                    state_out,
+                    logits_out,
+                    chunk_size,
+                    use_numpy
+                )
+
+            return logits_out, state_out
+
+    async def generate(
+            self,
+            prompt_tokens: rwkv_cpp_shared_library.Tokens,
+            state_in: Optional[NumpyArrayOrPyTorchTensor] = None,
+            max_tokens: int = 256,
+            sampler: Optional[Callable[[NumpyArrayOrPyTorchTensor], int]] = None,
+            stop_tokens: Iterable[int] = (),
+            stop_strings: Iterable[str] = (),
+            decode: Optional[Callable[[List[int]], str]] = None,
+            chunk_size: int = 16,
+            decode_bytes: Optional[Callable[[List[int]], bytes]] = None
+    ) -> AsyncIterator[rwkv_cpp_model.RWKVGenerationStep]:
+        """
+        Like `RWKVModel.generate`, but as an async iterator. The prompt is processed chunk by chunk, and each token is
+        generated and sampled on a worker thread only when the consumer asks for it, so a slow consumer does not make the
+        model run ahead. The worker is held until the iteration completes or the iterator is closed.
+
+        Returns
+        -------
+        AsyncIterator[RWKVGenerationStep]
+            Generated tokens with text decoded so far.
+        """
+
+        if not (chunk_size > 0):
+            raise ValueError('Chunk size must be > 0')
+
+        if len(prompt_tokens) == 0:
+            raise ValueError('Prompt must not be empty')
+
+        async with self._acquire() as worker:
+            session: rwkv_cpp_model.RWKVSession = rwkv_cpp_model.RWKVSession(worker.model, state_in, use_numpy=True)
+
+            for offset in range(0, len(prompt_tokens), chunk_size):
+                await self._run(worker, session.feed, prompt_tokens[offset:offset + chunk_size], chunk_size)
+
+            steps: Iterator[rwkv_cpp_model.RWKVGenerationStep] = worker.model.generate(
+                [],
+                max_tokens=max_tokens,
+                sampler=sampler,
+                stop_tokens=stop_tokens,
+                stop_strings=stop_strings,
+                decode=decode,
+                session=session,
+                decode_bytes=decode_bytes
+            )
+
+            try:
+                while True:
+                    step: Optional[rwkv_cpp_model.RWKVGenerationStep] = await self._run(worker, next, steps, None)
+
+                    if step is None:
+                        break
+
+                    yield step
+            finally:
+                # Closing the generator evaluates the last yielded token; it must run on the worker thread too.
+                await self._run(worker, steps.close)
+
+    def close(self) -> None:
+        """
+        Waits for all running native calls to finish and frees all contexts.
+        This object must not be used anymore after calling this method.
+        """
+
+        if not self._valid:
+            raise ValueError('Already closed')
+
+        self._valid = False
+
+        for worker in self._workers:
+            worker.executor.shutdown(wait=True)
+            worker.model.free()
+
+    async def aclose(self) -> None:
+        """
+        Like `close`, but waits for running native calls without blocking the event loop.
+        This object must not be used anymore after calling this method.
+        """
+
+        if not self._valid:
+            raise ValueError('Already closed')
+
+        self._valid = False
+
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+
+        for worker in self._workers:
+            await loop.run_in_executor(None, functools.partial(worker.executor.shutdown, wait=True))
+            worker.model.free()
+
+    async def __aenter__(self) -> 'AsyncRWKVModel':
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        if self._valid:
+            await self.aclose()
+
+    def __del__(self) -> None:
+        # Free the contexts on GC in case user forgot to call close() explicitly.
+        if hasattr(self, '_valid') and self._valid:
+            self.close()
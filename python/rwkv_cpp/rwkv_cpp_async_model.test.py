@@ -0,0 +1,159 @@
+import os
+import time
+import asyncio
+import pathlib
+import numpy as np
+import rwkv_cpp_model
+import rwkv_cpp_shared_library
+import rwkv_cpp_async_model
+from typing import List
+
+TESTS_DIR: pathlib.Path = pathlib.Path(os.path.abspath(__file__)).parent.parent.parent / 'tests'
+
+def decode(tokens: List[int]) -> str:
+    return bytes(tokens).decode('utf-8', errors='replace')
+
+async def run_tests(model: rwkv_cpp_model.RWKVModel) -> None:
+    documents: List[List[int]] = [list(text.encode('utf-8')) for text in [
+        'A long time ago, ',
+        'In a galaxy far, far away',
+        'Hello',
+        'The quick brown fox jumps over the lazy dog. '
+    ]]
+
+    async with rwkv_cpp_async_model.AsyncRWKVModel(model, size=2) as async_model:
+        # Concurrent requests give the same results as serial evaluation.
+        results = await asyncio.gather(*[async_model.eval_sequence_in_chunks(tokens, None, chunk_size=4, use_numpy=True) for tokens in documents])
+
+        for (logits, state), tokens in zip(results, documents):
+            expected_logits, expected_state = model.eval_sequence_in_chunks(tokens, None, use_numpy=True)
+
+            assert np.allclose(logits, expected_logits, rtol=1e-5, atol=1e-5)
+            assert np.allclose(state, expected_state, rtol=1e-5, atol=1e-5)
+
+        assert async_model._available.qsize() == 2
+
+    async with rwkv_cpp_async_model.AsyncRWKVModel(model, size=1) as async_model:
+        worker: rwkv_cpp_async_model._Worker = async_model._workers[0]
+
+        # Count chunks evaluated by the worker.
+        evaluated_chunks: List[int] = []
+        eval_sequence_in_chunks = worker.model.eval_sequence_in_chunks
+
+        def counting_eval_sequence_in_chunks(tokens, *args):
+            evaluated_chunks.append(len(tokens))
+
+            return eval_sequence_in_chunks(tokens, *args)
+
+        worker.model.eval_sequence_in_chunks = counting_eval_sequence_in_chunks
+
+        # A request cancelled in the middle of a sequence does not start the next chunk, and the worker goes back to the queue.
+        long_sequence: List[int] = list(('The quick brown fox jumps over the lazy dog. ' * 20).encode('utf-8'))
+        task: asyncio.Task = asyncio.create_task(async_model.eval_sequence_in_chunks(long_sequence, None, chunk_size=1, use_numpy=True))
+
+        while len(evaluated_chunks) < 3:
+            await asyncio.sleep(0.001)
+
+        task.cancel()
+
+        try:
+            await task
+            assert False, 'Task was not cancelled'
+        except asyncio.CancelledError:
+            pass
+
+        # The native call that was running when the task was cancelled completes before the worker is returned.
+        assert async_model._available.qsize() == (1 if worker.running is None or worker.running.done() else 0)
+
+        while async_model._available.qsize() == 0:
+            await asyncio.sleep(0.001)
+
+        chunk_count: int = len(evaluated_chunks)
+        assert 3 <= chunk_count < len(long_sequence), chunk_count
+
+        worker.model.eval_sequence_in_chunks = eval_sequence_in_chunks
+
+        # The worker serves the next request.
+        logits, _ = await asyncio.wait_for(async_model.eval_sequence_in_chunks(documents[0], None, use_numpy=True), timeout=10)
+        assert np.allclose(logits, model.eval_sequence_in_chunks(documents[0], None, use_numpy=True)[0], rtol=1e-5, atol=1e-5)
+        assert len(evaluated_chunks) == chunk_count
+
+        # Generation gives the same steps as synchronous generation.
+        expected_steps: List[rwkv_cpp_model.RWKVGenerationStep] = list(model.generate(documents[0], max_tokens=20, stop_strings=['sZZZ'], decode=decode))
+        steps: List[rwkv_cpp_model.RWKVGenerationStep] = [step async for step in async_model.generate(documents[0], max_tokens=20, stop_strings=['sZZZ'], decode=decode)]
+
+        assert steps == expected_steps
+
+        # Closing the generator early releases the worker.
+        generator = async_model.generate(documents[0], max_tokens=20, decode=decode)
+
+        for i in range(3):
+            assert (await generator.__anext__()).token == expected_steps[i].token
+
+        await generator.aclose()
+
+        assert async_model._available.qsize() == 1
+        assert worker.running is None or worker.running.done()
+
+        logits, _ = await asyncio.wait_for(async_model.eval(documents[0][0], None, use_numpy=True), timeout=10)
+        assert np.allclose(logits, model.eval(documents[0][0], None, use_numpy=True)[0], rtol=1e-5, atol=1e-5)
+
+async def test_aclose(model: rwkv_cpp_model.RWKVModel) -> None:
+    async_model = rwkv_cpp_async_model.AsyncRWKVModel(model, size=1)
+    worker: rwkv_cpp_async_model._Worker = async_model._workers[0]
+
+    # A slow native call, which is still running when the model is closed.
+    eval_sequence_in_chunks = worker.model.eval_sequence_in_chunks
+
+    def slow_eval_sequence_in_chunks(*args):
+        time.sleep(0.5)
+
+        return eval_sequence_in_chunks(*args)
+
+    worker.model.eval_sequence_in_chunks = slow_eval_sequence_in_chunks
+
+    task: asyncio.Task = asyncio.create_task(async_model.eval_sequence_in_chunks([1, 2, 3], None, use_numpy=True))
+
+    while worker.running is None:
+        await asyncio.sleep(0.001)
+
+    # The event loop keeps running other tasks while aclose waits for the native call.
+    ticks: List[int] = []
+
+    async def tick() -> None:
+        while True:
+            ticks.append(1)
+
+            await asyncio.sleep(0.01)
+
+    ticker: asyncio.Task = asyncio.create_task(tick())
+
+    await async_model.aclose()
+
+    ticker.cancel()
+
+    assert len(ticks) > 10, len(ticks)
+
+    logits, _ = await task
+    assert np.allclose(logits, model.eval_sequence_in_chunks([1, 2, 3], None, use_numpy=True)[0], rtol=1e-5, atol=1e-5)
+
+    try:
+        await async_model.aclose()
+        assert False, 'Model was closed twice'
+    except ValueError:
+        pass
+
+def test() -> None:
+    library: rwkv_cpp_shared_library.RWKVSharedLibrary = rwkv_cpp_shared_library.load_rwkv_shared_library()
+
+    model = rwkv_cpp_model.RWKVModel(library, str(TESTS_DIR / 'tiny-rwkv-5v2-730K-FP32.bin'), thread_count=1)
+
+    asyncio.run(run_tests(model))
+    asyncio.run(test_aclose(model))
+
+    model.free()
+
+    print('All tests pass')
+
+if __name__ == "__main__":
+    test()
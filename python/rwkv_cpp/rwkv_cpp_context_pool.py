@@ -0,0 +1,169 @@
+import queue
+import contextlib
+import concurrent.futures
+
+# I'm sure this is not strictly correct, but let's keep this crutch for now.
+try:
+    import rwkv_cpp_model
+except ModuleNotFoundError:
+    from . import rwkv_cpp_model
+
+from typing import TypeVar, Callable, Iterable, Iterator, List, Optional
+
+T = TypeVar('T')
+
+class RWKVContextPool:
+    """
+    A pool of cloned contexts of a single model, for parallel inference on Python threads.
+
+    All contexts share the weights of the model, so memory usage does not grow with pool size,
+    unlike loading the same model in several processes. Native calls release the GIL,
+    so evaluations on different contexts run truly in parallel.
+
+    Usage:
+
+    with RWKVContextPool(model, size=4) as pool:
+        futures = [pool.submit(lambda m, tokens: m.eval_sequence_in_chunks(tokens, None, use_numpy=True), doc) for doc in docs]
+    """
+
+    def __init__(
+            self,
+            model: rwkv_cpp_model.RWKVModel,
+            size: int,
+            thread_count_per_context: int = 1
+    ) -> None:
+        """
+        Creates the pool by cloning the context of the model.
+        In case of any error, this method will throw an exception.
+
+        Parameters
+        ----------
+        model : RWKVModel
+            Model to clone. It is not used by the pool itself and may be freed independently.
+        size : int
+            Count of contexts in the pool, which is also the max count of parallel evaluations. Must be positive.
+        thread_count_per_context : int
+            Thread count for each cloned context, must be positive.
+            Total thread count used by the pool is size * thread_count_per_context; it should not exceed the CPU count.
+        """
+
+        if not (size > 0):
+            raise ValueError('Pool size must be > 0')
+
+        if not (thread_count_per_context > 0):
+            raise ValueError('Thread count must be > 0')
+
+        self._models: List[rwkv_cpp_model.RWKVModel] = []
+
+        try:
+            for _ in range(size):
+                self._models.append(model.clone(thread_count_per_context))
+        except Exception:
+            for clone in self._models:
+                clone.free()
+
+            raise
+
+        self._available: queue.Queue = queue.Queue()
+
+        for clone in self._models:
+            self._available.put(clone)
+
+        self._executor: concurrent.futures.ThreadPoolExecutor = concurrent.futures.ThreadPoolExecutor(max_workers=size)
+
+        self._valid: bool = True
+
+    @property
+    def size(self) -> int:
+        return len(self._models)
+
+    @contextlib.contextmanager
+    def acquire(self, timeout: Optional[float] = None) -> Iterator[rwkv_cpp_model.RWKVModel]:
+        """
+        Takes a context out of the pool for exclusive use by the current thread, blocking until one is available.
+        The context is returned to the pool when the `with` block exits.
+
+        Parameters
+        ----------
+        timeout : Optional[float]
+            Max time to wait in seconds. If not set, waits indefinitely.
+            On timeout, queue.Empty is raised.
+        """
+
+        if not self._valid:
+            raise ValueError('Pool was closed')
+
+        model: rwkv_cpp_model.RWKVModel = self._available.get(timeout=timeout)
+
+        try:
+            yield model
+        finally:
+            self._available.put(model)
+
+    def submit(self, fn: Callable[..., T], *args, **kwargs) -> 'concurrent.futures.Future[T]':
+        """
+        Schedules fn(model, *args, **kwargs) to be run on the pool's executor with a context from the pool.
+        The context is used exclusively by fn until it returns.
+
+        Parameters
+        ----------
+        fn : Callable
+            Function that receives an RWKVModel as the first argument.
+
+        Returns
+        -------
+        Future
+            Future that resolves to the return value of fn.
+        """
+
+        if not self._valid:
+            raise ValueError('Pool was closed')
+
+        def run() -> T:
+            with self.acquire() as model:
+                return fn(model, *args, **kwargs)
+
+        return self._executor.submit(run)
+
+    def map(self, fn: Callable[..., T], *iterables: Iterable) -> Iterator[T]:
+        """
+        Like `submit`, but for each set of items of iterables; results are returned in order.
+
+        Parameters
+        ----------
+        fn : Callable
+            Function that receives an RWKVModel as the first argument, and one item of each iterable after it.
+        """
+
+        futures: List[concurrent.futures.Future] = [self.submit(fn, *args) for args in zip(*iterables)]
+
+        return (future.result() for future in futures)
+
+    def close(self) -> None:
+        """
+        Waits for all scheduled work to finish and frees all contexts.
+        The pool must not be used anymore after calling this method.
+        """
+
+        if not self._valid:
+            raise ValueError('Already closed')
+
+        # Scheduled work still takes contexts from the pool, so the pool is invalidated only after it is done.
+        self._executor.shutdown(wait=True)
+
+        self._valid = False
+
+        for model in self._models:
+            model.free()
+
+    def __enter__(self) -> 'RWKVContextPool':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if self._valid:
+            self.close()
+
+    def __del__(self) -> None:
+        # Free the contexts on GC in case user forgot to call close() explicitly.
+        if hasattr(self, '_valid') and self._valid:
+            self.close()
@@ -0,0 +1,121 @@
+import os
+import gc
+import queue
+import pathlib
+import numpy as np
+import rwkv_cpp_model
+import rwkv_cpp_shared_library
+import rwkv_cpp_context_pool
+from typing import List
+
+TESTS_DIR: pathlib.Path = pathlib.Path(os.path.abspath(__file__)).parent.parent.parent / 'tests'
+
+def eval_document(model: rwkv_cpp_model.RWKVModel, tokens: List[int]):
+    return model.eval_sequence_in_chunks(tokens, None, use_numpy=True)
+
+def test() -> None:
+    library: rwkv_cpp_shared_library.RWKVSharedLibrary = rwkv_cpp_shared_library.load_rwkv_shared_library()
+
+    model = rwkv_cpp_model.RWKVModel(library, str(TESTS_DIR / 'tiny-rwkv-5v2-730K-FP32.bin'), thread_count=1)
+
+    documents: List[List[int]] = [list(text.encode('utf-8')) for text in [
+        'A long time ago, ',
+        'In a galaxy far, far away',
+        'Hello',
+        'The quick brown fox jumps over the lazy dog. ' * 3,
+        '1, 2, 3, 4, 5, 6, 7, 8, 9, 10',
+        '!'
+    ]]
+
+    expected = [eval_document(model, tokens) for tokens in documents]
+
+    # Count frees of each context.
+    freed: List[int] = []
+    rwkv_free = library.rwkv_free
+
+    def counting_free(ctx: rwkv_cpp_shared_library.RWKVContext) -> None:
+        freed.append(ctx.ptr)
+
+        rwkv_free(ctx)
+
+    library.rwkv_free = counting_free
+
+    pool = rwkv_cpp_context_pool.RWKVContextPool(model, size=3)
+    clone_pointers: List[int] = [clone._ctx.ptr for clone in pool._models]
+
+    assert pool.size == 3 and len(set(clone_pointers)) == 3 and model._ctx.ptr not in clone_pointers
+
+    # Pooled evaluation gives the same results as serial evaluation, in order.
+    for (logits, state), (expected_logits, expected_state) in zip(pool.map(eval_document, documents), expected):
+        assert np.array_equal(logits, expected_logits)
+        assert np.array_equal(state, expected_state)
+
+    logits, state = pool.submit(eval_document, documents[0]).result()
+    assert np.array_equal(logits, expected[0][0])
+
+    # Errors are raised from the future, and the context goes back to the pool.
+    def fail(_: rwkv_cpp_model.RWKVModel) -> None:
+        raise ValueError('Test error')
+
+    try:
+        pool.submit(fail).result()
+        assert False, 'Error was not raised'
+    except ValueError as e:
+        assert str(e) == 'Test error'
+
+    # Acquired contexts are used exclusively; when all of them are taken, acquire times out.
+    with pool.acquire() as first, pool.acquire() as second, pool.acquire() as third:
+        assert len({id(first), id(second), id(third)}) == 3
+
+        try:
+            with pool.acquire(timeout=0.01):
+                assert False, 'Context was acquired twice'
+        except queue.Empty:
+            pass
+
+    with pool.acquire(timeout=0.01):
+        pass
+
+    assert freed == []
+
+    # Closing frees every clone exactly once, and the original model stays valid.
+    pool.close()
+
+    assert sorted(freed) == sorted(clone_pointers), freed
+
+    try:
+        pool.close()
+        assert False, 'Pool was closed twice'
+    except ValueError:
+        pass
+
+    try:
+        pool.submit(eval_document, documents[0])
+        assert False, 'Closed pool was used'
+    except ValueError:
+        pass
+
+    del pool
+    gc.collect()
+
+    assert sorted(freed) == sorted(clone_pointers), freed
+
+    logits, state = eval_document(model, documents[0])
+    assert np.array_equal(logits, expected[0][0])
+
+    library.rwkv_free = rwkv_free
+
+    # Closing the pool waits for all scheduled work, including jobs that have not started yet.
+    with rwkv_cpp_context_pool.RWKVContextPool(model, size=2) as pool:
+        futures = [pool.submit(eval_document, tokens) for tokens in documents * 2]
+
+    for future, (expected_logits, _) in zip(futures, expected * 2):
+        logits, _ = future.result()
+        assert np.array_equal(logits, expected_logits)
+
+    model.free()
+
+    print('All tests pass')
+
+if __name__ == "__main__":
+    test()
@@ -1,4 +1,6 @@
 import os
+import ctypes
+import random
 import multiprocessing
 
 # Pre-import PyTorch, if available.
@@ -11,14 +13,28 @@ except ModuleNotFoundError:
 # I'm sure this is not strictly correct, but let's keep this crutch for now.
 try:
     import rwkv_cpp_shared_library
+    import rwkv_cpp_penalty
+    import rwkv_streaming_detokenizer
 except ModuleNotFoundError:
     from . import rwkv_cpp_shared_library
+    from . import rwkv_cpp_penalty
+    from . import rwkv_streaming_detokenizer
 
-from typing import TypeVar, Optional, Tuple, List
+from typing import TypeVar, Optional, Tuple, List, Union, Dict, Callable, Iterable, Iterator, NamedTuple
 
 # A value of this type is either a numpy's ndarray or a PyTorch's Tensor.
 NumpyArrayOrPyTorchTensor: TypeVar = TypeVar('NumpyArrayOrPyTorchTensor')
 
+class RWKVGenerationStep(NamedTuple):
+    """
+    A single step of `RWKVModel.generate`.
+    """
+
+    # Generated token.
+    token: int
+    # Text decoded since the previous step. May be empty, when the token ends in the middle of a multi-byte UTF-8 character.
+    text: str
+
 class RWKVModel:
     """
     An RWKV model managed by rwkv.cpp library.
@@ -30,6 +46,10 @@ class RWKVModel:
             model_path: str,
             thread_count: int = max(1, multiprocessing.cpu_count() // 2),
             gpu_layer_count: int = 0,
+            use_mmap: bool = False,
+            mmap_hint: str = 'none',
+            load_thread_count: int = 0,
+            progress_callback: Optional[Callable[[float], None]] = None,
             **kwargs
     ) -> None:
         """
@@ -47,6 +67,18 @@ class RWKVModel:
         gpu_layer_count : int
             Count of layers to offload onto the GPU, must be >= 0.
             See documentation of `gpu_offload_layers` for details about layer offloading.
+        use_mmap : bool
+            Whether to map the model file into memory instead of reading it. Weights on the CPU that are aligned in the file
+            are used in place, so loading does not copy them, and processes that load the same file share them in the page cache.
+            The file must not be modified while the model is loaded.
+        mmap_hint : str
+            Hint for the mapping: 'none' reads pages on first access, 'willneed' starts reading the whole file in the background,
+            'populate' reads the whole file before the constructor returns.
+        load_thread_count : int
+            Count of threads that read the model file in parallel, must be >= 0. If 0, defaults to thread_count.
+        progress_callback : Optional[Callable[[float], None]]
+            Called with the fraction of weights loaded so far, in range 0 to 1; the last call is made with 1.
+            Calls come from loading threads, one call at a time. Exceptions raised by the callback are printed and ignored.
         """
 
         if 'gpu_layers_count' in kwargs:
@@ -61,15 +93,79 @@ class RWKVModel:
         if not (gpu_layer_count >= 0):
             raise ValueError('GPU layer count must be >= 0')
 
+        if not (load_thread_count >= 0):
+            raise ValueError('Load thread count must be >= 0')
+
+        if mmap_hint not in rwkv_cpp_shared_library.MMAP_HINTS:
+            raise ValueError(f'Unknown mmap hint {mmap_hint}, supported hints: {", ".join(rwkv_cpp_shared_library.MMAP_HINTS)}')
+
+        params: rwkv_cpp_shared_library.RWKVLoadParams = shared_library.rwkv_init_load_params()
+        params.n_threads = thread_count
+        params.n_gpu_layers = gpu_layer_count
+        params.use_mmap = use_mmap
+        params.mmap_hint = rwkv_cpp_shared_library.MMAP_HINTS[mmap_hint]
+        params.n_load_threads = load_thread_count
+
+        if progress_callback is not None:
+            # Referenced by params, which outlive the loading.
+            params.progress_callback = rwkv_cpp_shared_library.RWKV_PROGRESS_CALLBACK(lambda progress, _: progress_callback(progress))
+
+        self._init_from_context(
+            shared_library,
+            shared_library.rwkv_init_from_file_with_params(model_path, params),
+            thread_count
+        )
+
+    def _init_from_context(
+            self,
+            shared_library: rwkv_cpp_shared_library.RWKVSharedLibrary,
+            ctx: rwkv_cpp_shared_library.RWKVContext,
+            thread_count: int
+    ) -> None:
         self._library: rwkv_cpp_shared_library.RWKVSharedLibrary = shared_library
 
-        self._ctx: rwkv_cpp_shared_library.RWKVContext = self._library.rwkv_init_from_file(model_path, thread_count, gpu_layer_count)
+        self._ctx: rwkv_cpp_shared_library.RWKVContext = ctx
+
+        self._thread_count: int = thread_count
 
         self._state_buffer_element_count: int = self._library.rwkv_get_state_buffer_element_count(self._ctx)
         self._logits_buffer_element_count: int = self._library.rwkv_get_logits_buffer_element_count(self._ctx)
 
         self._valid: bool = True
 
+    def clone(self, thread_count: Optional[int] = None) -> 'RWKVModel':
+        """
+        Creates a new model object that shares weights with this one, but has its own inference context.
+        Cloning is cheap compared to loading the model again: weights are not copied, only per-context buffers are allocated.
+        Each clone may be used from a separate thread; native code releases the GIL, so evaluations run in parallel.
+        The clone stays valid after this model is freed.
+        In case of any error, this method will throw an exception.
+
+        Parameters
+        ----------
+        thread_count : Optional[int]
+            Thread count to use in the clone. If not set, thread count of this model is used.
+
+        Returns
+        -------
+        RWKVModel
+            A new model object.
+        """
+
+        if not self._valid:
+            raise ValueError('Model was freed')
+
+        if thread_count is None:
+            thread_count = self._thread_count
+
+        if not (thread_count > 0):
+            raise ValueError('Thread count must be > 0')
+
+        clone: RWKVModel = RWKVModel.__new__(RWKVModel)
+        clone._init_from_context(self._library, self._library.rwkv_clone_context(self._ctx, thread_count), thread_count)
+
+        return clone
+
     @property
     def n_vocab(self) -> int:
         return self._library.rwkv_get_n_vocab(self._ctx)
@@ -149,7 +245,7 @@ class RWKVModel:
     
     def eval_sequence(
             self,
-            tokens: List[int],
+            tokens: rwkv_cpp_shared_library.Tokens,
             state_in: Optional[NumpyArrayOrPyTorchTensor],
             state_out: Optional[NumpyArrayOrPyTorchTensor] = None,
             logits_out: Optional[NumpyArrayOrPyTorchTensor] = None,
@@ -171,8 +267,9 @@ class RWKVModel:
 
         Parameters
         ----------
-        tokens : List[int]
+        tokens : Tokens
             Indices of the next tokens to be seen by the model. Must be in range 0 <= token < n_vocab.
+            Pass a contiguous numpy uint32 array to avoid copying tokens on each call; lists are supported too.
         state_in : Optional[NumpyArrayOrTorchTensor]
             State from previous call of this method. If this is a first pass, set it to None.
         state_out : Optional[NumpyArrayOrTorchTensor]
@@ -222,9 +319,234 @@ class RWKVModel:
 
         return logits_out, state_out
 
+    def eval_sequence_logits(
+            self,
+            tokens: rwkv_cpp_shared_library.Tokens,
+            state_in: Optional[NumpyArrayOrPyTorchTensor],
+            positions: Optional[rwkv_cpp_shared_library.Tokens] = None,
+            state_out: Optional[NumpyArrayOrPyTorchTensor] = None,
+            logits_out: Optional[NumpyArrayOrPyTorchTensor] = None,
+            use_numpy: bool = False
+    ) -> Tuple[NumpyArrayOrPyTorchTensor, NumpyArrayOrPyTorchTensor]:
+        """
+        Evaluates the model for a sequence of tokens, like `eval_sequence`, but returns logits for multiple positions of the sequence,
+        all computed in one graph execution. Logits at position i are the model's prediction for the token following tokens[i].
+        This is useful for teacher-forced scoring, like perplexity measurement or reranking, which would otherwise need one `eval` call per token.
+
+        The same node limit as in `eval_sequence` applies; split long sequences into chunks and pass the state between calls.
+
+        In case of any error, this method will throw an exception.
+
+        Parameters
+        ----------
+        tokens : Tokens
+            Indices of the next tokens to be seen by the model. Must be in range 0 <= token < n_vocab.
+        state_in : Optional[NumpyArrayOrTorchTensor]
+            State from previous call of this method. If this is a first pass, set it to None.
+        positions : Optional[Tokens]
+            Positions in the sequence to compute logits for, in range 0 <= position < len(tokens). If not set, logits are computed for all positions.
+        state_out : Optional[NumpyArrayOrTorchTensor]
+            Optional output tensor for state. If provided, must be of type float32, contiguous and of shape (state_buffer_element_count).
+        logits_out : Optional[NumpyArrayOrTorchTensor]
+            Optional output tensor for logits. If provided, must be of type float32, contiguous and of shape (position count, logits_buffer_element_count).
+        use_numpy : bool
+            If set to True, numpy's ndarrays will be created instead of PyTorch's Tensors.
+            This parameter is ignored if any tensor parameter is not None; in such case,
+            type of returned tensors will match the type of received tensors.
+
+        Returns
+        -------
+        logits, state
+            Logits of shape (position count, n_vocab); state for the next step.
+        """
+
+        if not self._valid:
+            raise ValueError('Model was freed')
+
+        use_numpy = self._detect_numpy_usage([state_in, state_out, logits_out], use_numpy)
+
+        logits_shape: Tuple[int, int] = (len(tokens) if positions is None else len(positions), self._logits_buffer_element_count)
+
+        if state_in is not None:
+            self._validate_tensor(state_in, 'state_in', self._state_buffer_element_count)
+
+            state_in_ptr = self._get_data_ptr(state_in)
+        else:
+            state_in_ptr = 0
+
+        if state_out is not None:
+            self._validate_tensor(state_out, 'state_out', self._state_buffer_element_count)
+        else:
+            state_out = self._zeros_float32(self._state_buffer_element_count, use_numpy)
+
+        if logits_out is not None:
+            self._validate_tensor(logits_out, 'logits_out', logits_shape)
+        else:
+            logits_out = self._zeros_float32(logits_shape, use_numpy)
+
+        self._library.rwkv_eval_sequence_logits(
+            self._ctx,
+            tokens,
+            positions,
+            state_in_ptr,
+            self._get_data_ptr(state_out),
+            self._get_data_ptr(logits_out)
+        )
+
+        return logits_out, state_out
+
+    def eval_sequence_logprobs(
+            self,
+            tokens: rwkv_cpp_shared_library.Tokens,
+            targets: rwkv_cpp_shared_library.Tokens,
+            state_in: Optional[NumpyArrayOrPyTorchTensor],
+            state_out: Optional[NumpyArrayOrPyTorchTensor] = None,
+            logprobs_out: Optional[NumpyArrayOrPyTorchTensor] = None,
+            use_numpy: bool = False
+    ) -> Tuple[NumpyArrayOrPyTorchTensor, float, NumpyArrayOrPyTorchTensor]:
+        """
+        Evaluates the model for a sequence of tokens and scores the target tokens: for each position i, computes log-probability of targets[i]
+        according to the model's prediction for the token following tokens[i]. For teacher-forced scoring of a text,
+        targets are the tokens shifted by one. Log-softmax is computed natively, so full vocabulary logits are never copied out.
+
+        The same node limit as in `eval_sequence` applies; use `eval_sequence_logprobs_in_chunks` for long sequences.
+
+        In case of any error, this method will throw an exception.
+
+        Parameters
+        ----------
+        tokens : Tokens
+            Indices of the next tokens to be seen by the model. Must be in range 0 <= token < n_vocab.
+        targets : Tokens
+            Target token indices, one for each token. Must be in range 0 <= target < n_vocab.
+        state_in : Optional[NumpyArrayOrTorchTensor]
+            State from previous call of this method. If this is a first pass, set it to None.
+        state_out : Optional[NumpyArrayOrTorchTensor]
+            Optional output tensor for state. If provided, must be of type float32, contiguous and of shape (state_buffer_element_count).
+        logprobs_out : Optional[NumpyArrayOrTorchTensor]
+            Optional output tensor for log-probabilities. If provided, must be of type float32, contiguous and of shape (len(tokens)).
+        use_numpy : bool
+            If set to True, numpy's ndarrays will be created instead of PyTorch's Tensors.
+            This parameter is ignored if any tensor parameter is not None; in such case,
+            type of returned tensors will match the type of received tensors.
+
+        Returns
+        -------
+        logprobs, loss, state
+            Log-probabilities of shape (len(tokens)); summed negative log-probability of all targets; state for the next step.
+        """
+
+        if not self._valid:
+            raise ValueError('Model was freed')
+
+        use_numpy = self._detect_numpy_usage([state_in, state_out, logprobs_out], use_numpy)
+
+        if state_in is not None:
+            self._validate_tensor(state_in, 'state_in', self._state_buffer_element_count)
+
+            state_in_ptr = self._get_data_ptr(state_in)
+        else:
+            state_in_ptr = 0
+
+        if state_out is not None:
+            self._validate_tensor(state_out, 'state_out', self._state_buffer_element_count)
+        else:
+            state_out = self._zeros_float32(self._state_buffer_element_count, use_numpy)
+
+        if logprobs_out is not None:
+            self._validate_tensor(logprobs_out, 'logprobs_out', len(tokens))
+        else:
+            logprobs_out = self._zeros_float32(len(tokens), use_numpy)
+
+        loss: float = self._library.rwkv_eval_sequence_logprobs(
+            self._ctx,
+            tokens,
+            targets,
+            state_in_ptr,
+            self._get_data_ptr(state_out),
+            self._get_data_ptr(logprobs_out)
+        )
+
+        return logprobs_out, loss, state_out
+
+    def eval_sequence_logprobs_in_chunks(
+            self,
+            tokens: rwkv_cpp_shared_library.Tokens,
+            targets: rwkv_cpp_shared_library.Tokens,
+            state_in: Optional[NumpyArrayOrPyTorchTensor],
+            state_out: Optional[NumpyArrayOrPyTorchTensor] = None,
+            logprobs_out: Optional[NumpyArrayOrPyTorchTensor] = None,
+            chunk_size: int = 16,
+            use_numpy: bool = False
+    ) -> Tuple[NumpyArrayOrPyTorchTensor, float, NumpyArrayOrPyTorchTensor]:
+        """
+        Scores the target tokens like `eval_sequence_logprobs`, splitting a potentially long sequence into chunks
+        the same way as `eval_sequence_in_chunks`. Use it to score whole documents, for example, to measure perplexity.
+
+        In case of any error, this method will throw an exception.
+
+        Parameters
+        ----------
+        tokens : Tokens
+            Indices of the next tokens to be seen by the model. Must be in range 0 <= token < n_vocab.
+        targets : Tokens
+            Target token indices, one for each token. Must be in range 0 <= target < n_vocab.
+        state_in : Optional[NumpyArrayOrTorchTensor]
+            State from previous call of this method. If this is a first pass, set it to None.
+        state_out : Optional[NumpyArrayOrTorchTensor]
+            Optional output tensor for state. If provided, must be of type float32, contiguous and of shape (state_buffer_element_count).
+        logprobs_out : Optional[NumpyArrayOrTorchTensor]
+            Optional output tensor for log-probabilities. If provided, must be of type float32, contiguous and of shape (len(tokens)).
+        chunk_size : int
+            Size of each chunk in tokens, must be positive.
+        use_numpy : bool
+            If set to True, numpy's ndarrays will be created instead of PyTorch's Tensors.
+            This parameter is ignored if any tensor parameter is not None; in such case,
+            type of returned tensors will match the type of received tensors.
+
+        Returns
+        -------
+        logprobs, loss, state
+            Log-probabilities of shape (len(tokens)); summed negative log-probability of all targets; state for the next step.
+        """
+
+        if not self._valid:
+            raise ValueError('Model was freed')
+
+        use_numpy = self._detect_numpy_usage([state_in, state_out, logprobs_out], use_numpy)
+
+        if state_in is not None:
+            self._validate_tensor(state_in, 'state_in', self._state_buffer_element_count)
+
+            state_in_ptr = self._get_data_ptr(state_in)
+        else:
+            state_in_ptr = 0
+
+        if state_out is not None:
+            self._validate_tensor(state_out, 'state_out', self._state_buffer_element_count)
+        else:
+            state_out = self._zeros_float32(self._state_buffer_element_count, use_numpy)
+
+        if logprobs_out is not None:
+            self._validate_tensor(logprobs_out, 'logprobs_out', len(tokens))
+        else:
+            logprobs_out = self._zeros_float32(len(tokens), use_numpy)
+
+        loss: float = self._library.rwkv_eval_sequence_logprobs_in_chunks(
+            self._ctx,
+            tokens,
+            targets,
+            chunk_size,
+            state_in_ptr,
+            self._get_data_ptr(state_out),
+            self._get_data_ptr(logprobs_out)
+        )
+
+        return logprobs_out, loss, state_out
+
     def eval_sequence_in_chunks(
             self,
-            tokens: List[int],
+            tokens: rwkv_cpp_shared_library.Tokens,
             state_in: Optional[NumpyArrayOrPyTorchTensor],
             state_out: Optional[NumpyArrayOrPyTorchTensor] = None,
             logits_out: Optional[NumpyArrayOrPyTorchTensor] = None,
@@ -244,8 +566,9 @@ class RWKVModel:
 
         Parameters
         ----------
-        tokens : List[int]
+        tokens : Tokens
             Indices of the next tokens to be seen by the model. Must be in range 0 <= token < n_vocab.
+            Pass a contiguous numpy uint32 array to avoid copying tokens on each call; lists are supported too.
         chunk_size : int
             Size of each chunk in tokens, must be positive.
         state_in : Optional[NumpyArrayOrTorchTensor]
@@ -298,6 +621,349 @@ class RWKVModel:
 
         return logits_out, state_out
 
+    def eval_batch(
+            self,
+            tokens: rwkv_cpp_shared_library.Tokens,
+            state_in: Optional[NumpyArrayOrPyTorchTensor],
+            state_out: Optional[NumpyArrayOrPyTorchTensor] = None,
+            logits_out: Optional[NumpyArrayOrPyTorchTensor] = None,
+            use_numpy: bool = False
+    ) -> Tuple[NumpyArrayOrPyTorchTensor, NumpyArrayOrPyTorchTensor]:
+        """
+        Evaluates the model for a batch of independent sequences, advancing each sequence's state by a single token.
+        All sequences share a single pass over the model weights, which is much faster than calling `eval` for each sequence
+        when serving multiple concurrent sessions. Best used with batch sizes of 8 to 32.
+
+        In case of any error, this method will throw an exception.
+
+        Parameters
+        ----------
+        tokens : Tokens
+            Index of the next token for each sequence in the batch. Must be in range 0 <= token < n_vocab.
+        state_in : Optional[NumpyArrayOrTorchTensor]
+            States from previous call of this method, of shape (len(tokens), state_buffer_element_count).
+            If this is a first pass for all sequences, set it to None.
+        state_out : Optional[NumpyArrayOrTorchTensor]
+            Optional output tensor for states. If provided, must be of type float32, contiguous and of shape (len(tokens), state_buffer_element_count).
+        logits_out : Optional[NumpyArrayOrTorchTensor]
+            Optional output tensor for logits. If provided, must be of type float32, contiguous and of shape (len(tokens), logits_buffer_element_count).
+        use_numpy : bool
+            If set to True, numpy's ndarrays will be created instead of PyTorch's Tensors.
+            This parameter is ignored if any tensor parameter is not None; in such case,
+            type of returned tensors will match the type of received tensors.
+
+        Returns
+        -------
+        logits, state
+            Logits of shape (len(tokens), n_vocab); states for the next step.
+        """
+
+        if not self._valid:
+            raise ValueError('Model was freed')
+
+        batch_size: int = len(tokens)
+
+        if batch_size == 0:
+            raise ValueError('Batch must not be empty')
+
+        use_numpy = self._detect_numpy_usage([state_in, state_out, logits_out], use_numpy)
+
+        state_shape: Tuple[int, int] = (batch_size, self._state_buffer_element_count)
+        logits_shape: Tuple[int, int] = (batch_size, self._logits_buffer_element_count)
+
+        if state_in is not None:
+            self._validate_tensor(state_in, 'state_in', state_shape)
+
+            state_in_ptr = self._get_data_ptr(state_in)
+        else:
+            state_in_ptr = 0
+
+        if state_out is not None:
+            self._validate_tensor(state_out, 'state_out', state_shape)
+        else:
+            state_out = self._zeros_float32(state_shape, use_numpy)
+
+        if logits_out is not None:
+            self._validate_tensor(logits_out, 'logits_out', logits_shape)
+        else:
+            logits_out = self._zeros_float32(logits_shape, use_numpy)
+
+        self._library.rwkv_eval_batch(
+            self._ctx,
+            tokens,
+            state_in_ptr,
+            self._get_data_ptr(state_out),
+            self._get_data_ptr(logits_out)
+        )
+
+        return logits_out, state_out
+
+    def set_sequence_graph_cache_capacity(self, capacity: int) -> None:
+        """
+        Sets how many sequence graphs, each for a different sequence length, are kept by the model. The default is 8.
+        When the cache is full, the least recently used graph is freed to make room for a graph of a new sequence length.
+
+        Parameters
+        ----------
+        capacity : int
+            Max count of cached sequence graphs, must be positive.
+        """
+
+        if not self._valid:
+            raise ValueError('Model was freed')
+
+        self._library.rwkv_set_sequence_graph_cache_capacity(self._ctx, capacity)
+
+    def get_graph_stats(self) -> Dict[str, int]:
+        """
+        Returns counters of computation graph builds and allocations: build_count, build_time_us, alloc_count, alloc_time_us,
+        sequence_graph_hits and sequence_graph_misses. Useful for confirming that steady-state inference does not rebuild graphs.
+        """
+
+        if not self._valid:
+            raise ValueError('Model was freed')
+
+        return self._library.rwkv_get_graph_stats(self._ctx)
+
+    def create_session(
+            self,
+            state: Optional[NumpyArrayOrPyTorchTensor] = None,
+            use_numpy: bool = False
+    ) -> 'RWKVSession':
+        """
+        Creates a session for fast token-by-token evaluation, see `RWKVSession`.
+        In case of any error, this method will throw an exception.
+
+        Parameters
+        ----------
+        state : Optional[NumpyArrayOrTorchTensor]
+            Initial state, which will be copied into the session. If not set, the session starts from the initial model state.
+        use_numpy : bool
+            If set to True, numpy's ndarrays will be created instead of PyTorch's Tensors.
+            This parameter is ignored if state is not None; in such case, type of session buffers will match the type of state.
+        """
+
+        if not self._valid:
+            raise ValueError('Model was freed')
+
+        return RWKVSession(self, state, use_numpy)
+
+    def generate(
+            self,
+            prompt_tokens: rwkv_cpp_shared_library.Tokens,
+            state_in: Optional[NumpyArrayOrPyTorchTensor] = None,
+            max_tokens: int = 256,
+            sampler: Optional[Callable[[NumpyArrayOrPyTorchTensor], int]] = None,
+            stop_tokens: Iterable[int] = (),
+            stop_strings: Iterable[str] = (),
+            decode: Optional[Callable[[List[int]], str]] = None,
+            session: Optional['RWKVSession'] = None,
+            chunk_size: int = 16,
+            decode_bytes: Optional[Callable[[List[int]], bytes]] = None
+    ) -> Iterator[RWKVGenerationStep]:
+        """
+        Generates tokens after the prompt, yielding each token along with incrementally decoded text.
+        A token is yielded as soon as it is evaluated and the next token is sampled, so the last step is known when it is yielded:
+        when generation ends by max_tokens or a stop token, text held back for stop strings and incomplete UTF-8 characters is
+        included into the text of the last step. If the caller closes the iteration early, the held back text is not yielded.
+
+        The prompt is processed with `eval_sequence_in_chunks`; then tokens are generated with `RWKVSession.step`,
+        which reuses preallocated state and logits buffers, so the loop does no per-token allocations besides the sampler's.
+
+        Every yielded token is evaluated into the session state, even if the caller stops the iteration early,
+        so the session can be used to continue the conversation. A stop token is not yielded and not evaluated.
+
+        In case of any error, this method will throw an exception.
+
+        Parameters
+        ----------
+        prompt_tokens : Tokens
+            Tokens to process before generation. May be empty if a used session is given and state_in is not set;
+            then generation starts from the session logits.
+        state_in : Optional[NumpyArrayOrTorchTensor]
+            State to start from. If not set, the session state is used, or the initial model state when there is no session.
+        max_tokens : int
+            Max count of tokens to generate.
+        sampler : Optional[Callable]
+            Function that receives logits of shape (n_vocab) and returns the next token. It may modify logits in place.
+            If not set, the token with the highest logit is selected.
+            If it is an RWKVNativeSampler, tokens are sampled natively right after evaluation, and logits are not copied to Python.
+        stop_tokens : Iterable[int]
+            Generation stops when one of these tokens is sampled.
+        stop_strings : Iterable[str]
+            Generation stops when decoded text contains one of these strings. The stop string and text after it are not yielded.
+            Requires decode or decode_bytes to be set.
+        decode : Optional[Callable[[List[int]], str]]
+            Tokenizer decode function. If neither it nor decode_bytes is set, text of each step is empty.
+        session : Optional[RWKVSession]
+            Session to use; its state is updated in place. If not set, a new session is created.
+        chunk_size : int
+            Chunk size for prompt processing, see `eval_sequence_in_chunks`.
+        decode_bytes : Optional[Callable[[List[int]], bytes]]
+            Function that returns bytes of tokens, like `WorldTokenizer.decode_bytes`. If set, it is used instead of decode:
+            text is produced by `RWKVStreamingDetokenizer`, which decodes each token once and matches stop strings in constant time per byte.
+
+        Returns
+        -------
+        Iterator[RWKVGenerationStep]
+            Generated tokens with text decoded so far.
+        """
+
+        if not self._valid:
+            raise ValueError('Model was freed')
+
+        if not (max_tokens >= 0):
+            raise ValueError('Max token count must be >= 0')
+
+        stop_token_set = frozenset(stop_tokens)
+        stop_string_list: List[str] = [stop for stop in stop_strings if stop != '']
+
+        if len(stop_string_list) > 0 and decode is None and decode_bytes is None:
+            raise ValueError('Stop strings require decode function')
+
+        # Without a prompt, generation starts from the logits of the session, which are valid only if the session was used before.
+        if len(prompt_tokens) == 0 and (session is None or state_in is not None or not session._logits_valid):
+            raise ValueError('Prompt must not be empty, unless generation continues a used session')
+
+        if session is None:
+            session = RWKVSession(self, state_in, use_numpy=True)
+        elif state_in is not None:
+            session.reset(state_in)
+
+        if len(prompt_tokens) > 0:
+            session.feed(prompt_tokens, chunk_size)
+
+        if sampler is None:
+            sampler = lambda logits: int(logits.argmax())
+
+        # A native sampler samples right after evaluation, so logits are not copied into the session.
+        native_sampler: Optional[RWKVNativeSampler] = sampler if isinstance(sampler, RWKVNativeSampler) else None
+
+        detokenizer: Optional[rwkv_streaming_detokenizer.RWKVStreamingDetokenizer] = None
+
+        if decode_bytes is not None:
+            detokenizer = rwkv_streaming_detokenizer.RWKVStreamingDetokenizer(decode_bytes, stop_string_list)
+
+        # Tokens that do not decode into complete UTF-8 characters yet.
+        pending_tokens: List[int] = []
+        # Decoded text that was not yielded yet, because it may be the start of a stop string.
+        held_text: str = ''
+        max_stop_length: int = max((len(stop) for stop in stop_string_list), default=0)
+        # Whether a stop string was found in the decoded text.
+        stopped: bool = False
+
+        def find_stop(text: str) -> int:
+            return min((index for index in (text.find(stop) for stop in stop_string_list) if index != -1), default=-1)
+
+        def decode_next(token: int) -> str:
+            nonlocal held_text, stopped
+
+            if detokenizer is not None:
+                text: str = detokenizer.add(token)
+                stopped = detokenizer.stopped
+
+                return text
+
+            if decode is None:
+                return ''
+
+            pending_tokens.append(token)
+
+            text = decode(pending_tokens)
+
+            # A replacement character means that the last tokens end in the middle of a UTF-8 character.
+            # Give up waiting after a few tokens, the bytes may be invalid.
+            if '\uFFFD' in text and len(pending_tokens) < 4:
+                return ''
+
+            pending_tokens.clear()
+
+            if max_stop_length == 0:
+                return text
+
+            held_text += text
+
+            stop_index: int = find_stop(held_text)
+
+            if stop_index != -1:
+                stopped = True
+
+                return held_text[:stop_index]
+
+            # Hold back the longest suffix that may be the start of a stop string.
+            hold_length: int = 0
+
+            for length in range(1, min(max_stop_length - 1, len(held_text)) + 1):
+                suffix: str = held_text[-length:]
+
+                if any(stop.startswith(suffix) for stop in stop_string_list):
+                    hold_length = length
+
+            yielded_text: str = held_text[:len(held_text) - hold_length]
+            held_text = held_text[len(held_text) - hold_length:]
+
+            return yielded_text
+
+        def flush() -> str:
+            nonlocal held_text
+
+            if detokenizer is not None:
+                return detokenizer.flush()
+
+            text: str = held_text + (decode(pending_tokens) if len(pending_tokens) > 0 else '')
+            held_text = ''
+            pending_tokens.clear()
+
+            stop_index: int = find_stop(text)
+
+            return text if stop_index == -1 else text[:stop_index]
+
+        # The last yielded token, which is not evaluated yet.
+        unevaluated_token: Optional[int] = None
+
+        try:
+            if max_tokens == 0:
+                return
+
+            token: int = sampler(session.logits)
+
+            for i in range(max_tokens):
+                # The next token is sampled before a token is yielded, so that the last step is known and includes held back text.
+                if token in stop_token_set:
+                    break
+
+                text: str = decode_next(token)
+
+                if stopped:
+                    unevaluated_token = token
+
+                    yield RWKVGenerationStep(token, text)
+
+                    break
+
+                next_token: Optional[int] = None
+
+                if i == max_tokens - 1:
+                    unevaluated_token = token
+                elif native_sampler is not None:
+                    next_token = session.step_and_sample(token, native_sampler)
+                else:
+                    session.step(token)
+
+                    next_token = sampler(session.logits)
+
+                if next_token is None or next_token in stop_token_set:
+                    yield RWKVGenerationStep(token, text + flush())
+
+                    break
+
+                yield RWKVGenerationStep(token, text)
+
+                token = next_token
+        finally:
+            if unevaluated_token is not None:
+                session.step(unevaluated_token)
+
     def free(self) -> None:
         """
         Frees all allocated resources.
@@ -327,7 +993,9 @@ class RWKVModel:
 
         return use_numpy_by_default
 
-    def _validate_tensor(self, tensor: NumpyArrayOrPyTorchTensor, name: str, size: int) -> None:
+    def _validate_tensor(self, tensor: NumpyArrayOrPyTorchTensor, name: str, size: Union[int, Tuple[int, ...]]) -> None:
+        shape: Tuple[int, ...] = (size,) if isinstance(size, int) else tuple(size)
+
         if self._is_pytorch_tensor(tensor):
             tensor: torch.Tensor = tensor
             
@@ -335,8 +1003,8 @@ class RWKVModel:
                 raise ValueError(f'{name} is not on CPU')
             if tensor.dtype != torch.float32:
                 raise ValueError(f'{name} is not of type float32')
-            if tensor.shape != (size,):
-                raise ValueError(f'{name} has invalid shape {tensor.shape}, expected ({size})')
+            if tuple(tensor.shape) != shape:
+                raise ValueError(f'{name} has invalid shape {tuple(tensor.shape)}, expected {shape}')
             if not tensor.is_contiguous():
                 raise ValueError(f'{name} is not contiguous')
         else:
@@ -345,8 +1013,8 @@ class RWKVModel:
 
             if tensor.dtype != np.float32:
                 raise ValueError(f'{name} is not of type float32')
-            if tensor.shape != (size,):
-                raise ValueError(f'{name} has invalid shape {tensor.shape}, expected ({size})')
+            if tuple(tensor.shape) != shape:
+                raise ValueError(f'{name} has invalid shape {tuple(tensor.shape)}, expected {shape}')
             if not tensor.data.contiguous:
                 raise ValueError(f'{name} is not contiguous')
 
@@ -356,9 +1024,335 @@ class RWKVModel:
         else:
             return tensor.ctypes.data
 
-    def _zeros_float32(self, element_count: int, use_numpy: bool) -> NumpyArrayOrPyTorchTensor:
+    def _zeros_float32(self, element_count: Union[int, Tuple[int, ...]], use_numpy: bool) -> NumpyArrayOrPyTorchTensor:
         if use_numpy:
             import numpy as np
             return np.zeros(element_count, dtype=np.float32)
         else:
             return torch.zeros(element_count, dtype=torch.float32, device='cpu')
+
+class RWKVSession:
+    """
+    A bound evaluation session for fast token-by-token inference.
+
+    The session validates and pins its state and logits buffers once, caches raw pointers to them
+    and a prebuilt ctypes function handle, so `step` does nothing but the native call.
+    This removes Python wrapper overhead of `RWKVModel.eval`, which is a measurable share of per-token latency for small models.
+
+    The session holds a reference to the model. The model must not be freed while the session is in use.
+    """
+
+    def __init__(
+            self,
+            model: RWKVModel,
+            state: Optional[NumpyArrayOrPyTorchTensor] = None,
+            use_numpy: bool = False
+    ) -> None:
+        """
+        Creates a session. Prefer `RWKVModel.create_session` over calling this constructor directly.
+
+        Parameters
+        ----------
+        model : RWKVModel
+            Model to evaluate.
+        state : Optional[NumpyArrayOrTorchTensor]
+            Initial state, which will be copied into the session. If not set, the session starts from the initial model state.
+        use_numpy : bool
+            If set to True, numpy's ndarrays will be created instead of PyTorch's Tensors.
+        """
+
+        use_numpy = model._detect_numpy_usage([state], use_numpy)
+
+        self._model: RWKVModel = model
+
+        self._state: NumpyArrayOrPyTorchTensor = model._zeros_float32(model._state_buffer_element_count, use_numpy)
+        self._logits: NumpyArrayOrPyTorchTensor = model._zeros_float32(model._logits_buffer_element_count, use_numpy)
+
+        self._ctx_ptr = model._ctx.ptr
+        self._state_ptr = ctypes.cast(model._get_data_ptr(self._state), rwkv_cpp_shared_library.P_FLOAT)
+        self._logits_ptr = ctypes.cast(model._get_data_ptr(self._logits), rwkv_cpp_shared_library.P_FLOAT)
+        self._null_ptr = ctypes.cast(0, rwkv_cpp_shared_library.P_FLOAT)
+
+        self._eval = model._library.library.rwkv_eval
+        self._eval_and_sample = model._library.library.rwkv_eval_and_sample
+
+        self._token_out: ctypes.c_uint32 = ctypes.c_uint32()
+        self._token_out_ref = ctypes.byref(self._token_out)
+
+        self.reset(state)
+
+    @property
+    def state(self) -> NumpyArrayOrPyTorchTensor:
+        """
+        The pinned state buffer. It is overwritten by each call of `step`; copy it to keep a snapshot.
+        """
+
+        return self._state
+
+    @property
+    def logits(self) -> NumpyArrayOrPyTorchTensor:
+        """
+        The pinned logits buffer. It is overwritten by each call of `step`.
+        """
+
+        return self._logits
+
+    def reset(self, state: Optional[NumpyArrayOrPyTorchTensor] = None) -> None:
+        """
+        Resets the session to the given state, or to the initial model state.
+
+        Parameters
+        ----------
+        state : Optional[NumpyArrayOrTorchTensor]
+            State to be copied into the session.
+        """
+
+        # Logits are valid only after the session evaluates something.
+        self._logits_valid = False
+
+        if state is None:
+            self._state_in_ptr = self._null_ptr
+        else:
+            self._model._validate_tensor(state, 'state', self._model._state_buffer_element_count)
+
+            self._state[:] = state
+            self._state_in_ptr = self._state_ptr
+
+    def feed(self, tokens: rwkv_cpp_shared_library.Tokens, chunk_size: int = 16) -> NumpyArrayOrPyTorchTensor:
+        """
+        Evaluates the model for a sequence of tokens using `eval_sequence_in_chunks`, updating the session state in place.
+        In case of any error, this method will throw an exception.
+
+        Parameters
+        ----------
+        tokens : Tokens
+            Indices of the next tokens to be seen by the model. Must be in range 0 <= token < n_vocab.
+        chunk_size : int
+            Size of each chunk in tokens, must be positive.
+
+        Returns
+        -------
+        logits
+            The pinned logits buffer of shape (n_vocab).
+        """
+
+        self._model._library.rwkv_eval_sequence_in_chunks(
+            self._model._ctx,
+            tokens,
+            chunk_size,
+            None if self._state_in_ptr is self._null_ptr else self._model._get_data_ptr(self._state),
+            self._model._get_data_ptr(self._state),
+            self._model._get_data_ptr(self._logits)
+        )
+
+        self._state_in_ptr = self._state_ptr
+        self._logits_valid = True
+
+        return self._logits
+
+    def step(self, token: int) -> NumpyArrayOrPyTorchTensor:
+        """
+        Evaluates the model for a single token, updating the session state in place.
+        No validation is done besides the native one; in case of any error, this method will throw an exception.
+
+        Parameters
+        ----------
+        token : int
+            Index of next token to be seen by the model. Must be in range 0 <= token < n_vocab.
+
+        Returns
+        -------
+        logits
+            The pinned logits buffer of shape (n_vocab).
+        """
+
+        if not self._eval(self._ctx_ptr, token, self._state_in_ptr, self._state_ptr, self._logits_ptr):
+            raise ValueError('rwkv_eval failed, check stderr')
+
+        self._state_in_ptr = self._state_ptr
+        self._logits_valid = True
+
+        return self._logits
+
+    def step_and_sample(self, token: int, sampler: 'RWKVNativeSampler') -> int:
+        """
+        Evaluates the model for a single token, updating the session state in place, and samples the next token natively.
+        Logits are not copied into the session, so the `logits` buffer is not updated.
+        In case of any error, this method will throw an exception.
+
+        Parameters
+        ----------
+        token : int
+            Index of next token to be seen by the model. Must be in range 0 <= token < n_vocab.
+        sampler : RWKVNativeSampler
+            Sampler to use.
+
+        Returns
+        -------
+        int
+            Sampled token.
+        """
+
+        if not self._eval_and_sample(
+                self._ctx_ptr,
+                token,
+                self._state_in_ptr,
+                self._state_ptr,
+                self._null_ptr,
+                sampler._params_ref,
+                sampler._rng_state_ref,
+                self._token_out_ref
+        ):
+            raise ValueError('rwkv_eval_and_sample failed, check stderr')
+
+        self._state_in_ptr = self._state_ptr
+        self._logits_valid = False
+
+        next_token: int = self._token_out.value
+
+        sampler._accept(next_token)
+
+        return next_token
+
+class RWKVNativeSampler:
+    """
+    Sampler that runs in the shared library, see `rwkv_sample` in rwkv.h.
+
+    It can be called with logits like any other sampler. When it is passed to `RWKVModel.generate`, tokens are sampled
+    right after evaluation with `rwkv_eval_and_sample`, so logits never leave native memory.
+
+    Logits are adjusted by logit bias and penalties, then filtered by top-k and top-p, and then the temperature is applied.
+    """
+
+    def __init__(
+            self,
+            model: RWKVModel,
+            temperature: float = 1.0,
+            top_p: float = 1.0,
+            top_k: int = 0,
+            presence_penalty: float = 0.0,
+            frequency_penalty: float = 0.0,
+            logit_bias: Optional[Union[Dict[int, float], NumpyArrayOrPyTorchTensor]] = None,
+            token_counts: Optional[NumpyArrayOrPyTorchTensor] = None,
+            penalty: Optional[rwkv_cpp_penalty.RWKVTokenPenalty] = None,
+            seed: Optional[int] = None
+    ) -> None:
+        """
+        Creates a sampler.
+        In case of any error, this method will throw an exception.
+
+        Parameters
+        ----------
+        model : RWKVModel
+            Model whose logits will be sampled. Sampling uses scratch buffers of its context.
+        temperature : float
+            Temperature; 0 selects the token with the highest adjusted logit.
+        top_p : float
+            Tokens are sampled from the smallest set of most likely tokens with total probability above top_p. 0 or 1 disables top-p.
+        top_k : int
+            Tokens are sampled from top_k most likely tokens. 0 disables top-k.
+        presence_penalty : float
+            Subtracted from logits of tokens with non-zero count.
+        frequency_penalty : float
+            Multiplied by count of a token and subtracted from its logit.
+        logit_bias : Optional[Union[Dict[int, float], NumpyArrayOrTorchTensor]]
+            Values added to logits, as a dict from token to bias, or a float32 tensor of shape (n_vocab).
+        token_counts : Optional[NumpyArrayOrTorchTensor]
+            Counts of tokens for penalties, a float32 tensor of shape (n_vocab). It is read on each call, so it can be updated in place.
+            If not set and a penalty is non-zero, the sampler counts the tokens it samples.
+        penalty : Optional[RWKVTokenPenalty]
+            Penalty accumulator. If set, penalties and token counts are taken from it, and sampled tokens are added to it;
+            presence_penalty, frequency_penalty and token_counts must not be set then.
+        seed : Optional[int]
+            Seed of the random number generator. If not set, a random seed is used.
+        """
+
+        if not (temperature >= 0.0):
+            raise ValueError('Temperature must be >= 0')
+
+        if not (0.0 <= top_p <= 1.0):
+            raise ValueError('top_p must be in range [0, 1]')
+
+        if not (top_k >= 0):
+            raise ValueError('top_k must be >= 0')
+
+        self._model: RWKVModel = model
+
+        n_vocab: int = model._logits_buffer_element_count
+
+        if penalty is not None:
+            if presence_penalty != 0.0 or frequency_penalty != 0.0 or token_counts is not None:
+                raise ValueError('Penalties and token counts must not be set together with penalty accumulator')
+
+            presence_penalty = penalty.presence_penalty
+            frequency_penalty = penalty.frequency_penalty
+            token_counts = penalty.counts
+        elif token_counts is None and (presence_penalty != 0.0 or frequency_penalty != 0.0):
+            penalty = rwkv_cpp_penalty.RWKVTokenPenalty(n_vocab, presence_penalty, frequency_penalty)
+            token_counts = penalty.counts
+
+        self._params: rwkv_cpp_shared_library.RWKVSamplerParams = model._library.rwkv_init_sampler_params()
+        self._params.temperature = temperature
+        self._params.top_p = top_p
+        self._params.top_k = top_k
+        self._params.presence_penalty = presence_penalty
+        self._params.frequency_penalty = frequency_penalty
+
+        if isinstance(logit_bias, dict):
+            bias = model._zeros_float32(n_vocab, True)
+
+            for token, value in logit_bias.items():
+                bias[token] += value
+
+            logit_bias = bias
+
+        # Buffers are referenced by the params, so they must be kept alive.
+        self._logit_bias: Optional[NumpyArrayOrPyTorchTensor] = logit_bias
+        self._token_counts: Optional[NumpyArrayOrPyTorchTensor] = token_counts
+        self._penalty: Optional[rwkv_cpp_penalty.RWKVTokenPenalty] = penalty
+
+        if logit_bias is not None:
+            model._validate_tensor(logit_bias, 'logit_bias', n_vocab)
+            self._params.logit_bias = ctypes.cast(model._get_data_ptr(logit_bias), rwkv_cpp_shared_library.P_FLOAT)
+
+        if self._token_counts is not None:
+            model._validate_tensor(self._token_counts, 'token_counts', n_vocab)
+            self._params.token_counts = ctypes.cast(model._get_data_ptr(self._token_counts), rwkv_cpp_shared_library.P_FLOAT)
+
+        self._rng_state: ctypes.c_uint64 = ctypes.c_uint64(random.getrandbits(64) if seed is None else seed)
+
+        self._params_ref = ctypes.byref(self._params)
+        self._rng_state_ref = ctypes.byref(self._rng_state)
+
+    @property
+    def token_counts(self) -> Optional[NumpyArrayOrPyTorchTensor]:
+        """
+        Counts of tokens used for penalties, or None if penalties are not used.
+        """
+
+        return self._token_counts
+
+    def seed(self, seed: int) -> None:
+        """
+        Resets the random number generator to the given seed.
+        """
+
+        self._rng_state.value = seed
+
+    def __call__(self, logits: NumpyArrayOrPyTorchTensor) -> int:
+        """
+        Samples a token from logits of shape (n_vocab). Logits are not modified.
+        In case of any error, this method will throw an exception.
+        """
+
+        self._model._validate_tensor(logits, 'logits', self._model._logits_buffer_element_count)
+
+        token: int = self._model._library.rwkv_sample(self._model._ctx, self._model._get_data_ptr(logits), self._params, self._rng_state)
+
+        self._accept(token)
+
+        return token
+
+    def _accept(self, token: int) -> None:
+        if self._penalty is not None:
+            self._penalty.add(token)
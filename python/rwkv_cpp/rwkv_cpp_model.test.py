@@ -0,0 +1,84 @@
+import os
+import pathlib
+import numpy as np
+import rwkv_cpp_model
+import rwkv_cpp_shared_library
+from typing import Any, Dict, Iterator, List
+
+TESTS_DIR: pathlib.Path = pathlib.Path(os.path.abspath(__file__)).parent.parent.parent / 'tests'
+
+def decode(tokens: List[int]) -> str:
+    return bytes(tokens).decode('utf-8', errors='replace')
+
+def generate_text(model: rwkv_cpp_model.RWKVModel, prompt: List[int], **kwargs) -> str:
+    return ''.join(step.text for step in model.generate(prompt, **kwargs))
+
+def test() -> None:
+    library: rwkv_cpp_shared_library.RWKVSharedLibrary = rwkv_cpp_shared_library.load_rwkv_shared_library()
+
+    model = rwkv_cpp_model.RWKVModel(library, str(TESTS_DIR / 'tiny-rwkv-5v2-730K-FP32.bin'), thread_count=1)
+
+    prompt: List[int] = list('A long time ago, '.encode('utf-8'))
+
+    tokens: List[int] = [step.token for step in model.generate(prompt, max_tokens=20)]
+    full_text: str = decode(tokens)
+
+    # The text ends with 's', which may be the start of the stop string below, so it is held back until generation ends.
+    assert full_text.endswith('s'), full_text
+
+    decode_args: List[Dict[str, Any]] = [
+        {'decode': decode},
+        {'decode_bytes': bytes}
+    ]
+
+    for decode_arg in decode_args:
+        # Generation ends by max_tokens.
+        assert generate_text(model, prompt, max_tokens=20, **decode_arg) == full_text
+        assert generate_text(model, prompt, max_tokens=20, stop_strings=['sZZZ'], **decode_arg) == full_text
+
+        # A stop string that matches cuts the text.
+        assert generate_text(model, prompt, max_tokens=20, stop_strings=[' and'], **decode_arg) == full_text[:full_text.index(' and')]
+
+        # Generation ends by a stop token right after ' ', which may be the start of the stop string.
+        stop_text: str = full_text[:full_text.index('a')]
+
+        assert stop_text.endswith(' '), stop_text
+        assert generate_text(model, prompt, max_tokens=20, stop_tokens=[ord('a')], **decode_arg) == stop_text
+        assert generate_text(model, prompt, max_tokens=20, stop_tokens=[ord('a')], stop_strings=[' aZZZ'], **decode_arg) == stop_text
+
+        # Tokens that end in the middle of a UTF-8 character are decoded when generation ends.
+        def decode_with_invalid_bytes(tokens: List[int]) -> str:
+            return decode([0xC3 if token == ord('s') else token for token in tokens])
+
+        invalid_arg: Dict[str, Any] = {'decode': decode_with_invalid_bytes} if 'decode' in decode_arg else {'decode_bytes': lambda tokens: bytes(0xC3 if token == ord('s') else token for token in tokens)}
+
+        assert generate_text(model, prompt, max_tokens=20, **invalid_arg) == full_text.replace('s', '�')
+
+        # Closing the generator early evaluates all yielded tokens into the session.
+        for step_count in [1, 5, 19]:
+            session: rwkv_cpp_model.RWKVSession = model.create_session(use_numpy=True)
+            steps: Iterator[rwkv_cpp_model.RWKVGenerationStep] = model.generate(prompt, max_tokens=20, stop_strings=['sZZZ'], session=session, **decode_arg)
+
+            text: str = ''
+
+            for _ in range(step_count):
+                text += next(steps).text
+
+            steps.close()
+
+            # Text that may be the start of a stop string is not yielded on close.
+            yielded_text: str = decode(tokens[:step_count])
+
+            assert yielded_text.startswith(text) and len(yielded_text) - len(text) <= 1, text
+
+            expected_logits, expected_state = model.eval_sequence_in_chunks(prompt + tokens[:step_count], None, use_numpy=True)
+
+            assert np.array_equal(session.state, expected_state)
+            assert np.array_equal(session.logits, expected_logits)
+
+    model.free()
+
+    print('All tests pass')
+
+if __name__ == "__main__":
+    test()
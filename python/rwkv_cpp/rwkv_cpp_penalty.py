@@ -0,0 +1,224 @@
+import collections
+import numpy as np
+from typing import Optional, Callable, Iterable, Deque
+
+# Tokens whose decayed count falls below this value are not penalized anymore.
+MIN_DECAYED_COUNT: float = 0.01
+
+class RWKVTokenPenalty:
+    """
+    Presence and frequency penalties for the decode loop: logit of each token that was generated is reduced by
+    presence_penalty + count * frequency_penalty.
+
+    Counts are kept both in a dense float32 array of shape (n_vocab), which the native sampler reads directly,
+    and as an array of indices of tokens with non-zero count, so that penalties are applied in a single vectorized operation
+    over generated tokens only. Adding a token is O(1), unless decay is used.
+
+    Counts may be limited to a window of the most recent tokens, and may decay exponentially,
+    so that old tokens are penalized less.
+
+    Usage:
+
+    penalty = RWKVTokenPenalty(model.n_vocab, presence_penalty=0.2, frequency_penalty=0.2, window=256)
+
+    # With a Python sampler: penalties are applied to a copy of logits, and sampled tokens are counted.
+    model.generate(prompt_tokens, sampler=penalty.wrap(lambda logits: sampling.sample_logits(logits, 0.8, 0.5)))
+
+    # With the native sampler.
+    model.generate(prompt_tokens, sampler=RWKVNativeSampler(model, 0.8, 0.5, penalty=penalty))
+    """
+
+    def __init__(
+            self,
+            n_vocab: int,
+            presence_penalty: float = 0.0,
+            frequency_penalty: float = 0.0,
+            window: Optional[int] = None,
+            decay: float = 1.0
+    ) -> None:
+        """
+        Parameters
+        ----------
+        n_vocab : int
+            Vocabulary size.
+        presence_penalty : float
+            Subtracted from logits of tokens with non-zero count.
+        frequency_penalty : float
+            Multiplied by count of a token and subtracted from its logit.
+        window : Optional[int]
+            If set, only this many most recently added tokens are counted. Must be positive.
+        decay : float
+            Counts are multiplied by this factor each time a token is added, before counting it. Must be in range (0, 1].
+        """
+
+        if window is not None and not (window > 0):
+            raise ValueError('Window must be > 0')
+
+        if not (0.0 < decay <= 1.0):
+            raise ValueError('Decay must be in range (0, 1]')
+
+        self._n_vocab: int = n_vocab
+        self._presence_penalty: float = presence_penalty
+        self._frequency_penalty: float = frequency_penalty
+        self._window: Optional[int] = window
+        self._decay: float = decay
+
+        self._counts: np.ndarray = np.zeros(n_vocab, dtype=np.float32)
+
+        # Tokens with non-zero count are _active[:_active_count]; _positions maps a token to its index in _active.
+        self._active: np.ndarray = np.zeros(min(n_vocab, 64), dtype=np.int64)
+        self._active_count: int = 0
+        self._positions: np.ndarray = np.zeros(n_vocab, dtype=np.int64)
+
+        self._recent: Deque[int] = collections.deque()
+
+    @property
+    def presence_penalty(self) -> float:
+        return self._presence_penalty
+
+    @property
+    def frequency_penalty(self) -> float:
+        return self._frequency_penalty
+
+    @property
+    def counts(self) -> np.ndarray:
+        """
+        Dense counts of tokens, updated in place. Pass it as token_counts of the native sampler.
+        """
+
+        return self._counts
+
+    @property
+    def active_tokens(self) -> np.ndarray:
+        """
+        Tokens with non-zero count, in no particular order.
+        """
+
+        return self._active[:self._active_count]
+
+    def add(self, token: int) -> None:
+        """
+        Counts a generated token.
+        """
+
+        if self._decay != 1.0 and self._active_count > 0:
+            active: np.ndarray = self.active_tokens
+            self._counts[active] *= self._decay
+
+            expired: np.ndarray = active[self._counts[active] < MIN_DECAYED_COUNT]
+
+            for expired_token in expired:
+                self._counts[expired_token] = 0.0
+                self._deactivate(int(expired_token))
+
+        if self._counts[token] == 0.0:
+            self._activate(token)
+
+        self._counts[token] += 1.0
+
+        if self._window is not None:
+            self._recent.append(token)
+
+            if len(self._recent) > self._window:
+                self._remove(self._recent.popleft())
+
+    def add_tokens(self, tokens: Iterable[int]) -> None:
+        """
+        Counts generated tokens, in order.
+        """
+
+        for token in tokens:
+            self.add(int(token))
+
+    def reset(self) -> None:
+        """
+        Forgets all counted tokens.
+        """
+
+        self._counts[self.active_tokens] = 0.0
+        self._active_count = 0
+        self._recent.clear()
+
+    def apply(self, logits: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Applies penalties to logits of shape (n_vocab) or (B, n_vocab).
+
+        Parameters
+        ----------
+        logits : np.ndarray
+            Logits, which are not modified unless passed as out too.
+        out : Optional[np.ndarray]
+            Output array of the same shape. If not set, a copy of logits is created.
+
+        Returns
+        -------
+        np.ndarray
+            Logits with penalties applied.
+        """
+
+        if out is None:
+            out = np.array(logits, dtype=np.float32, copy=True)
+        elif out is not logits:
+            out[...] = logits
+
+        active: np.ndarray = self.active_tokens
+
+        if len(active) > 0:
+            out[..., active] -= self._presence_penalty + self._counts[active] * self._frequency_penalty
+
+        return out
+
+    def as_logit_bias(self) -> np.ndarray:
+        """
+        Returns penalties as a dense logit bias array of shape (n_vocab), for `sampling.sample_logits_batch`.
+        """
+
+        bias: np.ndarray = np.zeros(self._n_vocab, dtype=np.float32)
+
+        return self.apply(bias, bias)
+
+    def wrap(self, sampler: Callable[[np.ndarray], int]) -> Callable[[np.ndarray], int]:
+        """
+        Returns a sampler that applies penalties to a copy of logits, calls the given sampler and counts the sampled token.
+        """
+
+        def sample(logits) -> int:
+            if hasattr(logits, '__module__') and logits.__module__ == 'torch':
+                logits = logits.cpu().numpy()
+
+            token: int = int(sampler(self.apply(logits)))
+
+            self.add(token)
+
+            return token
+
+        return sample
+
+    def _activate(self, token: int) -> None:
+        if self._active_count == len(self._active):
+            self._active = np.resize(self._active, min(self._n_vocab, len(self._active) * 2))
+
+        self._active[self._active_count] = token
+        self._positions[token] = self._active_count
+        self._active_count += 1
+
+    def _deactivate(self, token: int) -> None:
+        # The last active token takes the place of the removed one.
+        position: int = int(self._positions[token])
+        last: int = int(self._active[self._active_count - 1])
+
+        self._active[position] = last
+        self._positions[last] = position
+        self._active_count -= 1
+
+    def _remove(self, token: int) -> None:
+        # With decay, the token may have expired already.
+        if self._counts[token] == 0.0:
+            return
+
+        # The count of the token that left the window has decayed over window steps.
+        self._counts[token] -= self._decay ** self._window
+
+        if self._counts[token] < MIN_DECAYED_COUNT:
+            self._counts[token] = 0.0
+            self._deactivate(token)
@@ -0,0 +1,104 @@
+import random
+import numpy as np
+import rwkv_cpp_penalty
+from typing import List, Optional
+
+N_VOCAB: int = 16
+
+def recount(tokens: List[int], window: Optional[int], decay: float) -> np.ndarray:
+    # Brute force: each of the last window tokens is counted with weight decay ** age, where the most recent token has age 0.
+    counts: np.ndarray = np.zeros(N_VOCAB, dtype=np.float64)
+    recent: List[int] = tokens if window is None else tokens[-window:]
+
+    for age, token in enumerate(reversed(recent)):
+        counts[token] += decay ** age
+
+    counts[counts < rwkv_cpp_penalty.MIN_DECAYED_COUNT] = 0.0
+
+    return counts
+
+def check(penalty: rwkv_cpp_penalty.RWKVTokenPenalty, tokens: List[int], window: Optional[int], decay: float) -> None:
+    expected: np.ndarray = recount(tokens, window, decay)
+
+    # Expired tokens may differ by less than the expiration threshold.
+    assert np.allclose(penalty.counts, expected, rtol=1e-5, atol=rwkv_cpp_penalty.MIN_DECAYED_COUNT), f'\nActual: {penalty.counts}\nExpected: {expected}'
+    assert sorted(penalty.active_tokens.tolist()) == np.flatnonzero(penalty.counts).tolist()
+
+def test() -> None:
+    random.seed(42)
+
+    presence_penalty: float = 0.5
+    frequency_penalty: float = 0.25
+
+    # Window only, decay only, both, and neither.
+    for window, decay in [(8, 1.0), (None, 0.8), (8, 0.7), (5, 0.5), (None, 1.0)]:
+        penalty = rwkv_cpp_penalty.RWKVTokenPenalty(N_VOCAB, presence_penalty, frequency_penalty, window=window, decay=decay)
+        tokens: List[int] = []
+
+        for _ in range(300):
+            # A few tokens are frequent, so that some counts grow and others expire.
+            token: int = random.choice([0, 1, 2, 3]) if random.random() < 0.7 else random.randrange(N_VOCAB)
+            tokens.append(token)
+            penalty.add(token)
+
+            check(penalty, tokens, window, decay)
+
+        # Penalties are applied to (n_vocab) and (B, n_vocab) logits, into a copy or in place.
+        expected_penalties: np.ndarray = (penalty.counts > 0) * presence_penalty + penalty.counts * frequency_penalty
+
+        logits: np.ndarray = np.random.default_rng(0).normal(size=(3, N_VOCAB)).astype(np.float32)
+        logits_copy: np.ndarray = logits.copy()
+
+        assert np.allclose(penalty.apply(logits), logits_copy - expected_penalties)
+        assert np.allclose(penalty.apply(logits[0]), logits_copy[0] - expected_penalties)
+        assert np.array_equal(logits, logits_copy), 'Logits were modified'
+
+        result: np.ndarray = penalty.apply(logits, out=logits)
+        assert result is logits and np.allclose(logits, logits_copy - expected_penalties)
+
+        row: np.ndarray = logits_copy[1].copy()
+        result = penalty.apply(row, out=row)
+        assert result is row and np.allclose(row, logits_copy[1] - expected_penalties)
+
+        out: np.ndarray = np.zeros_like(logits_copy)
+        assert penalty.apply(logits_copy, out=out) is out and np.allclose(out, logits_copy - expected_penalties)
+
+        assert np.allclose(penalty.as_logit_bias(), -expected_penalties)
+
+        # After reset, only tokens added since then are counted.
+        penalty.reset()
+
+        assert not np.any(penalty.counts) and len(penalty.active_tokens) == 0
+        assert np.array_equal(penalty.apply(logits_copy), logits_copy)
+
+        tokens = []
+
+        for token in [5, 5, 6, 5, 7, 8, 9, 10, 11, 5]:
+            tokens.append(token)
+            penalty.add(token)
+
+            check(penalty, tokens, window, decay)
+
+    # The sampler wrapper counts sampled tokens.
+    penalty = rwkv_cpp_penalty.RWKVTokenPenalty(N_VOCAB, presence_penalty, frequency_penalty)
+    sampler = penalty.wrap(lambda logits: int(np.argmax(logits)))
+
+    logits = np.zeros(N_VOCAB, dtype=np.float32)
+    logits[3] = 0.5
+
+    assert sampler(logits) == 3
+    # The penalty of 0.75 makes token 3 less likely than token 0.
+    assert sampler(logits) == 0
+    assert penalty.counts[3] == 1.0 and penalty.counts[0] == 1.0 and logits[3] == 0.5
+
+    for kwargs in [{'window': 0}, {'decay': 0.0}, {'decay': 1.5}]:
+        try:
+            rwkv_cpp_penalty.RWKVTokenPenalty(N_VOCAB, **kwargs)
+            assert False, f'Invalid parameters were accepted: {kwargs}'
+        except ValueError:
+            pass
+
+    print('All tests pass')
+
+if __name__ == "__main__":
+    test()
@@ -3,7 +3,7 @@ import sys
 import ctypes
 import pathlib
 import platform
-from typing import Optional, List, Tuple, Callable
+from typing import Optional, List, Tuple, Callable, Union, Any, Dict
 
 QUANTIZED_FORMAT_NAMES: Tuple[str, str, str, str, str] = (
     'Q4_0',
@@ -15,8 +15,92 @@ QUANTIZED_FORMAT_NAMES: Tuple[str, str, str, str, str] = (
     'Q8_0'
 )
 
+# Supported model file format versions, see RWKV_FILE_VERSION_* in rwkv.h. The last one is written by default.
+FILE_VERSIONS: Tuple[int, int, int] = (100, 101, 102)
+
+# Values of rwkv_mmap_hint enum, see rwkv.h.
+MMAP_HINTS: Dict[str, int] = {
+    'none': 0,
+    'willneed': 1,
+    'populate': 2
+}
+
 P_FLOAT = ctypes.POINTER(ctypes.c_float)
 P_INT = ctypes.POINTER(ctypes.c_int32)
+P_UINT = ctypes.POINTER(ctypes.c_uint32)
+
+# Token indices: a list of ints, a contiguous numpy uint32 array or any other object supporting the buffer protocol with uint32 items.
+# Arrays and buffers of uint32 are passed to the library without copying.
+Tokens = Union[List[int], Any]
+
+def _get_tokens_pointer(tokens: Tokens) -> Tuple[P_UINT, int, Any]:
+    """
+    Returns a pointer to the first token, token count and an object that must be kept alive while the pointer is in use.
+    """
+
+    if hasattr(tokens, '__array_interface__'):
+        # numpy arrays, and anything that pretends to be one.
+        import numpy as np
+
+        array = np.ascontiguousarray(tokens, dtype=np.uint32)
+
+        return array.ctypes.data_as(P_UINT), array.size, array
+
+    if not isinstance(tokens, (list, tuple)):
+        try:
+            view: memoryview = memoryview(tokens)
+        except TypeError:
+            view = None
+
+        if view is not None and view.format in ('I', '=I', '<I') and view.itemsize == 4 and view.c_contiguous:
+            count: int = view.nbytes // 4
+
+            if view.readonly:
+                # ctypes can not point into read-only buffers.
+                buffer = (ctypes.c_uint32 * count).from_buffer_copy(view)
+            else:
+                buffer = (ctypes.c_uint32 * count).from_buffer(view)
+
+            return ctypes.cast(buffer, P_UINT), count, buffer
+
+    buffer = (ctypes.c_uint32 * len(tokens))(*tokens)
+
+    return ctypes.cast(buffer, P_UINT), len(tokens), buffer
+
+class RWKVGraphStats(ctypes.Structure):
+    _fields_ = [
+        ('build_count', ctypes.c_uint64),
+        ('build_time_us', ctypes.c_uint64),
+        ('alloc_count', ctypes.c_uint64),
+        ('alloc_time_us', ctypes.c_uint64),
+        ('sequence_graph_hits', ctypes.c_uint64),
+        ('sequence_graph_misses', ctypes.c_uint64)
+    ]
+
+class RWKVSamplerParams(ctypes.Structure):
+    _fields_ = [
+        ('temperature', ctypes.c_float),
+        ('top_p', ctypes.c_float),
+        ('top_k', ctypes.c_uint32),
+        ('presence_penalty', ctypes.c_float),
+        ('frequency_penalty', ctypes.c_float),
+        ('logit_bias', P_FLOAT),
+        ('token_counts', P_FLOAT)
+    ]
+
+# Type of rwkv_progress_callback, see rwkv.h.
+RWKV_PROGRESS_CALLBACK = ctypes.CFUNCTYPE(None, ctypes.c_float, ctypes.c_void_p)
+
+class RWKVLoadParams(ctypes.Structure):
+    _fields_ = [
+        ('n_threads', ctypes.c_uint32),
+        ('n_gpu_layers', ctypes.c_uint32),
+        ('use_mmap', ctypes.c_bool),
+        ('mmap_hint', ctypes.c_int),
+        ('n_load_threads', ctypes.c_uint32),
+        ('progress_callback', RWKV_PROGRESS_CALLBACK),
+        ('progress_callback_user_data', ctypes.c_void_p)
+    ]
 
 class RWKVContext:
 
@@ -49,9 +133,18 @@ class RWKVSharedLibrary:
         self.library.rwkv_init_from_file.argtypes = [ctypes.c_char_p, ctypes.c_uint32, ctypes.c_uint32]
         self.library.rwkv_init_from_file.restype = ctypes.c_void_p
 
+        self.library.rwkv_init_load_params.argtypes = [ctypes.POINTER(RWKVLoadParams)]
+        self.library.rwkv_init_load_params.restype = None
+
+        self.library.rwkv_init_from_file_with_params.argtypes = [ctypes.c_char_p, ctypes.POINTER(RWKVLoadParams)]
+        self.library.rwkv_init_from_file_with_params.restype = ctypes.c_void_p
+
+        self.library.rwkv_clone_context.argtypes = [ctypes.c_void_p, ctypes.c_uint32]
+        self.library.rwkv_clone_context.restype = ctypes.c_void_p
+
         self.library.rwkv_eval.argtypes = [
             ctypes.c_void_p, # ctx
-            ctypes.c_int32, # token
+            ctypes.c_uint32, # token
             P_FLOAT, # state_in
             P_FLOAT, # state_out
             P_FLOAT  # logits_out
@@ -60,7 +153,7 @@ class RWKVSharedLibrary:
 
         self.library.rwkv_eval_sequence.argtypes = [
             ctypes.c_void_p, # ctx
-            P_INT, # tokens
+            P_UINT, # tokens
             ctypes.c_size_t, # token count
             P_FLOAT, # state_in
             P_FLOAT, # state_out
@@ -68,9 +161,46 @@ class RWKVSharedLibrary:
         ]
         self.library.rwkv_eval_sequence.restype = ctypes.c_bool
 
+        self.library.rwkv_eval_sequence_logits.argtypes = [
+            ctypes.c_void_p, # ctx
+            P_UINT, # tokens
+            ctypes.c_size_t, # token count
+            P_UINT, # positions
+            ctypes.c_size_t, # position count
+            P_FLOAT, # state_in
+            P_FLOAT, # state_out
+            P_FLOAT  # logits_out
+        ]
+        self.library.rwkv_eval_sequence_logits.restype = ctypes.c_bool
+
+        self.library.rwkv_eval_sequence_logprobs.argtypes = [
+            ctypes.c_void_p, # ctx
+            P_UINT, # tokens
+            ctypes.c_size_t, # token count
+            P_UINT, # targets
+            P_FLOAT, # state_in
+            P_FLOAT, # state_out
+            P_FLOAT, # logprobs_out
+            ctypes.POINTER(ctypes.c_double)  # loss_out
+        ]
+        self.library.rwkv_eval_sequence_logprobs.restype = ctypes.c_bool
+
+        self.library.rwkv_eval_sequence_logprobs_in_chunks.argtypes = [
+            ctypes.c_void_p, # ctx
+            P_UINT, # tokens
+            ctypes.c_size_t, # token count
+            P_UINT, # targets
+            ctypes.c_size_t, # chunk size
+            P_FLOAT, # state_in
+            P_FLOAT, # state_out
+            P_FLOAT, # logprobs_out
+            ctypes.POINTER(ctypes.c_double)  # loss_out
+        ]
+        self.library.rwkv_eval_sequence_logprobs_in_chunks.restype = ctypes.c_bool
+
         self.library.rwkv_eval_sequence_in_chunks.argtypes = [
             ctypes.c_void_p, # ctx
-            P_INT, # tokens
+            P_UINT, # tokens
             ctypes.c_size_t, # token count
             ctypes.c_size_t, # chunk size
             P_FLOAT, # state_in
@@ -79,6 +209,46 @@ class RWKVSharedLibrary:
         ]
         self.library.rwkv_eval_sequence_in_chunks.restype = ctypes.c_bool
 
+        self.library.rwkv_eval_batch.argtypes = [
+            ctypes.c_void_p, # ctx
+            P_UINT, # tokens
+            ctypes.c_size_t, # batch size
+            P_FLOAT, # state_in
+            P_FLOAT, # state_out
+            P_FLOAT  # logits_out
+        ]
+        self.library.rwkv_eval_batch.restype = ctypes.c_bool
+
+        self.library.rwkv_set_sequence_graph_cache_capacity.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+        self.library.rwkv_set_sequence_graph_cache_capacity.restype = ctypes.c_bool
+
+        self.library.rwkv_get_graph_stats.argtypes = [ctypes.c_void_p, ctypes.POINTER(RWKVGraphStats)]
+        self.library.rwkv_get_graph_stats.restype = None
+
+        self.library.rwkv_init_sampler_params.argtypes = [ctypes.POINTER(RWKVSamplerParams)]
+        self.library.rwkv_init_sampler_params.restype = None
+
+        self.library.rwkv_sample.argtypes = [
+            ctypes.c_void_p, # ctx
+            P_FLOAT, # logits
+            ctypes.POINTER(RWKVSamplerParams), # params
+            ctypes.POINTER(ctypes.c_uint64), # rng_state
+            P_UINT # token_out
+        ]
+        self.library.rwkv_sample.restype = ctypes.c_bool
+
+        self.library.rwkv_eval_and_sample.argtypes = [
+            ctypes.c_void_p, # ctx
+            ctypes.c_uint32, # token
+            P_FLOAT, # state_in
+            P_FLOAT, # state_out
+            P_FLOAT, # logits_out
+            ctypes.POINTER(RWKVSamplerParams), # params
+            ctypes.POINTER(ctypes.c_uint64), # rng_state
+            P_UINT # token_out
+        ]
+        self.library.rwkv_eval_and_sample.restype = ctypes.c_bool
+
         self.library.rwkv_get_n_vocab.argtypes = [ctypes.c_void_p]
         self.library.rwkv_get_n_vocab.restype = ctypes.c_size_t
 
@@ -103,6 +273,15 @@ class RWKVSharedLibrary:
         self.library.rwkv_quantize_model_file.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p]
         self.library.rwkv_quantize_model_file.restype = ctypes.c_bool
 
+        self.library.rwkv_tensor_needs_quantization.argtypes = [ctypes.c_char_p, ctypes.c_uint32]
+        self.library.rwkv_tensor_needs_quantization.restype = ctypes.c_bool
+
+        self.library.rwkv_quantize_tensor_data.argtypes = [ctypes.c_char_p, P_FLOAT, ctypes.c_void_p, ctypes.c_size_t, ctypes.c_size_t]
+        self.library.rwkv_quantize_tensor_data.restype = ctypes.c_size_t
+
+        self.library.rwkv_convert_model_file_version.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_uint32]
+        self.library.rwkv_convert_model_file_version.restype = ctypes.c_bool
+
         self.library.rwkv_get_system_info_string.argtypes = []
         self.library.rwkv_get_system_info_string.restype = ctypes.c_char_p
 
@@ -128,6 +307,63 @@ class RWKVSharedLibrary:
 
         return RWKVContext(ptr)
 
+    def rwkv_init_load_params(self) -> RWKVLoadParams:
+        """
+        Returns load params filled with defaults.
+        See `rwkv_load_params` struct in rwkv.h for descriptions of fields.
+        """
+
+        params = RWKVLoadParams()
+
+        self.library.rwkv_init_load_params(ctypes.byref(params))
+
+        return params
+
+    def rwkv_init_from_file_with_params(self, model_file_path: str, params: RWKVLoadParams) -> RWKVContext:
+        """
+        Loads the model from a file and prepares it for inference, like `rwkv_init_from_file`, with more parameters.
+        Throws an exception in case of any error. Error messages would be printed to stderr.
+
+        Parameters
+        ----------
+        model_file_path : str
+            Path to model file in ggml format.
+        params : RWKVLoadParams
+            Load params, see `rwkv_init_load_params`.
+        """
+
+        ptr = self.library.rwkv_init_from_file_with_params(model_file_path.encode('utf-8'), ctypes.byref(params))
+
+        if ptr is None:
+            raise ValueError('rwkv_init_from_file_with_params failed, check stderr')
+
+        return RWKVContext(ptr)
+
+    def rwkv_clone_context(self, ctx: RWKVContext, thread_count: int) -> RWKVContext:
+        """
+        Creates a new context from an existing one.
+        The new context shares model weights with the existing one, so only per-context buffers are allocated.
+        The model weights are freed when the last context that uses them is freed.
+        Throws an exception in case of any error. Error messages would be printed to stderr.
+
+        Like all other functions of the library, this function releases the GIL while running native code,
+        so evaluations on different contexts can run in parallel on Python threads.
+
+        Parameters
+        ----------
+        ctx : RWKVContext
+            RWKV context to be cloned.
+        thread_count : int
+            Count of threads to use in the new context, must be positive.
+        """
+
+        ptr = self.library.rwkv_clone_context(ctx.ptr, ctypes.c_uint32(thread_count))
+
+        if ptr is None:
+            raise ValueError('rwkv_clone_context failed, check stderr')
+
+        return RWKVContext(ptr)
+
     def rwkv_eval(
             self,
             ctx: RWKVContext,
@@ -157,7 +393,7 @@ class RWKVSharedLibrary:
 
         if not self.library.rwkv_eval(
             ctx.ptr,
-            ctypes.c_int32(token),
+            ctypes.c_uint32(token),
             ctypes.cast(0 if state_in_address is None else state_in_address, P_FLOAT),
             ctypes.cast(state_out_address, P_FLOAT),
             ctypes.cast(logits_out_address, P_FLOAT)
@@ -167,7 +403,7 @@ class RWKVSharedLibrary:
     def rwkv_eval_sequence(
             self,
             ctx: RWKVContext,
-            tokens: List[int],
+            tokens: Tokens,
             state_in_address: Optional[int],
             state_out_address: int,
             logits_out_address: int
@@ -193,8 +429,9 @@ class RWKVSharedLibrary:
         ----------
         ctx : RWKVContext
             RWKV context obtained from rwkv_init_from_file.
-        tokens : List[int]
+        tokens : Tokens
             Next token indices, in range 0 <= token < n_vocab.
+            A contiguous numpy uint32 array or a uint32 buffer is passed to the library without copying.
         state_in_address : int
             Address of the first element of a FP32 buffer of size rwkv_get_state_buffer_element_count; or None, if this is a first pass.
         state_out_address : int
@@ -203,20 +440,204 @@ class RWKVSharedLibrary:
             Address of the first element of a FP32 buffer of size rwkv_get_logits_buffer_element_count. This buffer will be written to.
         """
 
+        tokens_ptr, token_count, _tokens_buffer = _get_tokens_pointer(tokens)
+
         if not self.library.rwkv_eval_sequence(
             ctx.ptr,
-            ctypes.cast((ctypes.c_int32 * len(tokens))(*tokens), P_INT),
-            ctypes.c_size_t(len(tokens)),
+            tokens_ptr,
+            ctypes.c_size_t(token_count),
             ctypes.cast(0 if state_in_address is None else state_in_address, P_FLOAT),
             ctypes.cast(state_out_address, P_FLOAT),
             ctypes.cast(logits_out_address, P_FLOAT)
         ):
             raise ValueError('rwkv_eval_sequence failed, check stderr')
 
+    def rwkv_eval_sequence_logits(
+            self,
+            ctx: RWKVContext,
+            tokens: Tokens,
+            positions: Optional[Tokens],
+            state_in_address: Optional[int],
+            state_out_address: Optional[int],
+            logits_out_address: int
+    ) -> None:
+        """
+        Evaluates the model for a sequence of tokens, like `rwkv_eval_sequence`, but writes logits for multiple positions of the sequence,
+        all computed in one graph execution. Logits at position i are the model's prediction for the token following tokens[i].
+        Useful for teacher-forced scoring, like perplexity measurement or reranking.
+        The same node limit as in `rwkv_eval_sequence` applies.
+
+        Not thread-safe. For parallel inference, call `rwkv_clone_context` to create one rwkv_context for each thread.
+        Throws an exception in case of any error. Error messages would be printed to stderr.
+
+        Parameters
+        ----------
+        ctx : RWKVContext
+            RWKV context obtained from rwkv_init_from_file.
+        tokens : Tokens
+            Next token indices, in range 0 <= token < n_vocab.
+        positions : Optional[Tokens]
+            Positions in the sequence to compute logits for, in range 0 <= position < len(tokens); or None for all positions.
+        state_in_address : int
+            Address of the first element of a FP32 buffer of size rwkv_get_state_buffer_element_count; or None, if this is a first pass.
+        state_out_address : int
+            Address of the first element of a FP32 buffer of size rwkv_get_state_buffer_element_count; or None, if the state is not needed.
+            This buffer will be written to.
+        logits_out_address : int
+            Address of the first element of a FP32 buffer of size position count * rwkv_get_logits_buffer_element_count. This buffer will be written to.
+        """
+
+        tokens_ptr, token_count, _tokens_buffer = _get_tokens_pointer(tokens)
+
+        if positions is not None:
+            positions_ptr, position_count, _positions_buffer = _get_tokens_pointer(positions)
+        else:
+            positions_ptr, position_count = ctypes.cast(0, P_UINT), 0
+
+        if not self.library.rwkv_eval_sequence_logits(
+            ctx.ptr,
+            tokens_ptr,
+            ctypes.c_size_t(token_count),
+            positions_ptr,
+            ctypes.c_size_t(position_count),
+            ctypes.cast(0 if state_in_address is None else state_in_address, P_FLOAT),
+            ctypes.cast(0 if state_out_address is None else state_out_address, P_FLOAT),
+            ctypes.cast(logits_out_address, P_FLOAT)
+        ):
+            raise ValueError('rwkv_eval_sequence_logits failed, check stderr')
+
+    def rwkv_eval_sequence_logprobs(
+            self,
+            ctx: RWKVContext,
+            tokens: Tokens,
+            targets: Tokens,
+            state_in_address: Optional[int],
+            state_out_address: Optional[int],
+            logprobs_out_address: Optional[int]
+    ) -> float:
+        """
+        Evaluates the model for a sequence of tokens and scores the target tokens: for each position i, writes log-probability of targets[i]
+        according to the model's prediction for the token following tokens[i]. Log-softmax is computed natively,
+        so only one float per position is copied out instead of full vocabulary logits.
+        The same node limit as in `rwkv_eval_sequence` applies.
+
+        Not thread-safe. For parallel inference, call `rwkv_clone_context` to create one rwkv_context for each thread.
+        Throws an exception in case of any error. Error messages would be printed to stderr.
+
+        Parameters
+        ----------
+        ctx : RWKVContext
+            RWKV context obtained from rwkv_init_from_file.
+        tokens : Tokens
+            Next token indices, in range 0 <= token < n_vocab.
+        targets : Tokens
+            Target token indices, one for each token, in range 0 <= target < n_vocab.
+        state_in_address : int
+            Address of the first element of a FP32 buffer of size rwkv_get_state_buffer_element_count; or None, if this is a first pass.
+        state_out_address : int
+            Address of the first element of a FP32 buffer of size rwkv_get_state_buffer_element_count; or None, if the state is not needed.
+            This buffer will be written to.
+        logprobs_out_address : int
+            Address of the first element of a FP32 buffer of size len(tokens); or None, if per-position log-probabilities are not needed.
+            This buffer will be written to.
+
+        Returns
+        -------
+        float
+            Summed negative log-probability of all targets.
+        """
+
+        tokens_ptr, token_count, _tokens_buffer = _get_tokens_pointer(tokens)
+        targets_ptr, target_count, _targets_buffer = _get_tokens_pointer(targets)
+
+        if target_count != token_count:
+            raise ValueError(f'Target count {target_count} does not match token count {token_count}')
+
+        loss = ctypes.c_double(0.0)
+
+        if not self.library.rwkv_eval_sequence_logprobs(
+            ctx.ptr,
+            tokens_ptr,
+            ctypes.c_size_t(token_count),
+            targets_ptr,
+            ctypes.cast(0 if state_in_address is None else state_in_address, P_FLOAT),
+            ctypes.cast(0 if state_out_address is None else state_out_address, P_FLOAT),
+            ctypes.cast(0 if logprobs_out_address is None else logprobs_out_address, P_FLOAT),
+            ctypes.byref(loss)
+        ):
+            raise ValueError('rwkv_eval_sequence_logprobs failed, check stderr')
+
+        return loss.value
+
+    def rwkv_eval_sequence_logprobs_in_chunks(
+            self,
+            ctx: RWKVContext,
+            tokens: Tokens,
+            targets: Tokens,
+            chunk_size: int,
+            state_in_address: Optional[int],
+            state_out_address: Optional[int],
+            logprobs_out_address: Optional[int]
+    ) -> float:
+        """
+        Scores the target tokens like `rwkv_eval_sequence_logprobs`, splitting a potentially long sequence into chunks
+        the same way as `rwkv_eval_sequence_in_chunks`. Use it to score whole documents without reaching the node limit.
+
+        Not thread-safe. For parallel inference, call `rwkv_clone_context` to create one rwkv_context for each thread.
+        Throws an exception in case of any error. Error messages would be printed to stderr.
+
+        Parameters
+        ----------
+        ctx : RWKVContext
+            RWKV context obtained from rwkv_init_from_file.
+        tokens : Tokens
+            Next token indices, in range 0 <= token < n_vocab.
+        targets : Tokens
+            Target token indices, one for each token, in range 0 <= target < n_vocab.
+        chunk_size : int
+            Size of each chunk in tokens, must be positive.
+        state_in_address : int
+            Address of the first element of a FP32 buffer of size rwkv_get_state_buffer_element_count; or None, if this is a first pass.
+        state_out_address : int
+            Address of the first element of a FP32 buffer of size rwkv_get_state_buffer_element_count; or None, if the state is not needed.
+            This buffer will be written to.
+        logprobs_out_address : int
+            Address of the first element of a FP32 buffer of size len(tokens); or None, if per-position log-probabilities are not needed.
+            This buffer will be written to.
+
+        Returns
+        -------
+        float
+            Summed negative log-probability of all targets.
+        """
+
+        tokens_ptr, token_count, _tokens_buffer = _get_tokens_pointer(tokens)
+        targets_ptr, target_count, _targets_buffer = _get_tokens_pointer(targets)
+
+        if target_count != token_count:
+            raise ValueError(f'Target count {target_count} does not match token count {token_count}')
+
+        loss = ctypes.c_double(0.0)
+
+        if not self.library.rwkv_eval_sequence_logprobs_in_chunks(
+            ctx.ptr,
+            tokens_ptr,
+            ctypes.c_size_t(token_count),
+            targets_ptr,
+            ctypes.c_size_t(chunk_size),
+            ctypes.cast(0 if state_in_address is None else state_in_address, P_FLOAT),
+            ctypes.cast(0 if state_out_address is None else state_out_address, P_FLOAT),
+            ctypes.cast(0 if logprobs_out_address is None else logprobs_out_address, P_FLOAT),
+            ctypes.byref(loss)
+        ):
+            raise ValueError('rwkv_eval_sequence_logprobs_in_chunks failed, check stderr')
+
+        return loss.value
+
     def rwkv_eval_sequence_in_chunks(
             self,
             ctx: RWKVContext,
-            tokens: List[int],
+            tokens: Tokens,
             chunk_size: int,
             state_in_address: Optional[int],
             state_out_address: int,
@@ -238,8 +659,9 @@ class RWKVSharedLibrary:
         ----------
         ctx : RWKVContext
             RWKV context obtained from rwkv_init_from_file.
-        tokens : List[int]
+        tokens : Tokens
             Next token indices, in range 0 <= token < n_vocab.
+            A contiguous numpy uint32 array or a uint32 buffer is passed to the library without copying.
         chunk_size : int
             Size of each chunk in tokens, must be positive.
         state_in_address : int
@@ -250,10 +672,12 @@ class RWKVSharedLibrary:
             Address of the first element of a FP32 buffer of size rwkv_get_logits_buffer_element_count. This buffer will be written to.
         """
 
+        tokens_ptr, token_count, _tokens_buffer = _get_tokens_pointer(tokens)
+
         if not self.library.rwkv_eval_sequence_in_chunks(
             ctx.ptr,
-            ctypes.cast((ctypes.c_int32 * len(tokens))(*tokens), P_INT),
-            ctypes.c_size_t(len(tokens)),
+            tokens_ptr,
+            ctypes.c_size_t(token_count),
             ctypes.c_size_t(chunk_size),
             ctypes.cast(0 if state_in_address is None else state_in_address, P_FLOAT),
             ctypes.cast(state_out_address, P_FLOAT),
@@ -261,6 +685,191 @@ class RWKVSharedLibrary:
         ):
             raise ValueError('rwkv_eval_sequence_in_chunks failed, check stderr')
 
+    def rwkv_eval_batch(
+            self,
+            ctx: RWKVContext,
+            tokens: Tokens,
+            state_in_address: Optional[int],
+            state_out_address: int,
+            logits_out_address: Optional[int]
+    ) -> None:
+        """
+        Evaluates the model for a batch of independent sequences, advancing each sequence's state by a single token.
+        All sequences share a single pass over the model weights, which is much faster than calling `rwkv_eval` for each sequence.
+        Has to build a computation graph on the first call for a given batch size, but will use this cached graph for subsequent calls of the same batch size.
+
+        Not thread-safe. For parallel inference, call `rwkv_clone_context` to create one rwkv_context for each thread.
+        Throws an exception in case of any error. Error messages would be printed to stderr.
+
+        Parameters
+        ----------
+        ctx : RWKVContext
+            RWKV context obtained from rwkv_init_from_file.
+        tokens : Tokens
+            Next token index for each sequence, in range 0 <= token < n_vocab.
+        state_in_address : int
+            Address of the first element of a FP32 buffer of size len(tokens) * rwkv_get_state_buffer_element_count,
+            with states of sequences stored one after another; or None, if this is a first pass.
+        state_out_address : int
+            Address of the first element of a FP32 buffer of size len(tokens) * rwkv_get_state_buffer_element_count. This buffer will be written to.
+        logits_out_address : int
+            Address of the first element of a FP32 buffer of size len(tokens) * rwkv_get_logits_buffer_element_count; or None, if logits are not needed.
+            This buffer will be written to.
+        """
+
+        tokens_ptr, token_count, _tokens_buffer = _get_tokens_pointer(tokens)
+
+        if not self.library.rwkv_eval_batch(
+            ctx.ptr,
+            tokens_ptr,
+            ctypes.c_size_t(token_count),
+            ctypes.cast(0 if state_in_address is None else state_in_address, P_FLOAT),
+            ctypes.cast(state_out_address, P_FLOAT),
+            ctypes.cast(0 if logits_out_address is None else logits_out_address, P_FLOAT)
+        ):
+            raise ValueError('rwkv_eval_batch failed, check stderr')
+
+    def rwkv_set_sequence_graph_cache_capacity(self, ctx: RWKVContext, capacity: int) -> None:
+        """
+        Sets how many sequence graphs, each for a different sequence length, are kept in the context. The default is 8.
+        When the cache is full, the least recently used graph is freed.
+        Throws an exception in case of any error. Error messages would be printed to stderr.
+
+        Parameters
+        ----------
+        ctx : RWKVContext
+            RWKV context obtained from rwkv_init_from_file.
+        capacity : int
+            Max count of cached sequence graphs, must be positive.
+        """
+
+        if not self.library.rwkv_set_sequence_graph_cache_capacity(ctx.ptr, ctypes.c_size_t(capacity)):
+            raise ValueError('rwkv_set_sequence_graph_cache_capacity failed, check stderr')
+
+    def rwkv_get_graph_stats(self, ctx: RWKVContext) -> Dict[str, int]:
+        """
+        Returns counters of computation graph builds and allocations, accumulated over the lifetime of the context.
+        Keys are field names of `rwkv_graph_stats` struct in rwkv.h; times are in microseconds.
+
+        Parameters
+        ----------
+        ctx : RWKVContext
+            RWKV context obtained from rwkv_init_from_file.
+        """
+
+        stats = RWKVGraphStats()
+
+        self.library.rwkv_get_graph_stats(ctx.ptr, ctypes.byref(stats))
+
+        return {name: getattr(stats, name) for name, _ in RWKVGraphStats._fields_}
+
+    def rwkv_init_sampler_params(self) -> RWKVSamplerParams:
+        """
+        Returns sampler params filled with defaults, which correspond to sampling from the unmodified distribution.
+        See `rwkv_sampler_params` struct in rwkv.h for descriptions of fields.
+        """
+
+        params = RWKVSamplerParams()
+
+        self.library.rwkv_init_sampler_params(ctypes.byref(params))
+
+        return params
+
+    def rwkv_sample(
+            self,
+            ctx: RWKVContext,
+            logits_address: int,
+            params: RWKVSamplerParams,
+            rng_state: Optional[ctypes.c_uint64]
+    ) -> int:
+        """
+        Samples a token from logits.
+        Throws an exception in case of any error. Error messages would be printed to stderr.
+
+        Parameters
+        ----------
+        ctx : RWKVContext
+            RWKV context obtained from rwkv_init_from_file.
+        logits_address : int
+            Address of the first element of a FP32 buffer of size rwkv_get_logits_buffer_element_count.
+        params : RWKVSamplerParams
+            Sampler params, see rwkv_init_sampler_params.
+        rng_state : Optional[ctypes.c_uint64]
+            State of the random number generator, which is advanced by each call. May be None if temperature is 0.
+
+        Returns
+        -------
+        int
+            Sampled token.
+        """
+
+        token = ctypes.c_uint32()
+
+        if not self.library.rwkv_sample(
+            ctx.ptr,
+            ctypes.cast(logits_address, P_FLOAT),
+            ctypes.byref(params),
+            None if rng_state is None else ctypes.byref(rng_state),
+            ctypes.byref(token)
+        ):
+            raise ValueError('rwkv_sample failed, check stderr')
+
+        return token.value
+
+    def rwkv_eval_and_sample(
+            self,
+            ctx: RWKVContext,
+            token: int,
+            state_in_address: Optional[int],
+            state_out_address: int,
+            logits_out_address: Optional[int],
+            params: RWKVSamplerParams,
+            rng_state: Optional[ctypes.c_uint64]
+    ) -> int:
+        """
+        Evaluates the model for a single token, and samples the next token from the resulting logits.
+        When running on CPU, logits are sampled in place and are not copied unless logits_out_address is set.
+        Throws an exception in case of any error. Error messages would be printed to stderr.
+
+        Parameters
+        ----------
+        ctx : RWKVContext
+            RWKV context obtained from rwkv_init_from_file.
+        token : int
+            Next token index, in range 0 <= token < n_vocab.
+        state_in_address : int
+            Address of the first element of a FP32 buffer of size rwkv_get_state_buffer_element_count; or None, if this is a first pass.
+        state_out_address : int
+            Address of the first element of a FP32 buffer of size rwkv_get_state_buffer_element_count. This buffer will be written to.
+        logits_out_address : Optional[int]
+            Address of the first element of a FP32 buffer of size rwkv_get_logits_buffer_element_count; or None, if logits are not needed.
+        params : RWKVSamplerParams
+            Sampler params, see rwkv_init_sampler_params.
+        rng_state : Optional[ctypes.c_uint64]
+            State of the random number generator, which is advanced by each call. May be None if temperature is 0.
+
+        Returns
+        -------
+        int
+            Sampled token.
+        """
+
+        next_token = ctypes.c_uint32()
+
+        if not self.library.rwkv_eval_and_sample(
+            ctx.ptr,
+            ctypes.c_uint32(token),
+            ctypes.cast(0 if state_in_address is None else state_in_address, P_FLOAT),
+            ctypes.cast(state_out_address, P_FLOAT),
+            ctypes.cast(0 if logits_out_address is None else logits_out_address, P_FLOAT),
+            ctypes.byref(params),
+            None if rng_state is None else ctypes.byref(rng_state),
+            ctypes.byref(next_token)
+        ):
+            raise ValueError('rwkv_eval_and_sample failed, check stderr')
+
+        return next_token.value
+
     def rwkv_get_n_vocab(self, ctx: RWKVContext) -> int:
         """
         Returns the number of tokens in the given model's vocabulary.
@@ -365,6 +974,84 @@ class RWKVSharedLibrary:
         ):
             raise ValueError('rwkv_quantize_model_file failed, check stderr')
 
+    def rwkv_tensor_needs_quantization(self, tensor_name: str, dim_count: int) -> bool:
+        """
+        Returns whether `rwkv_quantize_model_file` quantizes an FP32 or FP16 tensor with the given name and dimension count.
+
+        Parameters
+        ----------
+        tensor_name : str
+            Name of the tensor in the model file.
+        dim_count : int
+            Count of dimensions of the tensor.
+        """
+
+        return self.library.rwkv_tensor_needs_quantization(tensor_name.encode('utf-8'), ctypes.c_uint32(dim_count))
+
+    def rwkv_quantize_tensor_data(self, format_name: str, src_address: Optional[int], dest_address: Optional[int], row_count: int, row_length: int) -> int:
+        """
+        Quantizes FP32 data of a single tensor, like `rwkv_quantize_model_file` does for tensors that need quantization.
+        Returns size of the quantized data in bytes.
+        Throws an exception in case of any error. Error messages would be printed to stderr.
+
+        The GIL is released while quantizing, so independent tensors can be quantized in parallel on Python threads.
+
+        Parameters
+        ----------
+        format_name : str
+            One of QUANTIZED_FORMAT_NAMES.
+        src_address : Optional[int]
+            Address of row_count * row_length FP32 values, row after row. May be None when dest_address is None.
+        dest_address : Optional[int]
+            Address of a buffer for the quantized data. If None, only the size of the quantized data is returned.
+        row_count : int
+            Count of rows, which is the first dimension of a PyTorch matrix.
+        row_length : int
+            Count of values in a row, which is the second dimension of a PyTorch matrix. Must be a multiple of the block size of the format.
+        """
+
+        if format_name not in QUANTIZED_FORMAT_NAMES:
+            raise ValueError(f'Unknown format name {format_name}, use one of {QUANTIZED_FORMAT_NAMES}')
+
+        size: int = self.library.rwkv_quantize_tensor_data(
+            format_name.encode('utf-8'),
+            ctypes.cast(0 if src_address is None else src_address, P_FLOAT),
+            ctypes.c_void_p(dest_address),
+            ctypes.c_size_t(row_count),
+            ctypes.c_size_t(row_length)
+        )
+
+        if size == 0:
+            raise ValueError('rwkv_quantize_tensor_data failed, check stderr')
+
+        return size
+
+    def rwkv_convert_model_file_version(self, model_file_path_in: str, model_file_path_out: str, version: int) -> None:
+        """
+        Rewrites a model file in another version of the file format; tensor data is copied as is.
+        Version 102 aligns tensor data, so it can be memory-mapped without copying; versions 100 and 101 are readable by older versions of rwkv.cpp.
+        Throws an exception in case of any error. Error messages would be printed to stderr.
+
+        Parameters
+        ----------
+        model_file_path_in : str
+            Path to model file in ggml format, of any supported version.
+        model_file_path_out : str
+            Converted model will be written here.
+        version : int
+            Version of the written file, one of FILE_VERSIONS. Quantized models can not be written in version 100.
+        """
+
+        if version not in FILE_VERSIONS:
+            raise ValueError(f'Unknown file version {version}, use one of {FILE_VERSIONS}')
+
+        if not self.library.rwkv_convert_model_file_version(
+            model_file_path_in.encode('utf-8'),
+            model_file_path_out.encode('utf-8'),
+            ctypes.c_uint32(version)
+        ):
+            raise ValueError('rwkv_convert_model_file_version failed, check stderr')
+
     def rwkv_get_system_info_string(self) -> str:
         """
         Returns system information string.
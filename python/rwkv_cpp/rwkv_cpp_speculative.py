@@ -0,0 +1,478 @@
+import abc
+import time
+import numpy as np
+
+# I'm sure this is not strictly correct, but let's keep this crutch for now.
+try:
+    import rwkv_cpp_model
+    import rwkv_cpp_shared_library
+except ModuleNotFoundError:
+    from . import rwkv_cpp_model
+    from . import rwkv_cpp_shared_library
+
+from typing import Optional, Tuple, List, Dict, Iterable, Iterator
+
+# Max count of tokens that are known to the decoder but not evaluated into the target state yet.
+# After a rejection, accepted tokens are evaluated together with the next verification; if too many accumulate,
+# they are evaluated separately, so that verification sequences stay short.
+MAX_PENDING_TOKENS: int = 16
+
+class _SpeculativeDecoder(abc.ABC):
+    """
+    Common part of speculative decoders: verification of drafted tokens by the target model and rollback of its state.
+
+    The target model state is kept as a committed state plus a list of pending tokens, which are accepted but not evaluated yet.
+    Each round, pending tokens and drafted tokens are evaluated in one `eval_sequence_logits` call, which returns target logits
+    after the last pending token and after each drafted token. The longest prefix of the draft that the target agrees with is accepted,
+    followed by one token sampled from the target, so that each round generates at least one token.
+
+    RWKV state can not be rewound. When all drafted tokens are accepted, the state after the call is committed.
+    Otherwise, the committed state is kept, and accepted tokens become pending; they are evaluated with the next verification call.
+    """
+
+    def __init__(
+            self,
+            target: rwkv_cpp_model.RWKVModel,
+            draft_length: int,
+            temperature: float,
+            seed: Optional[int]
+    ) -> None:
+        if not (draft_length > 0):
+            raise ValueError('Draft length must be > 0')
+
+        if not (temperature >= 0.0):
+            raise ValueError('Temperature must be >= 0')
+
+        self._target: rwkv_cpp_model.RWKVModel = target
+        self._draft_length: int = draft_length
+        self._temperature: float = temperature
+        self._rng: np.random.Generator = np.random.default_rng(seed)
+
+        state_len: int = target._state_buffer_element_count
+        n_vocab: int = target._logits_buffer_element_count
+
+        self._state: np.ndarray = np.zeros(state_len, dtype=np.float32)
+        self._state_out: np.ndarray = np.zeros(state_len, dtype=np.float32)
+        self._logits: np.ndarray = np.zeros((draft_length + 1, n_vocab), dtype=np.float32)
+        # False when the committed state is the initial model state.
+        self._has_state: bool = False
+        self._pending: List[int] = []
+        # Prompt and generated tokens.
+        self._tokens: List[int] = []
+
+        self.reset_stats()
+
+    @property
+    def draft_length(self) -> int:
+        return self._draft_length
+
+    def generate(
+            self,
+            prompt_tokens: rwkv_cpp_shared_library.Tokens,
+            max_tokens: int = 256,
+            stop_tokens: Iterable[int] = (),
+            chunk_size: int = 16
+    ) -> Iterator[int]:
+        """
+        Generates tokens after the prompt, yielding each token as soon as its round is verified.
+        With temperature 0, generated tokens are the same as with greedy decoding of the target model alone;
+        otherwise, they are distributed as if sampled from the target model with the temperature.
+
+        In case of any error, this method will throw an exception.
+
+        Parameters
+        ----------
+        prompt_tokens : Tokens
+            Tokens to process before generation, must not be empty.
+        max_tokens : int
+            Max count of tokens to generate.
+        stop_tokens : Iterable[int]
+            Generation stops when one of these tokens is generated. A stop token is not yielded.
+        chunk_size : int
+            Chunk size for prompt processing, see `RWKVModel.eval_sequence_in_chunks`.
+
+        Returns
+        -------
+        Iterator[int]
+            Generated tokens.
+        """
+
+        if len(prompt_tokens) == 0:
+            raise ValueError('Prompt must not be empty')
+
+        if not (max_tokens >= 0):
+            raise ValueError('Max token count must be >= 0')
+
+        stop_token_set = frozenset(stop_tokens)
+
+        self._tokens = list(prompt_tokens)
+        self._has_state = len(self._tokens) > 1
+        self._pending = self._tokens[-1:]
+
+        if self._has_state:
+            self._target.eval_sequence_in_chunks(self._tokens[:-1], None, self._state, chunk_size=chunk_size)
+
+        self._start(chunk_size)
+
+        generated_count: int = 0
+
+        while generated_count < max_tokens:
+            start: float = time.perf_counter()
+
+            # A round generates up to draft_length + 1 tokens; drafting tokens that would be cut off is a waste.
+            drafts, draft_probs = self._propose(min(self._draft_length, max_tokens - generated_count - 1))
+            accepted_count, next_token = self._verify(drafts, draft_probs)
+            self._accept(drafts, accepted_count, next_token)
+
+            self._elapsed += time.perf_counter() - start
+            self._rounds += 1
+            self._proposed_tokens += len(drafts)
+            self._accepted_tokens += accepted_count
+
+            for token in drafts[:accepted_count] + [next_token]:
+                if token in stop_token_set:
+                    return
+
+                self._tokens.append(token)
+                self._generated_tokens += 1
+                generated_count += 1
+
+                yield token
+
+    def get_stats(self) -> Dict[str, float]:
+        """
+        Returns counters of generation since the creation of the decoder or the last call of `reset_stats`.
+        Time is measured from the first to the last verification, so prompt processing is not counted.
+
+        accept_rate is the share of drafted tokens accepted by the target model;
+        tokens_per_round is the mean count of tokens generated per target model call.
+        """
+
+        return {
+            'rounds': self._rounds,
+            'proposed_tokens': self._proposed_tokens,
+            'accepted_tokens': self._accepted_tokens,
+            'generated_tokens': self._generated_tokens,
+            'accept_rate': self._accepted_tokens / self._proposed_tokens if self._proposed_tokens > 0 else 0.0,
+            'tokens_per_round': self._generated_tokens / self._rounds if self._rounds > 0 else 0.0,
+            'elapsed_seconds': self._elapsed,
+            'tokens_per_second': self._generated_tokens / self._elapsed if self._elapsed > 0.0 else 0.0
+        }
+
+    def reset_stats(self) -> None:
+        self._rounds: int = 0
+        self._proposed_tokens: int = 0
+        self._accepted_tokens: int = 0
+        self._generated_tokens: int = 0
+        self._elapsed: float = 0.0
+
+    @abc.abstractmethod
+    def _start(self, chunk_size: int) -> None:
+        """
+        Called after the target model processed the prompt, which is in self._tokens.
+        """
+
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def _propose(self, count: int) -> Tuple[List[int], Optional[List[np.ndarray]]]:
+        """
+        Returns up to count drafted tokens, and for each of them the distribution it was sampled from.
+        Distributions may be None when drafts are deterministic; then a drafted token has probability 1.
+        """
+
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def _accept(self, drafts: List[int], accepted_count: int, next_token: int) -> None:
+        """
+        Called after verification, when drafts[:accepted_count] and next_token are generated.
+        """
+
+        raise NotImplementedError()
+
+    def _verify(self, drafts: List[int], draft_probs: Optional[List[np.ndarray]]) -> Tuple[int, int]:
+        """
+        Evaluates pending and drafted tokens with the target model and updates its state.
+        Returns the count of accepted drafted tokens and the token that follows them.
+        """
+
+        pending_count: int = len(self._pending)
+        logits: np.ndarray = self._logits[:len(drafts) + 1]
+
+        self._target.eval_sequence_logits(
+            self._pending + drafts,
+            self._state if self._has_state else None,
+            list(range(pending_count - 1, pending_count + len(drafts))),
+            state_out=self._state_out,
+            logits_out=logits
+        )
+
+        accepted_count: int = 0
+        next_token: Optional[int] = None
+
+        for i, token in enumerate(drafts):
+            if self._temperature == 0.0:
+                next_token = int(logits[i].argmax())
+
+                if next_token != token:
+                    break
+            else:
+                # Speculative sampling: the drafted token is accepted with probability min(1, p / q);
+                # otherwise, a token is sampled from the normalized positive part of p - q.
+                p: np.ndarray = self._probabilities(logits[i])
+
+                if draft_probs is None:
+                    q: np.ndarray = np.zeros_like(p)
+                    q[token] = 1.0
+                else:
+                    q: np.ndarray = draft_probs[i]
+
+                if self._rng.random() * q[token] >= p[token]:
+                    residual: np.ndarray = np.maximum(p - q, 0.0)
+                    next_token = int(self._rng.choice(len(residual), p=residual / residual.sum()))
+
+                    break
+
+            accepted_count += 1
+            next_token = None
+
+        if next_token is None:
+            next_token = self._sample(logits[len(drafts)])
+
+        if accepted_count == len(drafts):
+            self._state, self._state_out = self._state_out, self._state
+            self._has_state = True
+            self._pending = [next_token]
+        else:
+            # The rejected tokens are in the state after the call, so it is discarded; accepted tokens wait for the next call.
+            self._pending = self._pending + drafts[:accepted_count] + [next_token]
+
+            if len(self._pending) > MAX_PENDING_TOKENS:
+                self._target.eval_sequence(
+                    self._pending[:-1],
+                    self._state if self._has_state else None,
+                    state_out=self._state_out,
+                    use_numpy=True
+                )
+
+                self._state, self._state_out = self._state_out, self._state
+                self._has_state = True
+                self._pending = self._pending[-1:]
+
+        return accepted_count, next_token
+
+    def _probabilities(self, logits: np.ndarray) -> np.ndarray:
+        x: np.ndarray = logits.astype(np.float64) / self._temperature
+        x = np.exp(x - x.max())
+
+        return x / x.sum()
+
+    def _sample(self, logits: np.ndarray) -> int:
+        if self._temperature == 0.0:
+            return int(logits.argmax())
+
+        p: np.ndarray = self._probabilities(logits)
+
+        return int(self._rng.choice(len(p), p=p))
+
+class RWKVSpeculativeDecoder(_SpeculativeDecoder):
+    """
+    Speculative decoding with a small draft model: the draft model proposes draft_length tokens one by one,
+    and the large target model verifies them in a single call. Decoding of a large model is bound by reading its weights,
+    which happens once per call regardless of the count of evaluated tokens, so each accepted token saves a pass over target weights.
+
+    The models must share the vocabulary. The draft model keeps a state after each drafted token,
+    so on rejection its state is rolled back to the last accepted token without evaluation.
+
+    Usage:
+
+    decoder = RWKVSpeculativeDecoder(target_model, draft_model, draft_length=4)
+
+    for token in decoder.generate(prompt_tokens, max_tokens=128):
+        print(decode([token]), end='')
+
+    print(decoder.get_stats())
+    """
+
+    def __init__(
+            self,
+            target: rwkv_cpp_model.RWKVModel,
+            draft: rwkv_cpp_model.RWKVModel,
+            draft_length: int = 4,
+            temperature: float = 0.0,
+            seed: Optional[int] = None
+    ) -> None:
+        """
+        Creates a decoder. It allocates its own state buffers; the models may be used for something else between generations.
+
+        Parameters
+        ----------
+        target : RWKVModel
+            Model whose output is generated.
+        draft : RWKVModel
+            Smaller model with the same vocabulary that proposes tokens.
+        draft_length : int
+            Count of tokens proposed by the draft model per round, must be positive.
+        temperature : float
+            Sampling temperature of both models; 0 selects tokens with the highest logit.
+        seed : Optional[int]
+            Seed of the random number generator. If not set, a random seed is used.
+        """
+
+        if draft._logits_buffer_element_count != target._logits_buffer_element_count:
+            raise ValueError('Draft and target models must have the same vocabulary size')
+
+        super().__init__(target, draft_length, temperature, seed)
+
+        self._draft: rwkv_cpp_model.RWKVModel = draft
+
+        state_len: int = draft._state_buffer_element_count
+
+        # Draft state is a committed state plus one or two pending tokens, like target state.
+        self._draft_state: np.ndarray = np.zeros(state_len, dtype=np.float32)
+        self._draft_has_state: bool = False
+        self._draft_pending: List[int] = []
+        # _draft_states[i] is the state after pending tokens and i drafted tokens.
+        self._draft_states: np.ndarray = np.zeros((draft_length, state_len), dtype=np.float32)
+        self._draft_logits: np.ndarray = np.zeros(draft._logits_buffer_element_count, dtype=np.float32)
+
+    def _start(self, chunk_size: int) -> None:
+        self._draft_has_state = len(self._tokens) > 1
+        self._draft_pending = self._tokens[-1:]
+
+        if self._draft_has_state:
+            self._draft.eval_sequence_in_chunks(self._tokens[:-1], None, self._draft_state, chunk_size=chunk_size)
+
+    def _propose(self, count: int) -> Tuple[List[int], Optional[List[np.ndarray]]]:
+        drafts: List[int] = []
+        draft_probs: Optional[List[np.ndarray]] = None if self._temperature == 0.0 else []
+
+        if count == 0:
+            return drafts, draft_probs
+
+        self._draft.eval_sequence(
+            self._draft_pending,
+            self._draft_state if self._draft_has_state else None,
+            state_out=self._draft_states[0],
+            logits_out=self._draft_logits
+        )
+
+        for i in range(count):
+            if draft_probs is None:
+                token: int = int(self._draft_logits.argmax())
+            else:
+                q: np.ndarray = self._probabilities(self._draft_logits)
+                token: int = int(self._rng.choice(len(q), p=q))
+                draft_probs.append(q)
+
+            drafts.append(token)
+
+            # The last drafted token is evaluated only if it is accepted, with the next round.
+            if i + 1 < count:
+                self._draft.eval(token, self._draft_states[i], self._draft_states[i + 1], self._draft_logits)
+
+        return drafts, draft_probs
+
+    def _accept(self, drafts: List[int], accepted_count: int, next_token: int) -> None:
+        if len(drafts) == 0:
+            self._draft_pending = self._draft_pending + [next_token]
+
+            return
+
+        # _draft_states[accepted_count] includes the rejected token, unless all tokens are accepted.
+        if accepted_count == len(drafts):
+            self._draft_state[:] = self._draft_states[accepted_count - 1]
+            self._draft_pending = [drafts[-1], next_token]
+        else:
+            self._draft_state[:] = self._draft_states[accepted_count]
+            self._draft_pending = [next_token]
+
+        self._draft_has_state = True
+
+class RWKVPromptLookupDecoder(_SpeculativeDecoder):
+    """
+    Speculative decoding without a draft model: drafted tokens are copied from the prompt and earlier output.
+    When the last n generated tokens occurred earlier, the tokens that followed their most recent earlier occurrence are proposed,
+    trying n from max_ngram_size down to min_ngram_size. This works well for extraction, summarization and editing,
+    where output often repeats spans of the prompt; when nothing matches, a round is an ordinary single-token step.
+
+    N-gram positions are indexed in dicts as tokens arrive, so a lookup does not scan the prompt.
+
+    Usage:
+
+    decoder = RWKVPromptLookupDecoder(model, draft_length=8)
+
+    for token in decoder.generate(prompt_tokens, max_tokens=128):
+        print(decode([token]), end='')
+    """
+
+    def __init__(
+            self,
+            target: rwkv_cpp_model.RWKVModel,
+            draft_length: int = 8,
+            max_ngram_size: int = 3,
+            min_ngram_size: int = 1,
+            temperature: float = 0.0,
+            seed: Optional[int] = None
+    ) -> None:
+        """
+        Creates a decoder. It allocates its own state buffers; the model may be used for something else between generations.
+
+        Parameters
+        ----------
+        target : RWKVModel
+            Model whose output is generated.
+        draft_length : int
+            Max count of tokens proposed per round, must be positive.
+        max_ngram_size : int
+            Longest suffix of generated tokens that is looked up.
+        min_ngram_size : int
+            Shortest suffix of generated tokens that is looked up, must be in range [1, max_ngram_size].
+        temperature : float
+            Sampling temperature; 0 selects tokens with the highest logit.
+        seed : Optional[int]
+            Seed of the random number generator. If not set, a random seed is used.
+        """
+
+        if not (1 <= min_ngram_size <= max_ngram_size):
+            raise ValueError('N-gram sizes must satisfy 1 <= min_ngram_size <= max_ngram_size')
+
+        super().__init__(target, draft_length, temperature, seed)
+
+        self._ngram_sizes: List[int] = list(range(max_ngram_size, min_ngram_size - 1, -1))
+        # For each n-gram size, maps an n-gram to the position of the token that followed its most recent occurrence.
+        self._index: Dict[int, Dict[Tuple[int, ...], int]] = {}
+        self._indexed_count: int = 0
+
+    def _start(self, chunk_size: int) -> None:
+        self._index = {n: {} for n in self._ngram_sizes}
+        self._indexed_count = 0
+
+    def _propose(self, count: int) -> Tuple[List[int], Optional[List[np.ndarray]]]:
+        tokens: List[int] = self._tokens
+
+        # An n-gram is indexed once the token following it is known, so the suffix itself is never found.
+        for position in range(self._indexed_count, len(tokens)):
+            for n, index in self._index.items():
+                if position >= n:
+                    index[tuple(tokens[position - n:position])] = position
+
+        self._indexed_count = len(tokens)
+
+        if count == 0:
+            return [], None
+
+        for n in self._ngram_sizes:
+            if len(tokens) < n:
+                continue
+
+            position: Optional[int] = self._index[n].get(tuple(tokens[-n:]))
+
+            if position is not None:
+                return tokens[position:position + count], None
+
+        return [], None
+
+    def _accept(self, drafts: List[int], accepted_count: int, next_token: int) -> None:
+        pass
@@ -0,0 +1,78 @@
+import os
+import pathlib
+import rwkv_cpp_model
+import rwkv_cpp_shared_library
+import rwkv_cpp_speculative
+from typing import List
+
+TESTS_DIR: pathlib.Path = pathlib.Path(os.path.abspath(__file__)).parent.parent.parent / 'tests'
+
+def test() -> None:
+    library: rwkv_cpp_shared_library.RWKVSharedLibrary = rwkv_cpp_shared_library.load_rwkv_shared_library()
+
+    prompt: List[int] = list('A long time ago, '.encode('utf-8'))
+
+    for target_name, draft_name in [
+        ('tiny-rwkv-5v2-730K-FP32.bin', 'tiny-rwkv-5v2-730K-Q5_1.bin'),
+        ('tiny-rwkv-7v0-834K-FP32.bin', 'tiny-rwkv-4v0-660K-FP32.bin')
+    ]:
+        target = rwkv_cpp_model.RWKVModel(library, str(TESTS_DIR / target_name), thread_count=1)
+        draft = rwkv_cpp_model.RWKVModel(library, str(TESTS_DIR / draft_name), thread_count=1)
+
+        expected_tokens: List[int] = [step.token for step in target.generate(prompt, max_tokens=64)]
+
+        for draft_length in [1, 3, 8]:
+            decoder = rwkv_cpp_speculative.RWKVSpeculativeDecoder(target, draft, draft_length)
+
+            actual_tokens: List[int] = list(decoder.generate(prompt, max_tokens=64))
+            assert actual_tokens == expected_tokens, f'\n{target_name} with draft length {draft_length}\nActual: {actual_tokens}\nExpected: {expected_tokens}'
+
+            stats = decoder.get_stats()
+            assert stats['generated_tokens'] == 64, stats
+            assert stats['accepted_tokens'] + stats['rounds'] == 64, stats
+
+            # Stop tokens are not yielded, and generation ends on them.
+            stop_token: int = expected_tokens[10]
+            actual_tokens = list(decoder.generate(prompt, max_tokens=64, stop_tokens=[stop_token]))
+            assert actual_tokens == expected_tokens[:expected_tokens.index(stop_token)], f'\nActual: {actual_tokens}'
+
+        # The draft model equal to the target model is always right.
+        decoder = rwkv_cpp_speculative.RWKVSpeculativeDecoder(target, target, 4)
+        assert list(decoder.generate(prompt, max_tokens=64)) == expected_tokens
+        assert decoder.get_stats()['accept_rate'] == 1.0, decoder.get_stats()
+
+        # Sampling with a seed is reproducible.
+        decoder = rwkv_cpp_speculative.RWKVSpeculativeDecoder(target, draft, 4, temperature=1.0, seed=42)
+        sampled_tokens: List[int] = list(decoder.generate(prompt, max_tokens=32))
+        decoder = rwkv_cpp_speculative.RWKVSpeculativeDecoder(target, draft, 4, temperature=1.0, seed=42)
+        assert list(decoder.generate(prompt, max_tokens=32)) == sampled_tokens
+        assert len(sampled_tokens) == 32
+
+        # Prompt lookup proposes spans of the prompt; the output is still the same as greedy decoding.
+        copy_prompt: List[int] = list('The quick brown fox jumps over the lazy dog. The quick brown fox'.encode('utf-8'))
+        copy_expected_tokens: List[int] = [step.token for step in target.generate(copy_prompt, max_tokens=64)]
+
+        for draft_length in [1, 4, 16]:
+            decoder = rwkv_cpp_speculative.RWKVPromptLookupDecoder(target, draft_length)
+
+            actual_tokens = list(decoder.generate(copy_prompt, max_tokens=64))
+            assert actual_tokens == copy_expected_tokens, f'\n{target_name} with lookup draft length {draft_length}\nActual: {actual_tokens}\nExpected: {copy_expected_tokens}'
+
+            stats = decoder.get_stats()
+            assert stats['proposed_tokens'] > 0, stats
+            assert stats['accepted_tokens'] + stats['rounds'] == 64, stats
+
+        # The base class is abstract.
+        try:
+            rwkv_cpp_speculative._SpeculativeDecoder(target, 4, 0.0, None)
+            assert False, 'Abstract decoder was instantiated'
+        except TypeError:
+            pass
+
+        target.free()
+        draft.free()
+
+    print('All tests pass')
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,331 @@
+import threading
+import collections
+import numpy as np
+
+# I'm sure this is not strictly correct, but let's keep this crutch for now.
+try:
+    import rwkv_cpp_model
+    import rwkv_cpp_shared_library
+except ModuleNotFoundError:
+    from . import rwkv_cpp_model
+    from . import rwkv_cpp_shared_library
+
+from typing import Optional, Tuple, List, Dict, Iterable
+
+class _TrieNode:
+
+    __slots__ = ('parent', 'token', 'children', 'state', 'logits')
+
+    def __init__(self, parent: Optional['_TrieNode'], token: int) -> None:
+        self.parent: Optional[_TrieNode] = parent
+        self.token: int = token
+        self.children: Dict[int, _TrieNode] = {}
+        # Checkpoint after the token sequence from the root to this node, if cached.
+        self.state: Optional[np.ndarray] = None
+        self.logits: Optional[np.ndarray] = None
+
+class StatePrefixCache:
+    """
+    A cache of model states after token sequence prefixes, for skipping evaluation of shared prompt prefixes.
+
+    Checkpoints of (state, logits) are stored in a token trie. Evaluation resumes from the checkpoint of the longest cached prefix,
+    and only the remaining suffix is evaluated. Since RWKV state size does not depend on the sequence length, each checkpoint
+    takes the same (state_len + n_vocab) * 4 bytes; checkpoints are evicted in LRU order when the byte budget is exceeded.
+
+    The cache is thread-safe. It may be shared by clones of the model, see the model parameter of `eval_sequence`.
+
+    Usage:
+
+    cache = StatePrefixCache(model, max_bytes=256 * 1024 * 1024)
+
+    # The system prompt is checkpointed too, so that requests with the same system prompt and different user input hit it.
+    logits, state = cache.eval_sequence(system_prompt_tokens + user_tokens, checkpoint_lengths=[len(system_prompt_tokens)])
+    """
+
+    def __init__(self, model: rwkv_cpp_model.RWKVModel, max_bytes: int) -> None:
+        """
+        Creates an empty cache.
+
+        Parameters
+        ----------
+        model : RWKVModel
+            Model whose states will be cached. Checkpoints are valid only for this model and its clones.
+        max_bytes : int
+            Max total size of cached states and logits in bytes, must be non-negative.
+        """
+
+        if not (max_bytes >= 0):
+            raise ValueError('Byte budget must be >= 0')
+
+        self._model: rwkv_cpp_model.RWKVModel = model
+        self._max_bytes: int = max_bytes
+
+        self._checkpoint_bytes: int = (model._state_buffer_element_count + model._logits_buffer_element_count) * 4
+
+        self._root: _TrieNode = _TrieNode(None, -1)
+        # Nodes that hold checkpoints, from least to most recently used.
+        self._lru: collections.OrderedDict = collections.OrderedDict()
+
+        self._lock: threading.Lock = threading.Lock()
+
+        self._hits: int = 0
+        self._misses: int = 0
+        self._evictions: int = 0
+        self._reused_tokens: int = 0
+        self._evaluated_tokens: int = 0
+
+    @property
+    def max_bytes(self) -> int:
+        return self._max_bytes
+
+    @property
+    def size_bytes(self) -> int:
+        return len(self._lru) * self._checkpoint_bytes
+
+    def __len__(self) -> int:
+        return len(self._lru)
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        Returns counters of the cache.
+
+        Returns
+        -------
+        stats : Dict[str, int]
+            hits and misses are counts of lookups that found and did not find a cached prefix;
+            reused_tokens and evaluated_tokens are counts of tokens that were skipped and evaluated by `eval_sequence`;
+            evictions is the count of checkpoints evicted to fit the byte budget.
+        """
+
+        with self._lock:
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'reused_tokens': self._reused_tokens,
+                'evaluated_tokens': self._evaluated_tokens,
+                'checkpoints': len(self._lru),
+                'size_bytes': self.size_bytes
+            }
+
+    def lookup(self, tokens: Iterable[int]) -> Tuple[int, Optional[np.ndarray], Optional[np.ndarray]]:
+        """
+        Finds the checkpoint of the longest cached prefix of tokens and marks it as recently used.
+        Returned arrays are owned by the cache and must not be modified.
+
+        Parameters
+        ----------
+        tokens : Iterable[int]
+            Token sequence.
+
+        Returns
+        -------
+        length, state, logits
+            Length of the prefix, and its checkpoint. If no prefix is cached, length is 0 and state and logits are None.
+        """
+
+        with self._lock:
+            node: _TrieNode = self._root
+            found: Optional[_TrieNode] = None
+            found_length: int = 0
+
+            for i, token in enumerate(tokens):
+                node = node.children.get(int(token))
+
+                if node is None:
+                    break
+
+                if node.state is not None:
+                    found = node
+                    found_length = i + 1
+
+            if found is None:
+                self._misses += 1
+
+                return 0, None, None
+
+            self._hits += 1
+            self._lru.move_to_end(found)
+
+            return found_length, found.state, found.logits
+
+    def put(self, tokens: Iterable[int], state: np.ndarray, logits: np.ndarray) -> bool:
+        """
+        Stores a copy of the checkpoint after the token sequence, evicting least recently used checkpoints if needed.
+
+        Parameters
+        ----------
+        tokens : Iterable[int]
+            Token sequence, must not be empty.
+        state : np.ndarray
+            State after the sequence.
+        logits : np.ndarray
+            Logits after the sequence.
+
+        Returns
+        -------
+        bool
+            False if the checkpoint does not fit into the byte budget and was not stored.
+        """
+
+        self._model._validate_tensor(state, 'state', self._model._state_buffer_element_count)
+        self._model._validate_tensor(logits, 'logits', self._model._logits_buffer_element_count)
+
+        if self._checkpoint_bytes > self._max_bytes:
+            return False
+
+        token_list: List[int] = [int(token) for token in tokens]
+
+        if len(token_list) == 0:
+            raise ValueError('Sequence must not be empty')
+
+        with self._lock:
+            node: Optional[_TrieNode] = self._root
+
+            for token in token_list:
+                node = node.children.get(token)
+
+                if node is None:
+                    break
+
+            if node is not None and node.state is not None:
+                node.state[:] = state
+                node.logits[:] = logits
+
+                self._lru.move_to_end(node)
+
+                return True
+
+            # Eviction prunes nodes that lead to no checkpoints, so it is done before the nodes of the new checkpoint are created.
+            while self.size_bytes + self._checkpoint_bytes > self._max_bytes:
+                self._evict(next(iter(self._lru)))
+
+            node = self._root
+
+            for token in token_list:
+                child: Optional[_TrieNode] = node.children.get(token)
+
+                if child is None:
+                    child = _TrieNode(node, token)
+                    node.children[token] = child
+
+                node = child
+
+            node.state = np.array(state, dtype=np.float32, copy=True)
+            node.logits = np.array(logits, dtype=np.float32, copy=True)
+
+            self._lru[node] = None
+
+            return True
+
+    def clear(self) -> None:
+        """
+        Removes all checkpoints. Counters are not reset.
+        """
+
+        with self._lock:
+            self._root = _TrieNode(None, -1)
+            self._lru.clear()
+
+    def eval_sequence(
+            self,
+            tokens: rwkv_cpp_shared_library.Tokens,
+            state_out: Optional[np.ndarray] = None,
+            logits_out: Optional[np.ndarray] = None,
+            chunk_size: int = 16,
+            checkpoint_lengths: Iterable[int] = (),
+            model: Optional[rwkv_cpp_model.RWKVModel] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Evaluates the model for a sequence of tokens, starting from the initial state.
+        Evaluation resumes from the longest cached prefix; the remaining suffix is evaluated with `eval_sequence_in_chunks`.
+        The state after the full sequence is stored in the cache, as well as states after each of checkpoint_lengths.
+
+        In case of any error, this method will throw an exception.
+
+        Parameters
+        ----------
+        tokens : Tokens
+            Indices of tokens to be seen by the model, must not be empty.
+        state_out : Optional[np.ndarray]
+            Optional output array for state. If provided, must be of type float32, contiguous and of shape (state_buffer_element_count).
+        logits_out : Optional[np.ndarray]
+            Optional output array for logits. If provided, must be of type float32, contiguous and of shape (logits_buffer_element_count).
+        chunk_size : int
+            Size of each chunk in tokens, must be positive.
+        checkpoint_lengths : Iterable[int]
+            Lengths of additional prefixes to store in the cache, for example, the length of the system prompt.
+        model : Optional[RWKVModel]
+            Model to evaluate with; must be the model of the cache or its clone. If not set, the model of the cache is used.
+
+        Returns
+        -------
+        logits, state
+        """
+
+        if model is None:
+            model = self._model
+
+        if len(tokens) == 0:
+            raise ValueError('Sequence must not be empty')
+
+        if state_out is None:
+            state_out = model._zeros_float32(model._state_buffer_element_count, True)
+        else:
+            model._validate_tensor(state_out, 'state_out', model._state_buffer_element_count)
+
+        if logits_out is None:
+            logits_out = model._zeros_float32(model._logits_buffer_element_count, True)
+        else:
+            model._validate_tensor(logits_out, 'logits_out', model._logits_buffer_element_count)
+
+        token_list: List[int] = [int(token) for token in tokens]
+
+        cached_length, cached_state, cached_logits = self.lookup(token_list)
+
+        if cached_length > 0:
+            # Copied under the lock, because put() from another thread may overwrite the arrays in place.
+            with self._lock:
+                state_out[:] = cached_state
+                logits_out[:] = cached_logits
+
+        # Evaluation is split at checkpoint lengths, so that the intermediate states can be stored.
+        ends: List[int] = sorted(set(length for length in checkpoint_lengths if cached_length < length < len(token_list)))
+        ends.append(len(token_list))
+
+        start: int = cached_length
+
+        for end in ends:
+            if start == end:
+                continue
+
+            model.eval_sequence_in_chunks(
+                tokens[start:end],
+                state_out if start > 0 else None,
+                state_out,
+                logits_out,
+                chunk_size
+            )
+
+            self.put(token_list[:end], state_out, logits_out)
+
+            start = end
+
+        with self._lock:
+            self._reused_tokens += cached_length
+            self._evaluated_tokens += len(token_list) - cached_length
+
+        return logits_out, state_out
+
+    def _evict(self, node: _TrieNode) -> None:
+        node.state = None
+        node.logits = None
+
+        del self._lru[node]
+
+        self._evictions += 1
+
+        # Remove the nodes that lead to no checkpoints anymore.
+        while node is not self._root and node.state is None and len(node.children) == 0:
+            del node.parent.children[node.token]
+            node = node.parent
@@ -0,0 +1,107 @@
+import os
+import pathlib
+import numpy as np
+import rwkv_cpp_model
+import rwkv_cpp_shared_library
+import rwkv_cpp_state_cache
+from typing import List
+
+TESTS_DIR: pathlib.Path = pathlib.Path(os.path.abspath(__file__)).parent.parent.parent / 'tests'
+
+def count_nodes(node: rwkv_cpp_state_cache._TrieNode) -> int:
+    return 1 + sum(count_nodes(child) for child in node.children.values())
+
+def count_dead_nodes(node: rwkv_cpp_state_cache._TrieNode) -> int:
+    # A leaf without a checkpoint leads to no checkpoints and should have been pruned.
+    dead: int = 1 if node.parent is not None and node.state is None and len(node.children) == 0 else 0
+
+    return dead + sum(count_dead_nodes(child) for child in node.children.values())
+
+def test() -> None:
+    library: rwkv_cpp_shared_library.RWKVSharedLibrary = rwkv_cpp_shared_library.load_rwkv_shared_library()
+
+    model = rwkv_cpp_model.RWKVModel(library, str(TESTS_DIR / 'tiny-rwkv-5v2-730K-FP32.bin'), thread_count=1)
+
+    system_prompt: List[int] = list('You are a helpful assistant. '.encode('utf-8'))
+    first_request: List[int] = system_prompt + list('Tell me a story.'.encode('utf-8'))
+    second_request: List[int] = system_prompt + list('What time is it?'.encode('utf-8'))
+
+    cache = rwkv_cpp_state_cache.StatePrefixCache(model, max_bytes=1024 * 1024 * 1024)
+    checkpoint_bytes: int = cache._checkpoint_bytes
+
+    # Cached evaluation gives the same results as uncached evaluation.
+    for tokens in [first_request, second_request, first_request]:
+        logits, state = cache.eval_sequence(tokens, checkpoint_lengths=[len(system_prompt)])
+        expected_logits, expected_state = model.eval_sequence_in_chunks(tokens, None, use_numpy=True)
+
+        assert np.array_equal(logits, expected_logits), np.abs(logits - expected_logits).max()
+        assert np.array_equal(state, expected_state), np.abs(state - expected_state).max()
+
+    stats = cache.get_stats()
+    assert stats['hits'] == 2 and stats['misses'] == 1, stats
+    # The second request resumed from the system prompt; the third one did not evaluate anything.
+    assert stats['reused_tokens'] == len(system_prompt) + len(first_request), stats
+    assert stats['evaluated_tokens'] == len(first_request) + len(second_request) - len(system_prompt), stats
+    assert len(cache) == 3 and cache.size_bytes == 3 * checkpoint_bytes
+
+    assert cache.lookup(system_prompt + [1, 2, 3])[0] == len(system_prompt)
+
+    state_len: int = model._state_buffer_element_count
+    logits_len: int = model._logits_buffer_element_count
+
+    def checkpoint(value: float):
+        return np.full(state_len, value, dtype=np.float32), np.full(logits_len, value, dtype=np.float32)
+
+    # Checkpoints are evicted in LRU order, and lookups make checkpoints recently used.
+    cache = rwkv_cpp_state_cache.StatePrefixCache(model, max_bytes=2 * checkpoint_bytes)
+
+    assert cache.put([1, 2, 3], *checkpoint(1))
+    assert cache.put([1, 2, 4], *checkpoint(2))
+    assert cache.lookup([1, 2, 3])[0] == 3
+    assert cache.put([5], *checkpoint(3))
+
+    assert cache.lookup([1, 2, 4])[0] == 0, 'Least recently used checkpoint was not evicted'
+    assert cache.lookup([1, 2, 3])[0] == 3
+    assert cache.lookup([5])[0] == 1
+    assert cache.get_stats()['evictions'] == 1
+
+    # Storing the same sequence again overwrites its checkpoint in place.
+    assert cache.put([5], *checkpoint(4))
+    assert len(cache) == 2 and cache.get_stats()['evictions'] == 1
+
+    length, state, logits = cache.lookup([5, 6])
+    assert length == 1 and np.all(state == 4) and np.all(logits == 4)
+
+    # Eviction removes the nodes that lead to no checkpoints, and keeps the ones that still do.
+    assert cache.put([1, 2], *checkpoint(5))
+    assert count_dead_nodes(cache._root) == 0
+    # [1, 2, 3] was evicted; [1, 2] keeps its nodes.
+    assert count_nodes(cache._root) == 4 and cache.lookup([1, 2, 3])[0] == 2
+
+    assert cache.put([7, 8, 9], *checkpoint(6))
+    assert cache.put([7, 8, 10], *checkpoint(7))
+    assert count_dead_nodes(cache._root) == 0
+    # Only [7, 8, 9] and [7, 8, 10] are left, sharing the [7, 8] prefix.
+    assert count_nodes(cache._root) == 5, count_nodes(cache._root)
+
+    cache.clear()
+    assert len(cache) == 0 and count_nodes(cache._root) == 1
+
+    # A budget smaller than one checkpoint stores nothing, but evaluation still works.
+    cache = rwkv_cpp_state_cache.StatePrefixCache(model, max_bytes=checkpoint_bytes - 1)
+
+    assert not cache.put([1], *checkpoint(1))
+
+    logits, state = cache.eval_sequence(first_request, checkpoint_lengths=[len(system_prompt)])
+    expected_logits, expected_state = model.eval_sequence_in_chunks(first_request, None, use_numpy=True)
+
+    assert np.array_equal(logits, expected_logits)
+    assert np.array_equal(state, expected_state)
+    assert len(cache) == 0 and count_nodes(cache._root) == 1 and cache.size_bytes == 0
+
+    model.free()
+
+    print('All tests pass')
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,400 @@
+import os
+import numpy as np
+
+# I'm sure this is not strictly correct, but let's keep this crutch for now.
+try:
+    import rwkv_cpp_model
+except ModuleNotFoundError:
+    from . import rwkv_cpp_model
+
+from typing import Optional, Tuple, List
+
+# Supported state formats. Sizes are given for a state of state_len elements with vectors of n_embed elements.
+# State is stored as is; state_len * 4 bytes.
+STATE_FORMAT_FP32: str = 'fp32'
+# State is converted to float16; state_len * 2 bytes.
+STATE_FORMAT_FP16: str = 'fp16'
+# Each vector of n_embed elements is quantized to int8 with its own float32 scale; state_len + state_len / n_embed * 4 bytes.
+STATE_FORMAT_INT8: str = 'int8'
+
+STATE_FORMATS: List[str] = [STATE_FORMAT_FP32, STATE_FORMAT_FP16, STATE_FORMAT_INT8]
+
+class RWKVStateCodec:
+    """
+    Encodes model states into compact byte arrays of fixed size, and decodes them back.
+
+    The state consists of n_layer blocks; each block is a sequence of rwkv_layer_state sections of n_embed-sized vectors:
+    ffn_xx, att_xx, att_aa, att_bb, att_pp for RWKV v4, and ffn_xx, att_xx, att_heads (head_size vectors) for RWKV v5+.
+    In int8 format, each such vector has its own scale, so that sections with different magnitudes do not lose precision.
+
+    FP16 and INT8 are lossy. Use `python/measure_state_compression.py` to measure their effect on perplexity.
+    """
+
+    def __init__(self, model: rwkv_cpp_model.RWKVModel, state_format: str = STATE_FORMAT_FP16) -> None:
+        """
+        Parameters
+        ----------
+        model : RWKVModel
+            Model whose states will be encoded.
+        state_format : str
+            One of STATE_FORMATS.
+        """
+
+        if state_format not in STATE_FORMATS:
+            raise ValueError(f'Unsupported state format {state_format}, supported formats: {STATE_FORMATS}')
+
+        self._model: rwkv_cpp_model.RWKVModel = model
+        self._format: str = state_format
+
+        self._state_len: int = model._state_buffer_element_count
+        self._vector_count: int = self._state_len // model.n_embed
+
+        if self._format == STATE_FORMAT_FP32:
+            self._encoded_size: int = self._state_len * 4
+        elif self._format == STATE_FORMAT_FP16:
+            self._encoded_size: int = self._state_len * 2
+        else:
+            self._encoded_size: int = self._vector_count * 4 + self._state_len
+
+    @property
+    def format(self) -> str:
+        return self._format
+
+    @property
+    def encoded_size(self) -> int:
+        """
+        Size of an encoded state in bytes; it is the same for all states of the model.
+        """
+
+        return self._encoded_size
+
+    def encode(self, state: rwkv_cpp_model.NumpyArrayOrPyTorchTensor, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Encodes the state.
+
+        Parameters
+        ----------
+        state : NumpyArrayOrTorchTensor
+            State of shape (state_buffer_element_count).
+        out : Optional[np.ndarray]
+            Optional output array of type uint8 and shape (encoded_size), for example, a view into a memory-mapped file.
+
+        Returns
+        -------
+        np.ndarray
+            Encoded state of type uint8 and shape (encoded_size).
+        """
+
+        self._model._validate_tensor(state, 'state', self._state_len)
+
+        if self._model._is_pytorch_tensor(state):
+            state = state.numpy()
+
+        if out is None:
+            out = np.empty(self._encoded_size, dtype=np.uint8)
+        elif out.dtype != np.uint8 or out.shape != (self._encoded_size,):
+            raise ValueError(f'out must be of type uint8 and shape ({self._encoded_size},)')
+
+        if self._format == STATE_FORMAT_FP32:
+            out.view(np.float32)[:] = state
+        elif self._format == STATE_FORMAT_FP16:
+            out.view(np.float16)[:] = state
+        else:
+            vectors: np.ndarray = state.reshape(self._vector_count, -1)
+
+            scales: np.ndarray = out[:self._vector_count * 4].view(np.float32)
+            np.max(np.abs(vectors), axis=1, out=scales)
+            scales /= 127.0
+
+            # All-zero vectors are encoded with zero scale; dividing by 1 keeps them zero.
+            divisors: np.ndarray = np.where(scales > 0.0, scales, np.float32(1.0))
+
+            quantized: np.ndarray = out[self._vector_count * 4:].view(np.int8).reshape(self._vector_count, -1)
+            np.rint(vectors / divisors[:, None], out=quantized, casting='unsafe')
+
+        return out
+
+    def decode(self, data, state_out: Optional[rwkv_cpp_model.NumpyArrayOrPyTorchTensor] = None) -> rwkv_cpp_model.NumpyArrayOrPyTorchTensor:
+        """
+        Decodes a state encoded with `encode`.
+
+        Parameters
+        ----------
+        data : bytes-like or np.ndarray
+            Encoded state of encoded_size bytes.
+        state_out : Optional[NumpyArrayOrTorchTensor]
+            Optional output tensor for state. If provided, must be of type float32, contiguous and of shape (state_buffer_element_count).
+
+        Returns
+        -------
+        state
+            Decoded state. If state_out is not set, a numpy array is returned.
+        """
+
+        data = np.frombuffer(data, dtype=np.uint8)
+
+        if data.shape != (self._encoded_size,):
+            raise ValueError(f'Encoded state has invalid size {data.shape[0]}, expected {self._encoded_size}')
+
+        if state_out is None:
+            state_out = np.empty(self._state_len, dtype=np.float32)
+        else:
+            self._model._validate_tensor(state_out, 'state_out', self._state_len)
+
+        state: np.ndarray = state_out.numpy() if self._model._is_pytorch_tensor(state_out) else state_out
+
+        if self._format == STATE_FORMAT_FP32:
+            state[:] = data.view(np.float32)
+        elif self._format == STATE_FORMAT_FP16:
+            state[:] = data.view(np.float16)
+        else:
+            scales: np.ndarray = data[:self._vector_count * 4].view(np.float32)
+            quantized: np.ndarray = data[self._vector_count * 4:].view(np.int8).reshape(self._vector_count, -1)
+
+            np.multiply(quantized, scales[:, None], out=state.reshape(self._vector_count, -1))
+
+        return state_out
+
+class RWKVStateStore:
+    """
+    A file of fixed-size slots for encoded model states, mapped into memory.
+
+    Idle sessions can be spilled into a slot and restored later: saving and loading a state is a single encode or decode
+    of a memory region, with no parsing, and the OS pages the file in and out as needed.
+    The file persists between runs; it can be reopened with the same model and settings.
+
+    The store is not thread-safe; concurrent access to different slots is fine, though.
+    """
+
+    _MAGIC: bytes = b'RWKVSTAT'
+    _VERSION: int = 1
+    _HEADER_SIZE: int = 64
+    _ALIGNMENT: int = 64
+
+    def __init__(
+            self,
+            path: str,
+            model: rwkv_cpp_model.RWKVModel,
+            slot_count: int,
+            state_format: str = STATE_FORMAT_FP16,
+            with_logits: bool = False
+    ) -> None:
+        """
+        Opens the store, creating the file if it does not exist.
+        In case of any error, this method will throw an exception.
+
+        Parameters
+        ----------
+        path : str
+            Path to the store file.
+        model : RWKVModel
+            Model whose states will be stored.
+        slot_count : int
+            Count of slots, must be positive.
+        state_format : str
+            Format of stored states, one of STATE_FORMATS.
+        with_logits : bool
+            If set to True, each slot also holds float32 logits, which are needed to continue generation after the state.
+        """
+
+        if not (slot_count > 0):
+            raise ValueError('Slot count must be > 0')
+
+        self._model: rwkv_cpp_model.RWKVModel = model
+        self._codec: RWKVStateCodec = RWKVStateCodec(model, state_format)
+        self._with_logits: bool = with_logits
+
+        self._logits_size: int = model._logits_buffer_element_count * 4 if with_logits else 0
+        self._slot_size: int = self._align(self._codec.encoded_size + self._logits_size)
+        self._slot_count: int = slot_count
+
+        header: np.ndarray = np.zeros(self._HEADER_SIZE // 4, dtype=np.uint32)
+        header.view(np.uint8)[:8] = np.frombuffer(self._MAGIC, dtype=np.uint8)
+        header[2:8] = [
+            self._VERSION,
+            STATE_FORMATS.index(state_format),
+            model._state_buffer_element_count,
+            model._logits_buffer_element_count if with_logits else 0,
+            self._slot_size,
+            slot_count
+        ]
+
+        occupancy_offset: int = self._HEADER_SIZE
+        slots_offset: int = occupancy_offset + self._align(slot_count)
+        file_size: int = slots_offset + self._slot_size * slot_count
+
+        if os.path.exists(path):
+            existing_header: np.ndarray = np.fromfile(path, dtype=np.uint32, count=self._HEADER_SIZE // 4)
+
+            if not np.array_equal(existing_header, header) or os.path.getsize(path) != file_size:
+                raise ValueError(f'State store {path} was created with a different model or settings')
+
+            mode: str = 'r+'
+        else:
+            mode: str = 'w+'
+
+        self._file: np.memmap = np.memmap(path, dtype=np.uint8, mode=mode, shape=(file_size,))
+
+        if mode == 'w+':
+            self._file[:self._HEADER_SIZE] = header.view(np.uint8)
+
+        self._occupancy: np.ndarray = self._file[occupancy_offset:occupancy_offset + slot_count]
+        self._slots: np.ndarray = self._file[slots_offset:].reshape(slot_count, self._slot_size)
+
+        self._valid: bool = True
+
+    @property
+    def slot_count(self) -> int:
+        return self._slot_count
+
+    @property
+    def slot_size(self) -> int:
+        return self._slot_size
+
+    @property
+    def codec(self) -> RWKVStateCodec:
+        return self._codec
+
+    def is_occupied(self, slot: int) -> bool:
+        self._validate_slot(slot)
+
+        return bool(self._occupancy[slot])
+
+    def find_free_slot(self) -> Optional[int]:
+        """
+        Returns index of the first unoccupied slot, or None if all slots are occupied.
+        """
+
+        self._validate_open()
+
+        free: np.ndarray = np.flatnonzero(self._occupancy == 0)
+
+        return int(free[0]) if len(free) > 0 else None
+
+    def save(
+            self,
+            slot: int,
+            state: rwkv_cpp_model.NumpyArrayOrPyTorchTensor,
+            logits: Optional[rwkv_cpp_model.NumpyArrayOrPyTorchTensor] = None
+    ) -> None:
+        """
+        Encodes the state into the slot, overwriting its previous contents.
+
+        Parameters
+        ----------
+        slot : int
+            Index of the slot.
+        state : NumpyArrayOrTorchTensor
+            State to save.
+        logits : Optional[NumpyArrayOrTorchTensor]
+            Logits to save. Required if the store was opened with with_logits, and must not be set otherwise.
+        """
+
+        self._validate_slot(slot)
+
+        if (logits is not None) != self._with_logits:
+            raise ValueError('Logits must be set if and only if the store was opened with with_logits')
+
+        self._codec.encode(state, self._slots[slot, :self._codec.encoded_size])
+
+        if logits is not None:
+            self._model._validate_tensor(logits, 'logits', self._model._logits_buffer_element_count)
+
+            self._slots[slot, self._codec.encoded_size:self._codec.encoded_size + self._logits_size].view(np.float32)[:] = logits
+
+        self._occupancy[slot] = 1
+
+    def load(
+            self,
+            slot: int,
+            state_out: Optional[rwkv_cpp_model.NumpyArrayOrPyTorchTensor] = None,
+            logits_out: Optional[rwkv_cpp_model.NumpyArrayOrPyTorchTensor] = None
+    ) -> Tuple[rwkv_cpp_model.NumpyArrayOrPyTorchTensor, Optional[rwkv_cpp_model.NumpyArrayOrPyTorchTensor]]:
+        """
+        Decodes the state from the slot.
+
+        Parameters
+        ----------
+        slot : int
+            Index of an occupied slot.
+        state_out : Optional[NumpyArrayOrTorchTensor]
+            Optional output tensor for state.
+        logits_out : Optional[NumpyArrayOrTorchTensor]
+            Optional output tensor for logits. Ignored if the store was opened without with_logits.
+
+        Returns
+        -------
+        state, logits
+            Logits are None if the store was opened without with_logits.
+        """
+
+        if not self.is_occupied(slot):
+            raise ValueError(f'Slot {slot} is not occupied')
+
+        state_out = self._codec.decode(self._slots[slot, :self._codec.encoded_size], state_out)
+
+        if not self._with_logits:
+            return state_out, None
+
+        if logits_out is None:
+            logits_out = np.empty(self._model._logits_buffer_element_count, dtype=np.float32)
+        else:
+            self._model._validate_tensor(logits_out, 'logits_out', self._model._logits_buffer_element_count)
+
+        logits_out[:] = self._slots[slot, self._codec.encoded_size:self._codec.encoded_size + self._logits_size].view(np.float32)
+
+        return state_out, logits_out
+
+    def discard(self, slot: int) -> None:
+        """
+        Marks the slot as unoccupied.
+        """
+
+        self._validate_slot(slot)
+
+        self._occupancy[slot] = 0
+
+    def flush(self) -> None:
+        """
+        Writes changes to the file.
+        """
+
+        self._validate_open()
+
+        self._file.flush()
+
+    def close(self) -> None:
+        """
+        Writes changes to the file and unmaps it. The store must not be used anymore after calling this method.
+        """
+
+        if not self._valid:
+            raise ValueError('Already closed')
+
+        self._file.flush()
+
+        self._valid = False
+
+        del self._slots
+        del self._occupancy
+        del self._file
+
+    def __enter__(self) -> 'RWKVStateStore':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if self._valid:
+            self.close()
+
+    def _validate_open(self) -> None:
+        if not self._valid:
+            raise ValueError('Store was closed')
+
+    def _validate_slot(self, slot: int) -> None:
+        self._validate_open()
+
+        if not (0 <= slot < self._slot_count):
+            raise ValueError(f'Slot {slot} is out of range [0, {self._slot_count})')
+
+    def _align(self, size: int) -> int:
+        return (size + self._ALIGNMENT - 1) // self._ALIGNMENT * self._ALIGNMENT
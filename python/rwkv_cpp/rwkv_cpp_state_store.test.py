@@ -0,0 +1,116 @@
+import os
+import shutil
+import pathlib
+import tempfile
+import numpy as np
+import rwkv_cpp_model
+import rwkv_cpp_shared_library
+import rwkv_cpp_state_store
+from typing import List
+
+TESTS_DIR: pathlib.Path = pathlib.Path(os.path.abspath(__file__)).parent.parent.parent / 'tests'
+
+def assert_raises_value_error(fn) -> None:
+    try:
+        fn()
+    except ValueError:
+        return
+
+    assert False, 'ValueError was not raised'
+
+def test() -> None:
+    library: rwkv_cpp_shared_library.RWKVSharedLibrary = rwkv_cpp_shared_library.load_rwkv_shared_library()
+
+    model = rwkv_cpp_model.RWKVModel(library, str(TESTS_DIR / 'tiny-rwkv-5v2-730K-FP32.bin'), thread_count=1)
+
+    prompt: List[int] = list('A long time ago, '.encode('utf-8'))
+    logits, state = model.eval_sequence_in_chunks(prompt, None, use_numpy=True)
+
+    # Some vectors are all zeros, which must survive quantization with a zero scale.
+    state = state.copy()
+    state[:model.n_embed] = 0.0
+    state[-model.n_embed:] = 0.0
+
+    # FP32 is exact.
+    codec = rwkv_cpp_state_store.RWKVStateCodec(model, rwkv_cpp_state_store.STATE_FORMAT_FP32)
+    assert codec.encoded_size == len(state) * 4
+    assert np.array_equal(codec.decode(codec.encode(state)), state)
+
+    # FP16 error is within half of the FP16 precision; there are no values out of the FP16 range.
+    codec = rwkv_cpp_state_store.RWKVStateCodec(model, rwkv_cpp_state_store.STATE_FORMAT_FP16)
+    assert codec.encoded_size == len(state) * 2
+
+    decoded: np.ndarray = codec.decode(codec.encode(state))
+    assert np.all(np.abs(decoded - state) <= np.abs(state) * 2 ** -11 + 2 ** -24)
+    assert np.all(decoded[:model.n_embed] == 0.0)
+
+    # INT8 error of each vector is within half of its scale.
+    codec = rwkv_cpp_state_store.RWKVStateCodec(model, rwkv_cpp_state_store.STATE_FORMAT_INT8)
+    vector_count: int = len(state) // model.n_embed
+    assert codec.encoded_size == vector_count * 4 + len(state)
+
+    decoded = codec.decode(codec.encode(state))
+    vectors: np.ndarray = state.reshape(vector_count, -1)
+    scales: np.ndarray = np.abs(vectors).max(axis=1) / 127.0
+    errors: np.ndarray = np.abs(decoded.reshape(vector_count, -1) - vectors)
+
+    assert np.all(errors <= scales[:, None] * (0.5 + 1e-5))
+    assert np.all(decoded[:model.n_embed] == 0.0) and np.all(decoded[-model.n_embed:] == 0.0)
+    assert not np.any(np.isnan(decoded))
+
+    store_dir: str = tempfile.mkdtemp()
+    path: str = os.path.join(store_dir, 'states.bin')
+
+    try:
+        # Saved states and occupancy survive closing and reopening the store.
+        with rwkv_cpp_state_store.RWKVStateStore(path, model, 3, rwkv_cpp_state_store.STATE_FORMAT_FP32, with_logits=True) as store:
+            assert store.slot_size % 64 == 0
+            assert store.find_free_slot() == 0
+
+            store.save(0, state, logits)
+            store.save(2, state * 2, logits * 2)
+
+            assert store.find_free_slot() == 1
+
+        with rwkv_cpp_state_store.RWKVStateStore(path, model, 3, rwkv_cpp_state_store.STATE_FORMAT_FP32, with_logits=True) as store:
+            assert [store.is_occupied(slot) for slot in range(3)] == [True, False, True]
+
+            loaded_state, loaded_logits = store.load(0)
+            assert np.array_equal(loaded_state, state) and np.array_equal(loaded_logits, logits)
+
+            loaded_state, loaded_logits = store.load(2)
+            assert np.array_equal(loaded_state, state * 2) and np.array_equal(loaded_logits, logits * 2)
+
+            assert_raises_value_error(lambda: store.load(1))
+
+            store.discard(0)
+
+        with rwkv_cpp_state_store.RWKVStateStore(path, model, 3, rwkv_cpp_state_store.STATE_FORMAT_FP32, with_logits=True) as store:
+            assert [store.is_occupied(slot) for slot in range(3)] == [False, False, True]
+            assert store.find_free_slot() == 0
+
+            assert_raises_value_error(lambda: store.load(0))
+
+        # A store created with other settings is rejected.
+        assert_raises_value_error(lambda: rwkv_cpp_state_store.RWKVStateStore(path, model, 3, rwkv_cpp_state_store.STATE_FORMAT_FP16, with_logits=True))
+        assert_raises_value_error(lambda: rwkv_cpp_state_store.RWKVStateStore(path, model, 4, rwkv_cpp_state_store.STATE_FORMAT_FP32, with_logits=True))
+        assert_raises_value_error(lambda: rwkv_cpp_state_store.RWKVStateStore(path, model, 3, rwkv_cpp_state_store.STATE_FORMAT_FP32, with_logits=False))
+
+        other_model = rwkv_cpp_model.RWKVModel(library, str(TESTS_DIR / 'tiny-rwkv-4v0-660K-FP32.bin'), thread_count=1)
+        assert_raises_value_error(lambda: rwkv_cpp_state_store.RWKVStateStore(path, other_model, 3, rwkv_cpp_state_store.STATE_FORMAT_FP32, with_logits=True))
+        other_model.free()
+
+        # So is a file with a corrupted header.
+        with open(path, 'r+b') as f:
+            f.write(b'RWKVSTAX')
+
+        assert_raises_value_error(lambda: rwkv_cpp_state_store.RWKVStateStore(path, model, 3, rwkv_cpp_state_store.STATE_FORMAT_FP32, with_logits=True))
+    finally:
+        shutil.rmtree(store_dir)
+
+    model.free()
+
+    print('All tests pass')
+
+if __name__ == "__main__":
+    test()
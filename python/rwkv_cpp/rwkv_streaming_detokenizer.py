@@ -0,0 +1,313 @@
+import json
+import codecs
+from typing import List, Dict, Optional, Union, Callable, Iterable
+
+class StopStringMatcher:
+    """
+    Finds stop strings in a stream of bytes with an Aho-Corasick automaton.
+
+    The automaton is built as a full transition table, so each byte is processed with a single table lookup,
+    regardless of count and length of stop strings and of the length of the stream.
+    """
+
+    def __init__(self, stop_strings: Iterable[Union[str, bytes]]) -> None:
+        """
+        Parameters
+        ----------
+        stop_strings : Iterable[Union[str, bytes]]
+            Stop strings; str values are matched as their UTF-8 encoding. Empty stop strings are ignored.
+        """
+
+        self.patterns: List[bytes] = [stop.encode('utf-8') if isinstance(stop, str) else bytes(stop) for stop in stop_strings]
+
+        # Trie of the patterns; state 0 is the root.
+        children: List[Dict[int, int]] = [{}]
+        depths: List[int] = [0]
+        # Index of the longest pattern that ends in a state, or -1.
+        matches: List[int] = [-1]
+
+        for index, pattern in enumerate(self.patterns):
+            if len(pattern) == 0:
+                continue
+
+            state: int = 0
+
+            for byte in pattern:
+                next_state: Optional[int] = children[state].get(byte)
+
+                if next_state is None:
+                    next_state = len(children)
+                    children[state][byte] = next_state
+                    children.append({})
+                    depths.append(depths[state] + 1)
+                    matches.append(-1)
+
+                state = next_state
+
+            if matches[state] == -1:
+                matches[state] = index
+
+        # Breadth-first order guarantees that the failure state of a state, which is shorter, is complete before the state itself.
+        transitions: List[List[int]] = [[0] * 256 for _ in range(len(children))]
+        failures: List[int] = [0] * len(children)
+        queue: List[int] = []
+
+        for byte, child in children[0].items():
+            transitions[0][byte] = child
+            queue.append(child)
+
+        for state in queue:
+            failure_transitions: List[int] = transitions[failures[state]]
+            state_transitions: List[int] = transitions[state]
+
+            for byte in range(256):
+                child: Optional[int] = children[state].get(byte)
+
+                if child is None:
+                    state_transitions[byte] = failure_transitions[byte]
+                else:
+                    state_transitions[byte] = child
+                    failures[child] = failure_transitions[byte]
+
+                    # A pattern ending in the failure state ends here too, but is shorter than a pattern ending here.
+                    if matches[child] == -1:
+                        matches[child] = matches[failures[child]]
+
+                    queue.append(child)
+
+        self._transitions: List[List[int]] = transitions
+        self._depths: List[int] = depths
+        self._matches: List[int] = matches
+        self._state: int = 0
+
+    @property
+    def depth(self) -> int:
+        """
+        Length of the longest suffix of the processed bytes that is a prefix of some stop string.
+        These bytes may turn out to be the start of a stop string, and should not be emitted yet.
+        """
+
+        return self._depths[self._state]
+
+    def feed(self, data: bytes) -> int:
+        """
+        Processes bytes of the stream, stopping after the first byte that completes a stop string.
+
+        Returns
+        -------
+        int
+            -1 if no stop string was completed; otherwise, the offset in data right after the end of the stop string.
+            Use `last_match` to get the stop string.
+        """
+
+        transitions: List[List[int]] = self._transitions
+        matches: List[int] = self._matches
+        state: int = self._state
+
+        for offset, byte in enumerate(data):
+            state = transitions[state][byte]
+
+            if matches[state] != -1:
+                self._state = state
+
+                return offset + 1
+
+        self._state = state
+
+        return -1
+
+    @property
+    def last_match(self) -> int:
+        """
+        Index of the longest stop string that ends at the current position, or -1.
+        """
+
+        return self._matches[self._state]
+
+    def reset(self) -> None:
+        self._state = 0
+
+class RWKVStreamingDetokenizer:
+    """
+    Converts generated tokens into text one token at a time.
+
+    Bytes of a token may end in the middle of a multi-byte UTF-8 character; these bytes are buffered
+    and emitted when the character is complete, so no replacement characters appear in the middle of the text.
+    Stop strings are matched over the bytes with `StopStringMatcher`; bytes that may be the start of a stop string
+    are held back until the match is ruled out.
+
+    Each token is decoded once and each byte is processed once, so the cost per token does not depend on the length of the text,
+    unlike decoding all generated tokens again after each one.
+
+    Usage:
+
+    detokenizer = RWKVStreamingDetokenizer(tokenizer.decode_bytes, stop_strings=['\\n\\n'])
+
+    for token in tokens:
+        print(detokenizer.add(token), end='', flush=True)
+
+        if detokenizer.stopped:
+            break
+    else:
+        print(detokenizer.flush())
+    """
+
+    def __init__(self, decode_bytes: Callable[[List[int]], bytes], stop_strings: Iterable[str] = ()) -> None:
+        """
+        Parameters
+        ----------
+        decode_bytes : Callable[[List[int]], bytes]
+            Function that returns bytes of tokens, like `WorldTokenizer.decode_bytes` or a function returned by `get_20b_decode_bytes`.
+        stop_strings : Iterable[str]
+            When one of these strings appears in the text, the text before it is emitted and decoding stops.
+            If several stop strings are found, the one that ends first wins.
+        """
+
+        self._decode_bytes: Callable[[List[int]], bytes] = decode_bytes
+        self._stop_strings: List[str] = [stop for stop in stop_strings if stop != '']
+        self._matcher: Optional[StopStringMatcher] = StopStringMatcher(self._stop_strings) if len(self._stop_strings) > 0 else None
+        self._utf8_decoder: codecs.IncrementalDecoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        # Bytes that may be the start of a stop string.
+        self._held: bytes = b''
+        self._stop_string: Optional[str] = None
+
+    @property
+    def stopped(self) -> bool:
+        """
+        Whether a stop string was found. After that, added tokens are ignored until `reset` is called.
+        """
+
+        return self._stop_string is not None
+
+    @property
+    def stop_string(self) -> Optional[str]:
+        """
+        The stop string that was found, or None.
+        """
+
+        return self._stop_string
+
+    def add(self, token: int) -> str:
+        """
+        Adds a token and returns newly completed text, which may be empty.
+        """
+
+        return self.add_bytes(self._decode_bytes([token]))
+
+    def add_tokens(self, tokens: Iterable[int]) -> str:
+        """
+        Adds tokens and returns newly completed text, which may be empty.
+        """
+
+        return self.add_bytes(self._decode_bytes(list(tokens)))
+
+    def add_bytes(self, data: bytes) -> str:
+        """
+        Adds bytes of the text and returns newly completed text, which may be empty.
+        """
+
+        if self._stop_string is not None:
+            return ''
+
+        matcher: Optional[StopStringMatcher] = self._matcher
+
+        if matcher is None:
+            return self._utf8_decoder.decode(data)
+
+        end: int = matcher.feed(data)
+        data = self._held + data
+
+        if end != -1:
+            self._stop_string = self._stop_strings[matcher.last_match]
+            stop_start: int = len(self._held) + end - len(matcher.patterns[matcher.last_match])
+            self._held = b''
+
+            return self._utf8_decoder.decode(data[:stop_start], final=True)
+
+        emit_length: int = len(data) - matcher.depth
+        self._held = data[emit_length:]
+
+        return self._utf8_decoder.decode(data[:emit_length])
+
+    def flush(self) -> str:
+        """
+        Returns the rest of the text: held back bytes, and incomplete UTF-8 characters as replacement characters.
+        Call it when generation ends without a stop string.
+        """
+
+        if self._stop_string is not None:
+            return ''
+
+        data: bytes = self._held
+        self._held = b''
+
+        if self._matcher is not None:
+            self._matcher.reset()
+
+        return self._utf8_decoder.decode(data, final=True)
+
+    def reset(self) -> None:
+        """
+        Forgets all added tokens, so that the detokenizer can be used for a new text.
+        """
+
+        self._utf8_decoder.reset()
+        self._held = b''
+        self._stop_string = None
+
+        if self._matcher is not None:
+            self._matcher.reset()
+
+def _byte_level_alphabet() -> Dict[str, int]:
+    # Byte-level BPE represents each byte with a printable character; printable ASCII and Latin-1 characters represent themselves.
+    printable: List[int] = list(range(ord('!'), ord('~') + 1)) + list(range(ord('¡'), ord('¬') + 1)) + list(range(ord('®'), ord('ÿ') + 1))
+    alphabet: Dict[str, int] = {chr(byte): byte for byte in printable}
+    shift: int = 0
+
+    for byte in range(256):
+        if byte not in printable:
+            alphabet[chr(256 + shift)] = byte
+            shift += 1
+
+    return alphabet
+
+def get_20b_decode_bytes(file_path) -> Callable[[List[int]], bytes]:
+    """
+    Loads bytes of tokens of a byte-level BPE tokenizer, like the 20B tokenizer, from its tokenizer.json file.
+    The tokenizers package is not required.
+
+    Special tokens, like <|endoftext|>, decode into empty bytes, like with `tokenizers.Tokenizer.decode` by default.
+
+    Parameters
+    ----------
+    file_path
+        Path to the tokenizer.json file.
+
+    Returns
+    -------
+    Callable[[List[int]], bytes]
+        Function that returns bytes of tokens.
+    """
+
+    with open(file_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    alphabet: Dict[str, int] = _byte_level_alphabet()
+    vocab: Dict[str, int] = data['model']['vocab']
+    token_bytes: List[bytes] = [b''] * (max(vocab.values(), default=-1) + 1)
+
+    for text, token in vocab.items():
+        token_bytes[token] = bytes(alphabet[c] for c in text)
+
+    for added_token in data.get('added_tokens', []):
+        token: int = added_token['id']
+
+        if token >= len(token_bytes):
+            token_bytes.extend([b''] * (token + 1 - len(token_bytes)))
+
+        token_bytes[token] = b'' if added_token['special'] else added_token['content'].encode('utf-8')
+
+    def decode_bytes(tokens: List[int]) -> bytes:
+        return b''.join([token_bytes[token] for token in tokens])
+
+    return decode_bytes
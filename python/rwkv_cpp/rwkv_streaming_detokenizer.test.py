@@ -0,0 +1,119 @@
+import os
+import random
+import pathlib
+import rwkv_world_tokenizer
+import rwkv_streaming_detokenizer
+from typing import List, Optional, Tuple
+
+PYTHON_DIR: pathlib.Path = pathlib.Path(os.path.abspath(__file__)).parent.parent
+
+def find_first_stop(text: bytes, stop_strings: List[bytes]) -> Optional[Tuple[int, int]]:
+    # Returns start and end of the stop string that ends first; of stop strings ending at the same position, the longest one.
+    best: Optional[Tuple[int, int]] = None
+
+    for stop in stop_strings:
+        index: int = text.find(stop)
+
+        if index != -1 and (best is None or (index + len(stop), index) < (best[1], best[0])):
+            best = (index, index + len(stop))
+
+    return best
+
+def test() -> None:
+    random.seed(0)
+
+    # The matcher finds the first completed stop string in a stream split at arbitrary points.
+    for _ in range(2000):
+        stop_strings: List[bytes] = [bytes(random.choices(b'abc', k=random.randint(1, 4))) for _ in range(random.randint(1, 3))]
+        text: bytes = bytes(random.choices(b'abcd', k=random.randint(0, 30)))
+        matcher = rwkv_streaming_detokenizer.StopStringMatcher(stop_strings)
+
+        position: int = 0
+        match_end: int = -1
+
+        while position < len(text):
+            chunk: bytes = text[position:position + random.randint(1, 4)]
+            end: int = matcher.feed(chunk)
+
+            if end != -1:
+                match_end = position + end
+
+                break
+
+            position += len(chunk)
+
+            # Held back bytes are exactly the longest suffix that is a prefix of a stop string.
+            expected_depth: int = max([length for length in range(1, position + 1) if any(stop.startswith(text[position - length:position]) for stop in stop_strings)], default=0)
+            assert matcher.depth == expected_depth, f'{stop_strings} {text[:position]} {matcher.depth}'
+
+        expected: Optional[Tuple[int, int]] = find_first_stop(text, stop_strings)
+
+        if expected is None:
+            assert match_end == -1, f'{stop_strings} {text}'
+        else:
+            assert match_end == expected[1], f'{stop_strings} {text} {match_end}'
+            assert len(stop_strings[matcher.last_match]) == expected[1] - expected[0]
+
+    # Text of tokens split in the middle of UTF-8 characters is emitted without replacement characters.
+    tokenizer = rwkv_world_tokenizer.WorldTokenizer(PYTHON_DIR / 'rwkv_cpp' / 'rwkv_vocab_v20230424.txt')
+
+    samples: List[str] = [
+        'Hello, world!\n\nUser: 以下は、テストです。🙂🙃 блабла',
+        '😀😁😂🤣😃😄 emoji\n and \n\n new lines',
+        ''.join(random.choice('ab \n😀日ы') for _ in range(500))
+    ]
+
+    for sample in samples:
+        # Single bytes are tokens too, so split multi-byte characters into byte tokens.
+        tokens: List[int] = [tokenizer.token_to_index[bytes([byte])] for byte in sample[:30].encode('utf-8')] + tokenizer.encode(sample[30:])
+
+        detokenizer = rwkv_streaming_detokenizer.RWKVStreamingDetokenizer(tokenizer.decode_bytes)
+        parts: List[str] = [detokenizer.add(token) for token in tokens]
+
+        assert all('�' not in part for part in parts)
+        assert ''.join(parts) + detokenizer.flush() == sample
+
+        for stop_strings in [['\n\n'], ['User:', '🙃'], ['ab', '\n', '日ы'], ['not found']]:
+            detokenizer = rwkv_streaming_detokenizer.RWKVStreamingDetokenizer(tokenizer.decode_bytes, stop_strings)
+            text: str = ''
+
+            for token in tokens:
+                text += detokenizer.add(token)
+
+                if detokenizer.stopped:
+                    break
+            else:
+                text += detokenizer.flush()
+
+            expected = find_first_stop(sample.encode('utf-8'), [stop.encode('utf-8') for stop in stop_strings])
+
+            if expected is None:
+                assert not detokenizer.stopped
+                assert text == sample, f'{stop_strings}\n{text}'
+            else:
+                assert detokenizer.stop_string is not None
+                assert text == sample.encode('utf-8')[:expected[0]].decode('utf-8'), f'{stop_strings}\n{text}'
+
+        # An incomplete character at the end is replaced on flush.
+        detokenizer.reset()
+        assert detokenizer.add_bytes('🙂'.encode('utf-8')[:2]) == ''
+        assert detokenizer.flush() == '�'
+
+    # The 20B tokenizer is byte-level BPE; bytes of its tokens are read from its JSON file.
+    decode_bytes = rwkv_streaming_detokenizer.get_20b_decode_bytes(PYTHON_DIR / '20B_tokenizer.json')
+
+    assert decode_bytes([187]) == b'\n'
+    assert decode_bytes([535]) == b'\n\n'
+    assert decode_bytes([0]) == b''
+
+    # 'Ġ' is a space in byte-level BPE; 'ĠâĢ' and 'ľ' are split bytes of a space and a left double quotation mark.
+    assert decode_bytes([510, 3158]) == b'The quick'
+    assert decode_bytes([541, 239]).decode('utf-8') == ' “'
+
+    detokenizer = rwkv_streaming_detokenizer.RWKVStreamingDetokenizer(decode_bytes)
+    assert [detokenizer.add(token) for token in [510, 541, 239, 0]] == ['The', ' ', '“', '']
+
+    print('All tests pass')
+
+if __name__ == "__main__":
+    test()
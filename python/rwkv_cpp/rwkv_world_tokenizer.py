@@ -1,8 +1,14 @@
+import io
 import os
+import mmap
+import struct
+import hashlib
 import pathlib
-from typing import List, Set, Tuple, Callable
+import numpy as np
+from typing import List, Set, Tuple, Callable, Dict, Iterable, Optional, Union
 
 # Taken from https://github.com/BlinkDL/ChatRWKV/tree/main/tokenizer/rwkv_tokenizer.py
+# WorldTokenizer uses ArrayTrie instead; this trie is kept as the reference implementation.
 
 class Trie:
     __slots__ = ('ch', 'to', 'values', 'front')
@@ -63,56 +69,484 @@ class Trie:
 
         return '<TRIE %s %s>' % (ret[::-1], self.values)
 
+# Inputs shorter than this are matched token by token; longer inputs are matched with numpy at all positions at once.
+SHORT_INPUT_LENGTH: int = 8192
+# Count of bases checked at once when building the double array.
+PLACEMENT_WINDOW: int = 1024
+
+class ArrayTrie:
+    """
+    A byte trie stored as a double array, for greedy longest-match tokenization.
+
+    Each node is a slot in flat int32 arrays, the root being slot 0. The child of node s by byte c is slot t = base[s] + c,
+    if check[t] == s; tokens[t] holds the token that ends at node t, or -1. Arrays are padded by 256 slots,
+    so that t is always in range. The trie takes 12 bytes per slot, instead of a 256-slot list and a set per node.
+
+    Short inputs are matched by walking the arrays through memoryviews. For long inputs, longest matches are found
+    for all positions at once: the trie is walked one depth at a time with numpy gathers over all still matching positions.
+    """
+
+    def __init__(self, base: np.ndarray, check: np.ndarray, tokens: np.ndarray) -> None:
+        self.base: np.ndarray = base
+        self.check: np.ndarray = check
+        self.tokens: np.ndarray = tokens
+
+        # Element access of a memoryview in native format is much faster than of a numpy array.
+        self._base_view: memoryview = memoryview(base).cast('B').cast('i')
+        self._check_view: memoryview = memoryview(check).cast('B').cast('i')
+        self._tokens_view: memoryview = memoryview(tokens).cast('B').cast('i')
+
+    @staticmethod
+    def build(tokens: Iterable[Tuple[bytes, int]]) -> 'ArrayTrie':
+        """
+        Builds a trie from pairs of token bytes and token index. Tokens must be non-empty and unique.
+        """
+
+        # Node 0 is the root; children[node] maps a byte to a child node.
+        children: List[Dict[int, int]] = [{}]
+        node_tokens: List[int] = [-1]
+
+        for token, index in tokens:
+            node: int = 0
+
+            for c in token:
+                child: Optional[int] = children[node].get(c)
+
+                if child is None:
+                    child = len(children)
+                    children[node][c] = child
+                    children.append({})
+                    node_tokens.append(-1)
+
+                node = child
+
+            node_tokens[node] = index
+
+        # Children of each node are placed at the first base where all their slots are free. Nodes with most children
+        # are placed first, while the arrays are sparse; nodes with a single child then fill the remaining holes.
+        # Nodes with the same count of children resume the search from the previous base, skipping regions that are already full.
+        bases: List[int] = [0] * len(children)
+        free: np.ndarray = np.ones(4 * len(children) + 2 * PLACEMENT_WINDOW, dtype=np.bool_)
+        free[0] = False
+        first_free: int = 1
+        previous_base: int = 1
+        previous_count: int = 0
+
+        for node in sorted(range(len(children)), key=lambda n: -len(children[n])):
+            chars: np.ndarray = np.array(sorted(children[node]), dtype=np.int64)
+
+            if len(chars) == 0:
+                break
+
+            if len(chars) == 1 and first_free > chars[0]:
+                b: int = first_free - int(chars[0])
+            else:
+                start: int = max(first_free - int(chars[0]), previous_base if len(chars) == previous_count else 1)
+                b, free = ArrayTrie._find_base(free, chars, start)
+
+            bases[node] = b
+            free[b + chars] = False
+            previous_base = b
+            previous_count = len(chars)
+
+            while not free[first_free]:
+                first_free += 1
+
+        # Slots are known once all bases are; the root is slot 0.
+        slots: List[int] = [0] * len(children)
+        parents: List[int] = [0] * len(children)
+
+        for node, node_children in enumerate(children):
+            for c, child in node_children.items():
+                slots[child] = bases[node] + c
+                parents[child] = node
+
+        # Trailing slots are kept free, so that base + byte is always in range.
+        size: int = max(slots) + 257
+
+        slots_array: np.ndarray = np.array(slots, dtype=np.int64)
+
+        base_array: np.ndarray = np.zeros(size, dtype=np.int32)
+        check_array: np.ndarray = np.full(size, -1, dtype=np.int32)
+        tokens_array: np.ndarray = np.full(size, -1, dtype=np.int32)
+
+        base_array[slots_array] = bases
+        check_array[slots_array[1:]] = slots_array[np.array(parents[1:], dtype=np.int64)]
+        tokens_array[slots_array] = node_tokens
+
+        return ArrayTrie(base_array, check_array, tokens_array)
+
+    @staticmethod
+    def _find_base(free: np.ndarray, chars: np.ndarray, start: int) -> Tuple[int, np.ndarray]:
+        # Returns the first base >= start where slots of all chars are free, checking all bases of a window at once,
+        # and the free mask, which is extended if needed.
+        while True:
+            if start + PLACEMENT_WINDOW + 256 > len(free):
+                free = np.concatenate((free, np.ones(len(free), dtype=np.bool_)))
+
+            fits: np.ndarray = free[start + chars[0]:start + chars[0] + PLACEMENT_WINDOW].copy()
+
+            for c in chars[1:]:
+                fits &= free[start + c:start + c + PLACEMENT_WINDOW]
+
+            if fits.any():
+                return start + int(fits.argmax()), free
+
+            start += PLACEMENT_WINDOW
+
+    def find_longest_all(self, src: bytes) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        For each position of src, finds the longest token that src continues with from that position.
+        Returns arrays of token lengths and tokens of shape (len(src)); length is 0 and token is -1 where no token matches.
+        """
+
+        data: np.ndarray = np.frombuffer(src, dtype=np.uint8)
+
+        lengths: np.ndarray = np.zeros(len(data), dtype=np.int32)
+        tokens: np.ndarray = np.full(len(data), -1, dtype=np.int32)
+
+        # Positions of the next byte for starts that still match at the current depth, and the node of each.
+        positions: np.ndarray = np.arange(len(data), dtype=np.int32)
+        nodes: np.ndarray = np.zeros(len(data), dtype=np.int32)
+        depth: int = 0
+
+        while len(positions) > 0:
+            children: np.ndarray = self.base[nodes] + data[positions]
+            matching: np.ndarray = np.flatnonzero(self.check[children] == nodes)
+
+            nodes = children[matching]
+            positions = positions[matching] + 1
+            depth += 1
+
+            node_tokens: np.ndarray = self.tokens[nodes]
+            ends_token: np.ndarray = np.flatnonzero(node_tokens >= 0)
+            starts: np.ndarray = positions[ends_token] - depth
+
+            lengths[starts] = depth
+            tokens[starts] = node_tokens[ends_token]
+
+            # Positions are increasing, so the starts that reached the end of src are at the end.
+            in_bounds: int = int(np.searchsorted(positions, len(data)))
+
+            if in_bounds < len(positions):
+                positions = positions[:in_bounds]
+                nodes = nodes[:in_bounds]
+
+        return lengths, tokens
+
+    def encode(self, src: bytes) -> List[int]:
+        """
+        Splits src into tokens greedily, taking the longest matching token at each step.
+        """
+
+        if len(src) < SHORT_INPUT_LENGTH:
+            return self._encode_short(src)
+
+        lengths, tokens = self.find_longest_all(src)
+
+        # Token boundaries form a chain from position 0: next_positions[i] = i + lengths[i].
+        # The chain is found with pointer doubling: after k steps, positions holds the first 2^k boundaries
+        # and jumps holds the boundary 2^k tokens ahead of each position. Position len(src) points to itself,
+        # and positions where no token matches point to it too, so that the chain always ends.
+        next_positions: np.ndarray = np.arange(len(src) + 1, dtype=np.int32)
+        next_positions[:-1] += lengths
+        next_positions[:-1][lengths == 0] = len(src)
+
+        positions: np.ndarray = np.zeros(1, dtype=np.int32)
+        jumps: np.ndarray = next_positions
+
+        while True:
+            reached: np.ndarray = jumps[positions]
+
+            if reached[0] == len(src):
+                positions = np.concatenate((positions, reached[reached < len(src)]))
+
+                break
+
+            positions = np.concatenate((positions, reached))
+            jumps = jumps[jumps]
+
+        positions = positions[positions < len(src)]
+        positions.sort()
+
+        if np.any(lengths[positions] == 0):
+            raise ValueError('Entry not found')
+
+        return tokens[positions].tolist()
+
+    def _encode_short(self, src: bytes) -> List[int]:
+        # Same as encode, walking the trie token by token.
+        base: memoryview = self._base_view
+        check: memoryview = self._check_view
+        tokens: memoryview = self._tokens_view
+
+        result: List[int] = []
+        length: int = len(src)
+        idx: int = 0
+
+        while idx < length:
+            node: int = 0
+            end: int = -1
+            token: int = -1
+            i: int = idx
+
+            while i < length:
+                child: int = base[node] + src[i]
+
+                if check[child] != node:
+                    break
+
+                node = child
+                i += 1
+                node_token: int = tokens[node]
+
+                if node_token >= 0:
+                    end = i
+                    token = node_token
+
+            if end == -1:
+                raise ValueError('Entry not found')
+
+            result.append(token)
+            idx = end
+
+        return result
+
+# Binary vocabulary cache, see WorldTokenizer.
+# Layout: header, then token offsets (uint32, token count + 1), token bytes, and base, check and tokens arrays of the trie (int32, slot count).
+# Each section starts at a multiple of CACHE_ALIGNMENT bytes.
+CACHE_MAGIC: bytes = b'RWKVVOCB'
+CACHE_VERSION: int = 1
+# Magic, version, reserved, SHA-256 of the vocabulary file, token count, blob size, slot count.
+CACHE_HEADER_FORMAT: str = '<8sII32sQQQ'
+CACHE_ALIGNMENT: int = 64
+
+def get_default_cache_dir() -> pathlib.Path:
+    """
+    Returns the directory for vocabulary caches: RWKV_CPP_CACHE_DIR environment variable if set,
+    or rwkv.cpp subdirectory of XDG_CACHE_HOME, or ~/.cache/rwkv.cpp.
+    """
+
+    if 'RWKV_CPP_CACHE_DIR' in os.environ:
+        return pathlib.Path(os.environ['RWKV_CPP_CACHE_DIR'])
+
+    return pathlib.Path(os.environ.get('XDG_CACHE_HOME', pathlib.Path.home() / '.cache')) / 'rwkv.cpp'
+
 class WorldTokenizer:
+    """
+    World tokenizer: greedy longest-match encoding over a vocabulary of byte strings.
 
-    def __init__(self, file_path) -> None:
-        self.index_to_token = {}
+    Parsing the vocabulary file and building the trie takes about a second, so the result is saved into a binary cache file,
+    keyed by SHA-256 of the vocabulary file. Later instances map the cache file into memory and use its arrays directly,
+    so construction costs little more than hashing the vocabulary file, and processes that load the same cache share its pages.
+    """
+
+    def __init__(self, file_path, cache_dir: Optional[Union[str, pathlib.Path]] = None, use_cache: bool = True) -> None:
+        """
+        Loads the tokenizer.
+
+        Parameters
+        ----------
+        file_path
+            Path to the vocabulary file.
+        cache_dir : Optional[Union[str, pathlib.Path]]
+            Directory of the binary cache; see `get_default_cache_dir` for the default.
+            If the cache can not be written there, the tokenizer works without it.
+        use_cache : bool
+            If set to False, the vocabulary file is parsed and no cache is read or written.
+        """
+
+        with open(file_path, 'rb') as f:
+            vocab_data: bytes = f.read()
+
+        self._index_to_token: Optional[Dict[int, bytes]] = None
+        self._token_to_index: Optional[Dict[bytes, int]] = None
+
+        vocab_hash: bytes = hashlib.sha256(vocab_data).digest()
+        cache_path: Optional[pathlib.Path] = None
+
+        if use_cache:
+            cache_path = pathlib.Path(cache_dir if cache_dir is not None else get_default_cache_dir()) / \
+                f'{pathlib.Path(file_path).stem}-{vocab_hash.hex()[:16]}.bin'
 
-        with open(file_path, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
+            if self._load_cache(cache_path, vocab_hash):
+                return
 
-        for line in lines:
+        self._index_to_token = {}
+
+        for line in io.TextIOWrapper(io.BytesIO(vocab_data), encoding='utf-8').readlines():
             idx = int(line[:line.index(' ')])
             x = eval(line[line.index(' '):line.rindex(' ')])
             x = x.encode('utf-8') if isinstance(x, str) else x
             assert isinstance(x, bytes)
             assert len(x) == int(line[line.rindex(' '):])
-            self.index_to_token[idx] = x
+            self._index_to_token[idx] = x
 
-        self.token_to_index = {}
+        self._token_to_index = {}
 
-        for k, v in self.index_to_token.items():
-            self.token_to_index[v] = int(k)
+        for k, v in self._index_to_token.items():
+            self._token_to_index[v] = int(k)
 
-        self.root = Trie()
+        self.trie: ArrayTrie = ArrayTrie.build(self._token_to_index.items())
 
-        for t, i in self.token_to_index.items():
-            _ = self.root.add(t, val=(t, i))
+        # Tokens are stored in a single blob: token i is token_blob[token_offsets[i]:token_offsets[i + 1]], empty for missing indices.
+        token_count: int = max(self._index_to_token.keys(), default=-1) + 1
+        lengths: np.ndarray = np.zeros(token_count, dtype=np.uint32)
+        lengths[list(self._index_to_token.keys())] = [len(token) for token in self._index_to_token.values()]
 
-    def encode_bytes(self, src: bytes) -> List[int]:
-        idx: int = 0
-        tokens: List[int] = []
+        self.token_offsets: np.ndarray = np.zeros(token_count + 1, dtype=np.uint32)
+        np.cumsum(lengths, out=self.token_offsets[1:])
+        self.token_blob: bytes = b''.join(self._index_to_token.get(i, b'') for i in range(token_count))
+
+        self._init_views()
+
+        if cache_path is not None:
+            self._save_cache(cache_path, vocab_hash)
+
+    @property
+    def index_to_token(self) -> Dict[int, bytes]:
+        """
+        Dict from token index to token bytes. Built on first access when the tokenizer is loaded from the cache.
+        """
 
-        while idx < len(src):
-            _idx: int = idx
-            idx, _, values = self.root.find_longest(src, idx)
-            assert (idx != _idx)
-            _, token = next(iter(values))
-            tokens.append(token)
+        if self._index_to_token is None:
+            offsets: List[int] = self.token_offsets.tolist()
 
-        return tokens
+            self._index_to_token = {
+                i: bytes(self.token_blob[offsets[i]:offsets[i + 1]]) for i in range(len(offsets) - 1) if offsets[i] != offsets[i + 1]
+            }
+
+        return self._index_to_token
+
+    @property
+    def token_to_index(self) -> Dict[bytes, int]:
+        """
+        Dict from token bytes to token index. Built on first access when the tokenizer is loaded from the cache.
+        """
+
+        if self._token_to_index is None:
+            self._token_to_index = {v: k for k, v in self.index_to_token.items()}
+
+        return self._token_to_index
+
+    def encode_bytes(self, src: bytes) -> List[int]:
+        return self.trie.encode(src)
 
     def decode_bytes(self, tokens: List[int]) -> bytes:
-        return b''.join(map(lambda i: self.index_to_token[i], tokens))
+        blob = self.token_blob
+        offsets: memoryview = self._offsets_view
+        token_count: int = len(offsets) - 1
+        parts: List[bytes] = []
+
+        for i in tokens:
+            # Negative indices are rejected explicitly, since the memoryview would accept them.
+            if not (0 <= i < token_count):
+                raise KeyError(i)
+
+            start: int = offsets[i]
+            end: int = offsets[i + 1]
+
+            if start == end:
+                raise KeyError(i)
+
+            parts.append(blob[start:end])
+
+        return b''.join(parts)
 
     def encode(self, src: str) -> List[int]:
         return self.encode_bytes(src.encode('utf-8'))
 
     def decode(self, tokens: List[int]) -> str:
         # 'replace' error handling mode will insert \uFFFD characters in place of malformed/partial UTF-8 sequences.
-        # Downstream code needs to detect \uFFFD and attempt to postpone decoding until more tokens arrive and UTF-8 sequences are complete.
+        # Downstream code needs to detect \uFFFD and attempt to postpone decoding until more tokens arrive and UTF-8 sequences are complete,
+        # or use RWKVStreamingDetokenizer with decode_bytes, which does this without decoding tokens again.
         return self.decode_bytes(tokens).decode('utf-8', errors='replace')
 
+    def _init_views(self) -> None:
+        # Element access of a memoryview in native format is much faster than of a numpy array.
+        self._offsets_view: memoryview = memoryview(self.token_offsets).cast('B').cast('I')
+
+    def _load_cache(self, cache_path: pathlib.Path, vocab_hash: bytes) -> bool:
+        # Returns False if there is no valid cache for the vocabulary.
+        try:
+            with open(cache_path, 'rb') as f:
+                data: mmap.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return False
+
+        header_size: int = struct.calcsize(CACHE_HEADER_FORMAT)
+
+        if len(data) < header_size:
+            return False
+
+        magic, version, _, cache_hash, token_count, blob_size, slot_count = struct.unpack_from(CACHE_HEADER_FORMAT, data, 0)
+
+        if magic != CACHE_MAGIC or version != CACHE_VERSION or cache_hash != vocab_hash:
+            return False
+
+        offsets_offset: int = _align(header_size)
+        blob_offset: int = _align(offsets_offset + (token_count + 1) * 4)
+        trie_offset: int = _align(blob_offset + blob_size)
+        trie_size: int = _align(slot_count * 4)
+
+        if len(data) < trie_offset + 3 * trie_size:
+            return False
+
+        self.token_offsets = np.frombuffer(data, dtype=np.uint32, count=token_count + 1, offset=offsets_offset)
+        # The blob is small, and slicing bytes is much faster than slicing a memoryview, so it is copied.
+        self.token_blob = data[blob_offset:blob_offset + blob_size]
+
+        self.trie = ArrayTrie(
+            np.frombuffer(data, dtype=np.int32, count=slot_count, offset=trie_offset),
+            np.frombuffer(data, dtype=np.int32, count=slot_count, offset=trie_offset + trie_size),
+            np.frombuffer(data, dtype=np.int32, count=slot_count, offset=trie_offset + 2 * trie_size)
+        )
+
+        self._init_views()
+
+        return True
+
+    def _save_cache(self, cache_path: pathlib.Path, vocab_hash: bytes) -> None:
+        # The cache is written into a temporary file, which is then renamed, so that concurrent processes never read a partial cache.
+        # Failure to write the cache is not an error.
+        header: bytes = struct.pack(
+            CACHE_HEADER_FORMAT,
+            CACHE_MAGIC,
+            CACHE_VERSION,
+            0,
+            vocab_hash,
+            len(self.token_offsets) - 1,
+            len(self.token_blob),
+            len(self.trie.base)
+        )
+
+        sections: List[bytes] = [
+            header,
+            self.token_offsets.tobytes(),
+            self.token_blob,
+            self.trie.base.tobytes(),
+            self.trie.check.tobytes(),
+            self.trie.tokens.tobytes()
+        ]
+
+        temp_path: pathlib.Path = cache_path.with_name(f'{cache_path.name}.{os.getpid()}.tmp')
+
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+
+            with open(temp_path, 'wb') as f:
+                for section in sections:
+                    f.write(section)
+                    f.write(bytes(_align(len(section)) - len(section)))
+
+            os.replace(temp_path, cache_path)
+        except OSError:
+            if temp_path.exists():
+                temp_path.unlink()
+
+def _align(offset: int) -> int:
+    return (offset + CACHE_ALIGNMENT - 1) // CACHE_ALIGNMENT * CACHE_ALIGNMENT
+
 def get_world_tokenizer_v20230424() -> Tuple[
     Callable[[List[int]], str],
     Callable[[str], List[int]]
@@ -1,3 +1,8 @@
+import os
+import random
+import shutil
+import pathlib
+import tempfile
 import rwkv_world_tokenizer
 from typing import List
 
@@ -16,6 +21,84 @@ def test() -> None:
     decoded_string: str = decode(actual_tokens)
     assert test_string == decoded_string, f'\nDecoding mismatch: \n{decoded_string}'
 
+    # The array trie splits inputs exactly like the reference trie, both token by token and at all positions at once.
+    tokenizer = rwkv_world_tokenizer.WorldTokenizer(pathlib.Path(os.path.abspath(__file__)).parent / 'rwkv_vocab_v20230424.txt')
+
+    reference_trie = rwkv_world_tokenizer.Trie()
+
+    for token_bytes, token in tokenizer.token_to_index.items():
+        reference_trie.add(token_bytes, val=(token_bytes, token))
+
+    def reference_encode(src: bytes) -> List[int]:
+        idx: int = 0
+        tokens: List[int] = []
+
+        while idx < len(src):
+            idx, _, values = reference_trie.find_longest(src, idx)
+            tokens.append(next(iter(values))[1])
+
+        return tokens
+
+    rng = random.Random(42)
+    pieces: List[str] = [test_string, ' ', '  ', '\n\n', 'the', 'ing', 'блабла', '以下は', '😀', '-' * 40, '\t' * 7]
+
+    for length in [0, 1, 2, 3, 10, 100, rwkv_world_tokenizer.SHORT_INPUT_LENGTH, 20000]:
+        random_bytes: bytes = bytes(rng.randrange(256) for _ in range(length))
+        random_text: bytes = ''.join(rng.choice(pieces) for _ in range(length))[:length].encode('utf-8')
+
+        for src in [random_bytes, random_text]:
+            reference_tokens: List[int] = reference_encode(src)
+            assert tokenizer.encode_bytes(src) == reference_tokens, f'\nMismatch for {src[:100]}'
+            assert tokenizer.trie._encode_short(src) == reference_tokens, f'\nMismatch for {src[:100]}'
+
+    # A tokenizer loaded from the binary cache is the same as one parsed from the vocabulary file.
+    vocab_path: pathlib.Path = pathlib.Path(os.path.abspath(__file__)).parent / 'rwkv_vocab_v20230424.txt'
+    cache_dir: str = tempfile.mkdtemp()
+
+    try:
+        parsed = rwkv_world_tokenizer.WorldTokenizer(vocab_path, use_cache=False)
+        rwkv_world_tokenizer.WorldTokenizer(vocab_path, cache_dir=cache_dir)
+        assert len(os.listdir(cache_dir)) == 1, 'Cache was not written'
+
+        cached = rwkv_world_tokenizer.WorldTokenizer(vocab_path, cache_dir=cache_dir)
+        assert cached._index_to_token is None, 'Cache was not used'
+        assert cached.encode(test_string) == expected_tokens
+        assert cached.decode(expected_tokens) == test_string
+        assert cached.index_to_token == parsed.index_to_token
+
+        # Unknown and out of range token indices are rejected, like the dict lookup did.
+        for t in [parsed, cached]:
+            for invalid_token in [-1, -5, 0, len(t.token_offsets) - 1, 1 << 20]:
+                try:
+                    t.decode_bytes([1, invalid_token])
+                    assert False, f'Token {invalid_token} was decoded'
+                except KeyError as e:
+                    assert e.args == (invalid_token,), e
+
+        # A corrupted cache is rebuilt.
+        cache_path: str = os.path.join(cache_dir, os.listdir(cache_dir)[0])
+
+        with open(cache_path, 'r+b') as f:
+            f.write(b'garbage')
+
+        assert rwkv_world_tokenizer.WorldTokenizer(vocab_path, cache_dir=cache_dir).encode(test_string) == expected_tokens
+        assert rwkv_world_tokenizer.WorldTokenizer(vocab_path, cache_dir=cache_dir)._index_to_token is None, 'Cache was not rebuilt'
+
+        # A changed vocabulary gets its own cache.
+        changed_vocab_path: str = os.path.join(cache_dir, 'vocab.txt')
+        shutil.copyfile(vocab_path, changed_vocab_path)
+
+        with open(changed_vocab_path, 'a', encoding='utf-8') as f:
+            f.write('65536 \'<|test|>\' 8\n')
+
+        changed = rwkv_world_tokenizer.WorldTokenizer(changed_vocab_path, cache_dir=cache_dir)
+        changed = rwkv_world_tokenizer.WorldTokenizer(changed_vocab_path, cache_dir=cache_dir)
+        assert changed._index_to_token is None, 'Cache was not used'
+        assert changed.encode('<|test|>') == [65536]
+        assert parsed.encode('<|test|>') != [65536]
+    finally:
+        shutil.rmtree(cache_dir)
+
     print('All tests pass')
 
 if __name__ == "__main__":
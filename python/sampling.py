@@ -1,5 +1,5 @@
 import numpy as np
-from typing import Dict
+from typing import Dict, List, Optional, Sequence, Union
 
 # https://stackoverflow.com/a/50425683
 def softmax(x: np.ndarray, axis: int):
@@ -50,3 +50,196 @@ def sample_probs(probs: np.ndarray, temperature: float = 1.0, top_p: float = 0.8
     probs = probs / np.sum(probs)
 
     return np.random.choice(a=len(probs), p=probs)
+
+# Count of candidates selected with np.argpartition for top-p filtering, when top-k is not set.
+# Rows whose nucleus does not fit into the candidates are sampled again with more candidates.
+TOP_P_CANDIDATE_COUNT: int = 256
+
+def make_logit_bias(n_vocab: int, logit_bias: Dict[int, float]) -> np.ndarray:
+    """
+    Converts a dict from token to bias into a dense array for `sample_logits_batch`. Compute it once and reuse it for all tokens.
+    """
+
+    bias: np.ndarray = np.zeros(n_vocab, dtype=np.float32)
+
+    for token, value in logit_bias.items():
+        bias[token] += value
+
+    return bias
+
+def make_generators(seeds: Sequence[Optional[int]]) -> List[np.random.Generator]:
+    """
+    Creates a random number generator for each row of a batch, so that each row is reproducible regardless of other rows.
+    """
+
+    return [np.random.default_rng(seed) for seed in seeds]
+
+def sample_logits_batch(
+        logits: np.ndarray,
+        temperature: Union[float, np.ndarray] = 1.0,
+        top_p: Union[float, np.ndarray] = 0.8,
+        top_k: Union[int, np.ndarray] = 0,
+        logit_bias: Optional[np.ndarray] = None,
+        rng: Union[np.random.Generator, Sequence[np.random.Generator], None] = None
+) -> np.ndarray:
+    """
+    Samples a token from each row of a (B, n_vocab) batch of logits at once. Logits are not modified.
+
+    Logits are adjusted by logit bias, filtered by top-k and then by top-p, and then the temperature is applied,
+    like in `sample_logits` and the native sampler. Top-k and top-p candidates are selected with np.argpartition,
+    so the vocabulary is not sorted.
+
+    Parameters
+    ----------
+    logits : np.ndarray
+        Logits of shape (B, n_vocab).
+    temperature : Union[float, np.ndarray]
+        Temperature, a scalar or an array of shape (B). 0 selects the token with the highest logit.
+    top_p : Union[float, np.ndarray]
+        Top-p threshold, a scalar or an array of shape (B). 0 or 1 disables top-p filtering.
+    top_k : Union[int, np.ndarray]
+        Count of most likely tokens to sample from, a scalar or an array of shape (B). 0 disables top-k filtering.
+    logit_bias : Optional[np.ndarray]
+        Bias added to logits, of shape (n_vocab) or (B, n_vocab); see `make_logit_bias`.
+    rng : Union[np.random.Generator, Sequence[np.random.Generator], None]
+        A generator for the whole batch, or a generator for each row; see `make_generators`.
+        If not set, numpy's default generator is used.
+
+    Returns
+    -------
+    np.ndarray
+        Sampled tokens of shape (B).
+    """
+
+    if logits.ndim != 2:
+        raise ValueError('logits must be of shape (B, n_vocab)')
+
+    batch_size, n_vocab = logits.shape
+
+    temperature = np.broadcast_to(np.asarray(temperature, dtype=np.float32), (batch_size,))
+    top_p = np.broadcast_to(np.asarray(top_p, dtype=np.float32), (batch_size,))
+    top_k = np.broadcast_to(np.asarray(top_k, dtype=np.int64), (batch_size,))
+
+    if not np.all(temperature >= 0.0):
+        raise ValueError('temperature')
+    if not np.all((0.0 <= top_p) & (top_p <= 1.0)):
+        raise ValueError('top_p')
+    if not np.all(top_k >= 0):
+        raise ValueError('top_k')
+
+    x: np.ndarray = logits if logit_bias is None else logits + logit_bias
+
+    if rng is None:
+        rng = np.random.default_rng()
+
+    if isinstance(rng, np.random.Generator):
+        uniform: np.ndarray = rng.random(batch_size)
+    else:
+        if len(rng) != batch_size:
+            raise ValueError('Generator count must match batch size')
+
+        uniform: np.ndarray = np.array([generator.random() for generator in rng])
+
+    tokens: np.ndarray = np.argmax(x, axis=1)
+
+    top_k = np.where((top_k == 0) | (top_k > n_vocab), n_vocab, top_k)
+    top_p = np.where(top_p == 0.0, 1.0, top_p)
+
+    greedy: np.ndarray = temperature == 0.0
+    unfiltered: np.ndarray = ~greedy & (top_k == n_vocab) & (top_p >= 1.0)
+    filtered: np.ndarray = ~greedy & ~unfiltered
+
+    if np.any(unfiltered):
+        # No candidate selection is needed; sample by inverse CDF over the whole vocabulary.
+        rows: np.ndarray = np.flatnonzero(unfiltered)
+        tokens[rows] = _sample_rows(x[rows], np.arange(n_vocab)[None, :], None, temperature[rows], uniform[rows])
+
+    if np.any(filtered):
+        rows: np.ndarray = np.flatnonzero(filtered)
+
+        needs_top_p: np.ndarray = top_p[rows] < 1.0
+        candidate_count: int = int(min(n_vocab, max(
+            top_k[rows][top_k[rows] < n_vocab].max(initial=0),
+            TOP_P_CANDIDATE_COUNT if np.any(needs_top_p & (top_k[rows] == n_vocab)) else 0
+        )))
+
+        # Rows where top-p needs more candidates than were selected are sampled again with 8 times more candidates.
+        while len(rows) > 0:
+            overflow: np.ndarray = _sample_filtered_rows(x[rows], rows, candidate_count, top_k, top_p, temperature, uniform, tokens)
+
+            rows = rows[overflow]
+            candidate_count = min(n_vocab, candidate_count * 8)
+
+    return tokens
+
+def _sample_filtered_rows(
+        x: np.ndarray,
+        rows: np.ndarray,
+        candidate_count: int,
+        top_k: np.ndarray,
+        top_p: np.ndarray,
+        temperature: np.ndarray,
+        uniform: np.ndarray,
+        tokens: np.ndarray
+) -> np.ndarray:
+    """
+    Samples tokens of the given rows into tokens, considering only candidate_count most likely tokens of each row.
+    Returns a mask of rows that could not be sampled, because their top-p nucleus does not fit into the candidates.
+    """
+
+    n_vocab: int = x.shape[1]
+
+    if candidate_count < n_vocab:
+        candidates: np.ndarray = np.argpartition(-x, candidate_count - 1, axis=1)[:, :candidate_count]
+    else:
+        candidates: np.ndarray = np.broadcast_to(np.arange(n_vocab), x.shape)
+
+    values: np.ndarray = np.take_along_axis(x, candidates, axis=1)
+    order: np.ndarray = np.argsort(-values, axis=1, kind='stable')
+    candidates = np.take_along_axis(candidates, order, axis=1)
+    values = np.take_along_axis(values, order, axis=1)
+
+    row_max: np.ndarray = values[:, :1]
+    probs: np.ndarray = np.exp(values - row_max)
+
+    k: np.ndarray = top_k[rows]
+    in_top_k: np.ndarray = np.arange(candidate_count)[None, :] < k[:, None]
+    probs = np.where(in_top_k, probs, 0.0)
+
+    # Without top-k, probabilities are normalized over the whole vocabulary, not only over the selected candidates.
+    total: np.ndarray = probs.sum(axis=1)
+    without_top_k: np.ndarray = k == n_vocab
+
+    if np.any(without_top_k) and candidate_count < n_vocab:
+        total[without_top_k] = np.exp(x[without_top_k] - row_max[without_top_k]).sum(axis=1)
+
+    cumulative: np.ndarray = np.cumsum(probs, axis=1) / total[:, None]
+    p: np.ndarray = top_p[rows]
+
+    # Tokens are kept up to and including the one where cumulative probability first exceeds top_p.
+    keep: np.ndarray = in_top_k & ((cumulative - probs / total[:, None]) <= p[:, None])
+    keep[:, 0] = True
+
+    overflow: np.ndarray = (k == n_vocab) & (p < 1.0) & (cumulative[:, -1] <= p) & (candidate_count < n_vocab)
+
+    sampled: np.ndarray = ~overflow
+    tokens[rows[sampled]] = _sample_rows(values[sampled], candidates[sampled], keep[sampled], temperature[rows[sampled]], uniform[rows[sampled]])
+
+    return overflow
+
+def _sample_rows(values: np.ndarray, candidates: np.ndarray, keep: Optional[np.ndarray], temperature: np.ndarray, uniform: np.ndarray) -> np.ndarray:
+    """
+    Samples a candidate of each row with weights exp(value / temperature), using one uniform random number per row.
+    """
+
+    weights: np.ndarray = np.exp((values - values.max(axis=1, keepdims=True)) / temperature[:, None])
+
+    if keep is not None:
+        weights = np.where(keep, weights, 0.0)
+
+    cumulative: np.ndarray = np.cumsum(weights, axis=1)
+    targets: np.ndarray = uniform * cumulative[:, -1]
+
+    indices: np.ndarray = np.minimum((cumulative <= targets[:, None]).sum(axis=1), values.shape[1] - 1)
+
+    return np.take_along_axis(np.broadcast_to(candidates, values.shape), indices[:, None], axis=1)[:, 0]
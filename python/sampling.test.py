@@ -0,0 +1,117 @@
+import numpy as np
+import sampling
+from typing import List
+
+def test() -> None:
+    n_vocab: int = 4096
+    logits: np.ndarray = np.random.default_rng(0).normal(0.0, 3.0, (6, n_vocab)).astype(np.float32)
+    logits_copy: np.ndarray = logits.copy()
+    expected: np.ndarray = np.argmax(logits, axis=1)
+
+    # Greedy rows select the token with the highest logit, regardless of other parameters and other rows.
+    tokens: np.ndarray = sampling.sample_logits_batch(
+        logits,
+        temperature=np.array([0.0, 1.0, 0.0, 1.0, 0.0, 1.0], dtype=np.float32),
+        top_p=np.array([0.5, 0.8, 1.0, 1.0, 0.0, 0.9], dtype=np.float32),
+        top_k=np.array([0, 0, 10, 0, 1, 40]),
+        rng=np.random.default_rng(1)
+    )
+
+    assert np.array_equal(tokens[[0, 2, 4]], expected[[0, 2, 4]]), tokens
+
+    # Top-k of 1 leaves only the token with the highest logit.
+    for top_p in [0.0, 0.5, 1.0]:
+        tokens = sampling.sample_logits_batch(logits, temperature=1.5, top_p=top_p, top_k=1, rng=np.random.default_rng(2))
+        assert np.array_equal(tokens, expected), tokens
+
+    # Logit bias is applied before filtering.
+    bias: np.ndarray = sampling.make_logit_bias(n_vocab, {7: 1000.0})
+    tokens = sampling.sample_logits_batch(logits, temperature=1.0, top_k=1, logit_bias=bias, rng=np.random.default_rng(3))
+    assert np.all(tokens == 7), tokens
+
+    # A nucleus of a flat distribution does not fit into the candidates, and is sampled again with more candidates.
+    flat_logits: np.ndarray = np.tile(-np.arange(n_vocab, dtype=np.float32) * 1e-4, (4, 1))
+    flat_logits_copy: np.ndarray = flat_logits.copy()
+    top_p: float = 0.999
+
+    calls: List[int] = []
+    sample_filtered_rows = sampling._sample_filtered_rows
+
+    def counting_sample_filtered_rows(x, rows, candidate_count, *args):
+        calls.append(candidate_count)
+
+        return sample_filtered_rows(x, rows, candidate_count, *args)
+
+    sampling._sample_filtered_rows = counting_sample_filtered_rows
+
+    try:
+        tokens = sampling.sample_logits_batch(flat_logits, top_p=top_p, rng=sampling.make_generators([10, 11, 12, 13]))
+    finally:
+        sampling._sample_filtered_rows = sample_filtered_rows
+
+    assert calls == [sampling.TOP_P_CANDIDATE_COUNT, sampling.TOP_P_CANDIDATE_COUNT * 8, n_vocab], calls
+
+    # The result is the same as when all tokens are candidates from the start.
+    candidate_count: int = sampling.TOP_P_CANDIDATE_COUNT
+    sampling.TOP_P_CANDIDATE_COUNT = n_vocab
+
+    try:
+        expected_tokens: np.ndarray = sampling.sample_logits_batch(flat_logits, top_p=top_p, rng=sampling.make_generators([10, 11, 12, 13]))
+    finally:
+        sampling.TOP_P_CANDIDATE_COUNT = candidate_count
+
+    assert np.array_equal(tokens, expected_tokens), (tokens, expected_tokens)
+
+    # Sampled tokens are within the nucleus: tokens are sorted by probability, so the nucleus is a prefix of the vocabulary.
+    probs: np.ndarray = np.exp(flat_logits[0].astype(np.float64))
+    probs /= probs.sum()
+    nucleus_size: int = int(np.searchsorted(np.cumsum(probs), top_p)) + 1
+
+    assert nucleus_size > sampling.TOP_P_CANDIDATE_COUNT * 8
+    assert np.all(tokens < nucleus_size), tokens
+    assert np.array_equal(flat_logits, flat_logits_copy)
+
+    # With a generator for each row, each row is reproducible regardless of other rows of the batch.
+    seeds: List[int] = [100, 101, 102, 103, 104, 105]
+    parameters = {'temperature': 1.0, 'top_p': np.array([0.8, 0.8, 1.0, 1.0, 0.95, 0.95], dtype=np.float32), 'top_k': np.array([0, 5, 0, 50, 0, 0])}
+
+    tokens = sampling.sample_logits_batch(logits, **parameters, rng=sampling.make_generators(seeds))
+    assert np.array_equal(tokens, sampling.sample_logits_batch(logits, **parameters, rng=sampling.make_generators(seeds)))
+
+    for row in range(len(seeds)):
+        row_token: np.ndarray = sampling.sample_logits_batch(
+            logits[row:row + 1],
+            temperature=parameters['temperature'],
+            top_p=parameters['top_p'][row],
+            top_k=parameters['top_k'][row],
+            rng=sampling.make_generators([seeds[row]])
+        )
+
+        assert row_token[0] == tokens[row], (row, row_token, tokens)
+
+    # Different seeds give different samples.
+    samples = set(int(sampling.sample_logits_batch(flat_logits[:1], top_p=1.0, rng=sampling.make_generators([seed]))[0]) for seed in range(20))
+    assert len(samples) > 1
+
+    # Logits are not modified by any of the calls above.
+    assert np.array_equal(logits, logits_copy)
+    assert np.array_equal(flat_logits, flat_logits_copy)
+
+    # Invalid parameters are rejected.
+    for kwargs in [{'temperature': -1.0}, {'top_p': 1.5}, {'top_k': -1}, {'rng': sampling.make_generators([1])}]:
+        try:
+            sampling.sample_logits_batch(logits, **kwargs)
+            assert False, f'Invalid parameters were accepted: {kwargs}'
+        except ValueError:
+            pass
+
+    try:
+        sampling.sample_logits_batch(logits[0])
+        assert False, 'Logits of invalid shape were accepted'
+    except ValueError:
+        pass
+
+    print('All tests pass')
+
+if __name__ == "__main__":
+    test()
@@ -1,6 +1,6 @@
 import os
 import pathlib
-from rwkv_cpp import rwkv_world_tokenizer
+from rwkv_cpp import rwkv_world_tokenizer, rwkv_streaming_detokenizer
 from typing import List, Tuple, Callable
 
 def add_tokenizer_argument(parser) -> None:
@@ -12,27 +12,45 @@ def add_tokenizer_argument(parser) -> None:
             default='auto'
     )
 
-def get_tokenizer(tokenizer_name: str, n_vocab: int) -> Tuple[
-    Callable[[List[int]], str],
-    Callable[[str], List[int]]
-]:
+def _resolve_tokenizer_name(tokenizer_name: str, n_vocab: int) -> str:
     if tokenizer_name == 'auto':
         if n_vocab == 50277:
-            tokenizer_name = '20B'
+            return '20B'
         elif n_vocab == 65536:
-            tokenizer_name = 'world'
+            return 'world'
         else:
             raise ValueError(f'Can not guess the tokenizer from n_vocab value of {n_vocab}')
 
+    if tokenizer_name not in ('world', '20B'):
+        raise ValueError(f'Unknown tokenizer {tokenizer_name}')
+
+    return tokenizer_name
+
+def get_tokenizer(tokenizer_name: str, n_vocab: int) -> Tuple[
+    Callable[[List[int]], str],
+    Callable[[str], List[int]]
+]:
+    tokenizer_name = _resolve_tokenizer_name(tokenizer_name, n_vocab)
+
     parent: pathlib.Path = pathlib.Path(os.path.abspath(__file__)).parent
 
     if tokenizer_name == 'world':
         print('Loading World v20230424 tokenizer')
         return rwkv_world_tokenizer.get_world_tokenizer_v20230424()
-    elif tokenizer_name == '20B':
+    else:
         print('Loading 20B tokenizer')
         import tokenizers
         tokenizer: tokenizers.Tokenizer = tokenizers.Tokenizer.from_file(str(parent / '20B_tokenizer.json'))
         return tokenizer.decode, lambda x: tokenizer.encode(x).ids
+
+def get_tokenizer_decode_bytes(tokenizer_name: str, n_vocab: int) -> Callable[[List[int]], bytes]:
+    """
+    Returns a function that returns bytes of tokens, for `rwkv_streaming_detokenizer.RWKVStreamingDetokenizer`.
+    """
+
+    tokenizer_name = _resolve_tokenizer_name(tokenizer_name, n_vocab)
+
+    if tokenizer_name == 'world':
+        return rwkv_world_tokenizer.WorldTokenizer(pathlib.Path(rwkv_world_tokenizer.__file__).parent / 'rwkv_vocab_v20230424.txt').decode_bytes
     else:
-        raise ValueError(f'Unknown tokenizer {tokenizer_name}')
+        return rwkv_streaming_detokenizer.get_20b_decode_bytes(pathlib.Path(os.path.abspath(__file__)).parent / '20B_tokenizer.json')
@@ -27,6 +27,12 @@
 #include <unordered_map>
 #include <memory>
 #include <utility>
+#include <atomic>
+#include <list>
+#include <algorithm>
+#include <thread>
+#include <mutex>
+#include <system_error>
 
 #define _FILE_OFFSET_BITS 64
 // Puts an optional break point, if debug is enabled.
@@ -50,11 +56,28 @@
 #    endif
 #endif
 
+#if defined(WIN32) || defined(_WIN32) || defined(__WIN32__) || defined(__NT__)
+#    ifndef WIN32_LEAN_AND_MEAN
+#        define WIN32_LEAN_AND_MEAN
+#    endif
+#    ifndef NOMINMAX
+#        define NOMINMAX
+#    endif
+#    include <windows.h>
+#    include <io.h>
+#else
+#    include <sys/mman.h>
+#    include <unistd.h>
+#    include <cerrno>
+#endif
+
 static_assert(sizeof(stat::st_size) >= 8, "File offsets should be 64-bit or else rwkv.cpp will not be able to load model files over 2 GB");
 static_assert(sizeof(decltype(ftell(NULL))) >= 8, "File offsets should be 64-bit or else rwkv.cpp will not be able to load model files over 2 GB");
 
 #define RWKV_MAX_NODES 80000
 
+#define RWKV_DEFAULT_SEQUENCE_GRAPH_CACHE_CAPACITY 8
+
 #include "rwkv_error_handling.inc"
 
 #include "rwkv_utilities.inc"
@@ -67,10 +90,34 @@ static_assert(sizeof(decltype(ftell(NULL))) >= 8, "File offsets should be 64-bit
 
 #include "rwkv_graph.inc"
 
+// API function.
+void rwkv_init_load_params(struct rwkv_load_params * params) {
+    params->n_threads = 1;
+    params->n_gpu_layers = 0;
+    params->use_mmap = false;
+    params->mmap_hint = RWKV_MMAP_HINT_NONE;
+    params->n_load_threads = 0;
+    params->progress_callback = NULL;
+    params->progress_callback_user_data = NULL;
+}
+
 // API function.
 struct rwkv_context * rwkv_init_from_file(const char * file_path, const uint32_t n_threads, const uint32_t n_gpu_layers) {
+    struct rwkv_load_params params;
+    rwkv_init_load_params(&params);
+    params.n_threads = n_threads;
+    params.n_gpu_layers = n_gpu_layers;
+
+    return rwkv_init_from_file_with_params(file_path, &params);
+}
+
+// API function.
+struct rwkv_context * rwkv_init_from_file_with_params(const char * file_path, const struct rwkv_load_params * params) {
     global_last_error = RWKV_ERROR_NONE;
 
+    const uint32_t n_threads = params->n_threads;
+    const uint32_t n_gpu_layers = params->n_gpu_layers;
+
     std::unique_ptr<struct rwkv_context> ctx(new(std::nothrow) struct rwkv_context());
     RWKV_ASSERT_NULL_MSG(RWKV_ERROR_CTX | RWKV_ERROR_ALLOC, ctx, "Failed to allocate rwkv_context");
 
@@ -107,12 +154,16 @@ struct rwkv_context * rwkv_init_from_file(const char * file_path, const uint32_t
     ggml_backend_cpu_set_n_threads(cpu_backend, n_threads);
     ctx->model->backends.push_back(cpu_backend);
 
-    int ngl = n_gpu_layers;
+    struct rwkv_load_params load_params = *params;
     if (ctx->model->backends.size() == 1) {
-        ngl = 0;
+        load_params.n_gpu_layers = 0;
     }
 
-    RWKV_ENSURE_OR_NULL(rwkv_load_model_from_file(file_path, *ctx->model, ngl));
+    RWKV_ENSURE_OR_NULL(rwkv_load_model_from_file(file_path, *ctx->model, load_params));
+
+    ctx->backends = ctx->model->backends;
+
+    ctx->sequential_graph_cache_capacity = RWKV_DEFAULT_SEQUENCE_GRAPH_CACHE_CAPACITY;
 
     RWKV_ENSURE_OR_NULL(rwkv_measure_and_build_serial_context(*ctx->model, ctx->serial_graph));
 
@@ -124,22 +175,48 @@ struct rwkv_context * rwkv_clone_context(struct rwkv_context * ctx, const uint32
     std::unique_ptr<struct rwkv_context> clone(new(std::nothrow) struct rwkv_context());
     RWKV_ASSERT_NULL_MSG(RWKV_ERROR_CTX | RWKV_ERROR_ALLOC, clone, "Failed to allocate rwkv_context");
 
+    // The reference count is incremented only when the clone is complete, so that error paths do not have to undo it.
     clone->model = ctx->model;
-    clone->model->reference_count++;
 
     clone->n_threads = n_threads;
 
-    RWKV_ENSURE_OR_NULL(rwkv_measure_and_build_serial_context(*clone->model, clone->serial_graph));
+    ggml_backend_t cpu_backend = ggml_backend_cpu_init();
+    RWKV_ASSERT_NULL_MSG(RWKV_ERROR_CTX | RWKV_ERROR_ALLOC, cpu_backend, "Failed to initialize CPU backend");
+    ggml_backend_cpu_set_n_threads(cpu_backend, n_threads);
+
+    clone->backends.assign(ctx->backends.begin(), ctx->backends.end() - 1);
+    clone->backends.push_back(cpu_backend);
+    clone->own_cpu_backend = cpu_backend;
+
+    if (!rwkv_measure_and_build_serial_context(*clone->model, clone->serial_graph)) {
+        // The clone is not freed with rwkv_free, so the serial graph and the CPU backend are released here.
+        if (clone->serial_graph.sched) {
+            ggml_backend_sched_free(clone->serial_graph.sched);
+        }
 
-    clone->last_used_sequence_length = 0;
+        if (clone->serial_graph.ggml_ctx) {
+            ggml_free(clone->serial_graph.ggml_ctx);
+        }
+
+        ggml_backend_free(cpu_backend);
+
+        return NULL;
+    }
+
+    clone->sequential_graph_cache_capacity = ctx->sequential_graph_cache_capacity;
+    clone->last_used_batch_size = 0;
 
     clone->print_errors = ctx->print_errors;
 
+    clone->model->reference_count++;
+
     return clone.release();
 }
 
 #include "rwkv_eval.inc"
 
+#include "rwkv_sampling.inc"
+
 // API function.
 // Provided for backwards compatibility.
 extern "C" RWKV_API uint32_t rwkv_get_state_buffer_element_count(const struct rwkv_context * ctx) {
@@ -206,9 +283,16 @@ void rwkv_free(struct rwkv_context * ctx) {
     ggml_backend_sched_free(ctx->serial_graph.sched);
     ggml_free(ctx->serial_graph.ggml_ctx);
 
-    if (ctx->last_used_sequence_length > 0) {
-        ggml_backend_sched_free(ctx->sequential_graph.sched);
-        ggml_free(ctx->sequential_graph.ggml_ctx);
+    for (auto & entry : ctx->sequential_graphs) {
+        rwkv_free_graph(entry.graph);
+    }
+
+    if (ctx->last_used_batch_size > 0) {
+        rwkv_free_graph(ctx->batch_graph);
+    }
+
+    if (ctx->own_cpu_backend) {
+        ggml_backend_free(ctx->own_cpu_backend);
     }
 
     delete ctx;
@@ -24,8 +24,10 @@
 
 #define RWKV_FILE_VERSION_0 100
 #define RWKV_FILE_VERSION_1 101
+// Adds a tensor directory after the file header and aligns tensor data, see docs/FILE_FORMAT.md.
+#define RWKV_FILE_VERSION_2 102
 #define RWKV_FILE_VERSION_MIN RWKV_FILE_VERSION_0
-#define RWKV_FILE_VERSION_MAX RWKV_FILE_VERSION_1
+#define RWKV_FILE_VERSION_MAX RWKV_FILE_VERSION_2
 // Default file version is the latest version.
 #define RWKV_FILE_VERSION RWKV_FILE_VERSION_MAX
 
@@ -90,6 +92,50 @@ extern "C" {
     // - n_gpu_layer: count of layers need to load to gpu
     RWKV_API struct rwkv_context * rwkv_init_from_file(const char * model_file_path, const uint32_t n_threads, const uint32_t n_gpu_layers);
 
+    // Hints for the memory mapping of the model file, see rwkv_load_params.
+    enum rwkv_mmap_hint {
+        // Pages are read from the file when they are accessed for the first time.
+        RWKV_MMAP_HINT_NONE = 0,
+        // The OS is asked to start reading the whole file in the background (madvise MADV_WILLNEED, PrefetchVirtualMemory).
+        RWKV_MMAP_HINT_WILLNEED = 1,
+        // The whole file is read into memory before loading returns (MAP_POPULATE, or touching every page).
+        RWKV_MMAP_HINT_POPULATE = 2
+    };
+
+    // Reports loading progress, in range 0 to 1, see rwkv_load_params.
+    typedef void (* rwkv_progress_callback)(float progress, void * user_data);
+
+    // Parameters of rwkv_init_from_file_with_params. Call rwkv_init_load_params to fill it with defaults before setting fields.
+    struct rwkv_load_params {
+        // Count of threads to use, must be positive. Default is 1.
+        uint32_t n_threads;
+        // Count of layers to offload to the GPU. Default is 0.
+        uint32_t n_gpu_layers;
+        // Whether to map the model file into memory instead of reading it. Default is false.
+        // Tensors on the CPU backend whose data is aligned in the file point straight into the mapping, so loading does not copy them,
+        // and processes that load the same file share one copy of it in the page cache. Other tensors are copied from the mapping.
+        // The file must not be modified while the model is loaded.
+        bool use_mmap;
+        // Hint for the mapping; ignored if use_mmap is false. Default is RWKV_MMAP_HINT_NONE.
+        enum rwkv_mmap_hint mmap_hint;
+        // Count of threads that read tensor data from the file in parallel, or copy it from the mapping; 0 means n_threads. Default is 0.
+        // Parallel reads help to saturate fast storage, like NVMe SSDs; on hard drives, 1 may be faster.
+        uint32_t n_load_threads;
+        // Called with the fraction of tensor data loaded so far and progress_callback_user_data, at least once; the last call has progress 1.
+        // It is called from loading threads, one call at a time, with non-decreasing progress. Default is NULL, which disables progress reporting.
+        rwkv_progress_callback progress_callback;
+        void * progress_callback_user_data;
+    };
+
+    // Fills the load params with defaults, which correspond to rwkv_init_from_file(model_file_path, 1, 0).
+    RWKV_API void rwkv_init_load_params(struct rwkv_load_params * params);
+
+    // Loads the model from a file and prepares it for inference, like rwkv_init_from_file, with more parameters.
+    // Returns NULL on any error.
+    // - model_file_path: path to model file in ggml format.
+    // - params: load params, see rwkv_init_load_params.
+    RWKV_API struct rwkv_context * rwkv_init_from_file_with_params(const char * model_file_path, const struct rwkv_load_params * params);
+
     // Creates a new context from an existing one.
     // This can allow you to run multiple rwkv_eval's in parallel, without having to load a single model multiple times.
     // Each rwkv_context can have one eval running at a time.
@@ -114,6 +160,29 @@ extern "C" {
         float * logits_out
     );
 
+    // Evaluates the model for a batch of independent sequences, advancing each sequence's state by a single token.
+    // All sequences share a single pass over the model weights, which makes this much faster than calling `rwkv_eval` for each sequence
+    // when inference is memory-bandwidth bound, like when serving multiple concurrent chat sessions. Best used with batch sizes of 8 to 32.
+    // Has to build a computation graph on the first call for a given batch size, but will use this cached graph for subsequent calls of the same batch size.
+    // You can pass NULL to logits_out whenever logits are not needed.
+    // Not thread-safe. For parallel inference, call `rwkv_clone_context` to create one rwkv_context for each thread.
+    // Returns false on any error.
+    // - tokens: pointer to an array of batch_size tokens, one for each sequence, each in range 0 <= token < n_vocab.
+    // - batch_size: number of sequences in the batch.
+    // - state_in: FP32 buffer of size batch_size * rwkv_get_state_len(), with state of sequence i starting at i * rwkv_get_state_len();
+    //   or NULL, if this is a first pass for all sequences.
+    // - state_out: FP32 buffer of size batch_size * rwkv_get_state_len(), laid out like state_in. This buffer will be written to if non-NULL.
+    // - logits_out: FP32 buffer of size batch_size * rwkv_get_logits_len(), with logits of sequence i starting at i * rwkv_get_logits_len().
+    //   This buffer will be written to if non-NULL.
+    RWKV_API bool rwkv_eval_batch(
+        struct rwkv_context * ctx,
+        const uint32_t * tokens,
+        const size_t batch_size,
+        const float * state_in,
+        float * state_out,
+        float * logits_out
+    );
+
     // Evaluates the model for a sequence of tokens.
     // Uses a faster algorithm than `rwkv_eval` if you do not need the state and logits for every token. Best used with sequence lengths of 64 or so.
     // Has to build a computation graph on the first call for a given sequence, but will use this cached graph for subsequent calls of the same sequence length.
@@ -146,6 +215,82 @@ extern "C" {
         float * logits_out
     );
 
+    // Evaluates the model for a sequence of tokens, like `rwkv_eval_sequence`, but writes logits for multiple positions of the sequence,
+    // all computed in one graph execution. Logits at position i are the model's prediction for the token following sequence[i].
+    // This is useful for teacher-forced scoring, like perplexity measurement or reranking, which would otherwise need one `rwkv_eval` call per token.
+    // Has to build a computation graph on the first call for a given sequence length and position count,
+    // but will use this cached graph for subsequent calls with the same sequence length and position count.
+    // The same node limit as in `rwkv_eval_sequence` applies; split long sequences into chunks and pass the state between calls.
+    // Not thread-safe. For parallel inference, call `rwkv_clone_context` to create one rwkv_context for each thread.
+    // Returns false on any error.
+    // - tokens: pointer to an array of tokens.
+    // - sequence_len: number of tokens to read from the array.
+    // - positions: positions in the sequence to compute logits for, each in range 0 <= position < sequence_len; or NULL to compute logits for all positions.
+    // - position_count: number of positions to read from the array. Ignored if positions is NULL.
+    // - state_in: FP32 buffer of size rwkv_get_state_len(), or NULL if this is a first pass.
+    // - state_out: FP32 buffer of size rwkv_get_state_len(). This buffer will be written to if non-NULL.
+    // - logits_out: FP32 buffer of size position_count * rwkv_get_logits_len() (or sequence_len * rwkv_get_logits_len(), if positions is NULL),
+    //   with logits for i-th position starting at i * rwkv_get_logits_len(). This buffer will be written to.
+    RWKV_API bool rwkv_eval_sequence_logits(
+        struct rwkv_context * ctx,
+        const uint32_t * tokens,
+        const size_t sequence_len,
+        const uint32_t * positions,
+        const size_t position_count,
+        const float * state_in,
+        float * state_out,
+        float * logits_out
+    );
+
+    // Evaluates the model for a sequence of tokens and scores the given target tokens: for each position i,
+    // writes log-probability of targets[i] according to the logits at position i, which is the model's prediction for the token following tokens[i].
+    // Log-softmax is computed natively, so only one float per position is copied out instead of full vocabulary logits.
+    // For teacher-forced scoring of a text, targets are the tokens shifted by one: targets[i] = text[i + 1].
+    // Uses the same cached graphs and has the same node limit as `rwkv_eval_sequence_logits`.
+    // Not thread-safe. For parallel inference, call `rwkv_clone_context` to create one rwkv_context for each thread.
+    // Returns false on any error.
+    // - tokens: pointer to an array of tokens.
+    // - sequence_len: number of tokens to read from the array.
+    // - targets: pointer to an array of sequence_len target tokens, each in range 0 <= target < n_vocab.
+    // - state_in: FP32 buffer of size rwkv_get_state_len(), or NULL if this is a first pass.
+    // - state_out: FP32 buffer of size rwkv_get_state_len(). This buffer will be written to if non-NULL.
+    // - logprobs_out: FP32 buffer of size sequence_len. This buffer will be written to if non-NULL.
+    // - loss_out: pointer to a double, where the summed negative log-probability of all targets will be written to if non-NULL.
+    RWKV_API bool rwkv_eval_sequence_logprobs(
+        struct rwkv_context * ctx,
+        const uint32_t * tokens,
+        const size_t sequence_len,
+        const uint32_t * targets,
+        const float * state_in,
+        float * state_out,
+        float * logprobs_out,
+        double * loss_out
+    );
+
+    // Scores the target tokens like `rwkv_eval_sequence_logprobs`, splitting a potentially long sequence into chunks
+    // the same way as `rwkv_eval_sequence_in_chunks`. Use it to score whole documents without reaching the node limit.
+    // Not thread-safe. For parallel inference, call `rwkv_clone_context` to create one rwkv_context for each thread.
+    // Returns false on any error.
+    // - sequence: pointer to an array of tokens.
+    // - sequence_len: number of tokens to read from the array.
+    // - targets: pointer to an array of sequence_len target tokens, each in range 0 <= target < n_vocab.
+    // - chunk_size: size of each chunk in tokens, must be positive.
+    // - state_in: FP32 buffer of size rwkv_get_state_len(), or NULL if this is a first pass.
+    // - state_out: FP32 buffer of size rwkv_get_state_len(). This buffer will be written to if non-NULL.
+    // - logprobs_out: FP32 buffer of size sequence_len. This buffer will be written to if non-NULL.
+    // - loss_out: pointer to a double, where the summed negative log-probability of all targets will be written to if non-NULL.
+    RWKV_API bool rwkv_eval_sequence_logprobs_in_chunks(
+        struct rwkv_context * ctx,
+        const uint32_t * sequence,
+        const size_t sequence_len,
+        const uint32_t * targets,
+        const size_t chunk_size,
+        const float * state_in,
+        float * state_out,
+        float * logprobs_out,
+        double * loss_out
+    );
+
     // Evaluates the model for a sequence of tokens using `rwkv_eval_sequence`, splitting a potentially long sequence into fixed-length chunks.
     // This function is useful for processing complete prompts and user input in chat & role-playing use-cases.
     // It is recommended to use this function instead of `rwkv_eval_sequence` to avoid mistakes and get maximum performance.
@@ -154,6 +299,10 @@ extern "C" {
     // A reasonable and recommended value of chunk size is 16. If you want maximum performance, try different chunk sizes in range [2..64]
     // and choose one that works the best in your use case.
     //
+    // The remainder that does not fill a whole chunk is evaluated in one pass. Its graph is built on the first use of its length
+    // and kept in the sequence graph cache (see `rwkv_set_sequence_graph_cache_capacity`), so prompts of varying lengths may use
+    // up to chunk_size different graphs; increase the cache capacity if graphs are rebuilt too often.
+    //
     // Not thread-safe. For parallel inference, call `rwkv_clone_context` to create one rwkv_context for each thread.
     // Returns false on any error.
     // - tokens: pointer to an array of tokens. If NULL, the graph will be built and cached, but not executed: this can be useful for initialization.
@@ -172,6 +321,89 @@ extern "C" {
         float * logits_out
     );
 
+    // Sets how many sequence graphs, each for a different sequence length, are kept in the context. The default is 8.
+    // When the cache is full, the least recently used graph is freed to make room for a graph of a new sequence length.
+    // Each cached graph holds its own compute buffers, so larger capacity trades memory for fewer graph rebuilds.
+    // Returns false on any error.
+    // - capacity: max count of cached sequence graphs, must be positive.
+    RWKV_API bool rwkv_set_sequence_graph_cache_capacity(struct rwkv_context * ctx, const size_t capacity);
+
+    // Counters of computation graph builds and allocations, accumulated over the lifetime of a context.
+    // Useful for confirming that steady-state inference does not rebuild graphs.
+    struct rwkv_graph_stats {
+        // How many times a sequence or batch graph was built, and total time spent building graphs, in microseconds.
+        // The serial graph is built once on context creation and is not counted.
+        uint64_t build_count;
+        uint64_t build_time_us;
+        // How many times scheduler and compute buffers were allocated for a graph, and total time spent on it, in microseconds.
+        uint64_t alloc_count;
+        uint64_t alloc_time_us;
+        // How many times a sequence graph was found in the cache, and how many times it had to be built.
+        uint64_t sequence_graph_hits;
+        uint64_t sequence_graph_misses;
+    };
+
+    // Writes graph build and allocation counters of the context into stats.
+    RWKV_API void rwkv_get_graph_stats(const struct rwkv_context * ctx, struct rwkv_graph_stats * stats);
+
+    // Parameters of rwkv_sample and rwkv_eval_and_sample. Call rwkv_init_sampler_params to fill it with defaults before setting fields.
+    // Logits are adjusted by logit bias and penalties, then filtered by top-k and top-p, and then the temperature is applied.
+    struct rwkv_sampler_params {
+        // Temperature; 0 selects the token with the highest adjusted logit and makes sampling deterministic. Default is 1.
+        float temperature;
+        // Tokens are sampled from the smallest set of most likely tokens with total probability above top_p.
+        // 0 or 1 disables top-p filtering. Default is 1.
+        float top_p;
+        // Tokens are sampled from top_k most likely tokens. 0 disables top-k filtering. Default is 0.
+        uint32_t top_k;
+        // Subtracted from logits of tokens with non-zero count. Default is 0.
+        float presence_penalty;
+        // Multiplied by count of a token and subtracted from its logit. Default is 0.
+        float frequency_penalty;
+        // Optional FP32 buffer of size rwkv_get_logits_len(), added to logits. Default is NULL.
+        const float * logit_bias;
+        // Optional FP32 buffer of size rwkv_get_logits_len() with counts of tokens used for penalties, which may be fractional
+        // (for example, decayed over time). Required if any penalty is non-zero. Default is NULL.
+        const float * token_counts;
+    };
+
+    // Fills the sampler params with defaults, which correspond to sampling from the unmodified distribution.
+    RWKV_API void rwkv_init_sampler_params(struct rwkv_sampler_params * params);
+
+    // Samples a token from logits.
+    // Uses a scratch buffer of the context, so it is not thread-safe, like other functions that take a context.
+    // Returns false on any error.
+    // - logits: FP32 buffer of size rwkv_get_logits_len().
+    // - rng_state: state of the random number generator, which is advanced by each call. Set it to a seed before the first call.
+    //   The same seed and the same calls produce the same tokens. May be NULL if temperature is 0.
+    // - token_out: sampled token is written here.
+    RWKV_API bool rwkv_sample(
+        struct rwkv_context * ctx,
+        const float * logits,
+        const struct rwkv_sampler_params * params,
+        uint64_t * rng_state,
+        uint32_t * token_out
+    );
+
+    // Evaluates the model for a single token like rwkv_eval, and samples the next token like rwkv_sample.
+    // Logits are sampled from directly in the graph's memory, so they are never copied to the caller when running on CPU.
+    // Returns false on any error.
+    // - token: next token index, in range 0 <= token < n_vocab.
+    // - state_in: FP32 buffer of size rwkv_get_state_len(); or NULL, if this is a first pass.
+    // - state_out: FP32 buffer of size rwkv_get_state_len(). This buffer will be written to if non-NULL.
+    // - logits_out: FP32 buffer of size rwkv_get_logits_len(). This buffer will be written to if non-NULL; logits are not adjusted.
+    // - params, rng_state, token_out: see rwkv_sample.
+    RWKV_API bool rwkv_eval_and_sample(
+        struct rwkv_context * ctx,
+        const uint32_t token,
+        const float * state_in,
+        float * state_out,
+        float * logits_out,
+        const struct rwkv_sampler_params * params,
+        uint64_t * rng_state,
+        uint32_t * token_out
+    );
+
     // Returns the number of tokens in the given model's vocabulary.
     // Useful for telling 20B_tokenizer models (n_vocab = 50277) apart from World models (n_vocab = 65536).
     RWKV_API size_t rwkv_get_n_vocab(const struct rwkv_context * ctx);
@@ -217,6 +449,30 @@ extern "C" {
     // - Q8_0
     RWKV_API bool rwkv_quantize_model_file(const char * model_file_path_in, const char * model_file_path_out, const char * format_name);
 
+    // Returns whether rwkv_quantize_model_file quantizes an FP32 or FP16 tensor with the given name and dimension count.
+    // Embedding and head matrices, small matrices of RWKV v7 and all tensors that are not 2D are kept as is.
+    RWKV_API bool rwkv_tensor_needs_quantization(const char * tensor_name, const uint32_t dim_count);
+
+    // Quantizes FP32 data of a single tensor, like rwkv_quantize_model_file does for tensors that need quantization.
+    // Can be called on multiple threads at once, so that independent tensors are quantized in parallel.
+    // Returns size of the quantized data in bytes, or 0 on any error. Errors are reported on the calling thread.
+    // - format_name: one of format names of rwkv_quantize_model_file.
+    // - src: n_rows * n_per_row FP32 values, row after row.
+    // - dst: buffer for the quantized data. If NULL, only the size of the quantized data is returned.
+    // - n_rows: count of rows, which is size1 of the tensor in ggml order.
+    // - n_per_row: count of values in a row, which is size0 of the tensor in ggml order. Must be a multiple of the block size of the format.
+    RWKV_API size_t rwkv_quantize_tensor_data(const char * format_name, const float * src, void * dst, const size_t n_rows, const size_t n_per_row);
+
+    // Rewrites a model file in another version of the file format; tensor data is copied as is.
+    // Useful for upgrading older files to the latest version, whose aligned tensor data can be memory-mapped without copying,
+    // or for downgrading files for older versions of rwkv.cpp.
+    // Returns false on any error. Error messages would be printed to stderr.
+    // - model_file_path_in: path to model file in ggml format, of any supported version.
+    // - model_file_path_out: converted model will be written here.
+    // - version: version of the written file, in range RWKV_FILE_VERSION_MIN <= version <= RWKV_FILE_VERSION_MAX.
+    //   Quantized models can not be written in version RWKV_FILE_VERSION_0.
+    RWKV_API bool rwkv_convert_model_file_version(const char * model_file_path_in, const char * model_file_path_out, const uint32_t version);
+
     // Returns system information string.
     RWKV_API const char * rwkv_get_system_info_string(void);
 
@@ -0,0 +1,99 @@
+// Tests that evaluating a batch of sequences gives the same results as evaluating each sequence separately.
+#include <stdlib.h>
+#include <stdio.h>
+#include <string.h>
+
+#include <rwkv.h>
+
+#include "assertions.inc"
+
+#define BATCH_SIZE 3
+
+static const char * prompts[BATCH_SIZE] = {
+    "hello world",
+    "batched evaluation",
+    "the quick brown fox"
+};
+
+static float absolute(const float x) {
+    return x < 0.0f ? -x : x;
+}
+
+static void test_model(const char * model_path) {
+    fprintf(stderr, "Testing %s\n", model_path);
+
+    struct rwkv_context * ctx = rwkv_init_from_file(model_path, 2, 0);
+
+    ASSERT(ctx != NULL, "Unexpected error 0x%.8X", rwkv_get_last_error(NULL));
+
+    const size_t state_len = rwkv_get_state_len(ctx);
+    const size_t logits_len = rwkv_get_logits_len(ctx);
+
+    float * expected_state = calloc(BATCH_SIZE * state_len, sizeof(float));
+    float * expected_logits = calloc(BATCH_SIZE * logits_len, sizeof(float));
+    float * state = calloc(BATCH_SIZE * state_len, sizeof(float));
+    float * logits = calloc(BATCH_SIZE * logits_len, sizeof(float));
+
+    ASSERT(expected_state != NULL && expected_logits != NULL, "Failed to allocate expected results");
+    ASSERT(state != NULL && logits != NULL, "Failed to allocate results");
+
+    // Number of steps is limited by the shortest prompt.
+    size_t step_count = strlen(prompts[0]);
+
+    for (size_t b = 1; b < BATCH_SIZE; b++) {
+        if (strlen(prompts[b]) < step_count) {
+            step_count = strlen(prompts[b]);
+        }
+    }
+
+    for (size_t b = 0; b < BATCH_SIZE; b++) {
+        float * sequence_state = expected_state + b * state_len;
+        float * sequence_logits = expected_logits + b * logits_len;
+
+        for (size_t i = 0; i < step_count; i++) {
+            ASSERT(rwkv_eval(ctx, (uint8_t) prompts[b][i], i == 0 ? NULL : sequence_state, sequence_state, sequence_logits), "Failed to evaluate sequence");
+        }
+    }
+
+    uint32_t tokens[BATCH_SIZE];
+
+    for (size_t i = 0; i < step_count; i++) {
+        for (size_t b = 0; b < BATCH_SIZE; b++) {
+            tokens[b] = (uint8_t) prompts[b][i];
+        }
+
+        ASSERT(rwkv_eval_batch(ctx, tokens, BATCH_SIZE, i == 0 ? NULL : state, state, logits), "Failed to evaluate batch");
+    }
+
+    for (size_t i = 0; i < BATCH_SIZE * logits_len; i++) {
+        ASSERT(absolute(expected_logits[i] - logits[i]) <= 1e-4f, "Logit %zu differs: expected %f, got %f", i, (double) expected_logits[i], (double) logits[i]);
+    }
+
+    for (size_t i = 0; i < BATCH_SIZE * state_len; i++) {
+        // v4 state contains large negative values used as -infinity.
+        const float magnitude = absolute(expected_state[i]);
+        const float tolerance = 1e-4f * (magnitude > 1.0f ? magnitude : 1.0f);
+
+        ASSERT(absolute(expected_state[i] - state[i]) <= tolerance, "State element %zu differs: expected %f, got %f", i, (double) expected_state[i], (double) state[i]);
+    }
+
+    // Graph for a different batch size must be rebuilt.
+    ASSERT(rwkv_eval_batch(ctx, tokens, BATCH_SIZE - 1, state, state, logits), "Failed to evaluate smaller batch");
+
+    rwkv_free(ctx);
+
+    free(expected_state);
+    free(expected_logits);
+    free(state);
+    free(logits);
+}
+
+int main(void) {
+    test_model("tiny-rwkv-4v0-660K-FP32.bin");
+    test_model("tiny-rwkv-5v1-730K-FP32.bin");
+    test_model("tiny-rwkv-5v2-730K-FP32.bin");
+    test_model("tiny-rwkv-6v0-3m-Q5_1.bin");
+    test_model("tiny-rwkv-7v0-834K-FP32.bin");
+
+    return 0;
+}
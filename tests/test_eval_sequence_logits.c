@@ -0,0 +1,141 @@
+// Tests that per-position logits and target log-probabilities from a single sequence evaluation are equivalent to results of serial eval.
+#include <stdlib.h>
+#include <stdio.h>
+#include <string.h>
+#include <math.h>
+
+#include <rwkv.h>
+
+#include "assertions.inc"
+
+#define SEQUENCE_LENGTH 12
+
+static float absolute(const float x) {
+    return x < 0.0f ? -x : x;
+}
+
+static void test_model(const char * model_path) {
+    fprintf(stderr, "Testing %s\n", model_path);
+
+    struct rwkv_context * ctx = rwkv_init_from_file(model_path, 2, 0);
+
+    ASSERT(ctx != NULL, "Unexpected error 0x%.8X", rwkv_get_last_error(NULL));
+
+    const size_t state_len = rwkv_get_state_len(ctx);
+    const size_t n_vocab = rwkv_get_logits_len(ctx);
+
+    const char * prompt = "hello world!";
+
+    uint32_t tokens[SEQUENCE_LENGTH];
+
+    for (size_t i = 0; i < SEQUENCE_LENGTH; i++) {
+        tokens[i] = (uint8_t) prompt[i];
+    }
+
+    float * expected_state = calloc(state_len, sizeof(float));
+    float * expected_logits = calloc(SEQUENCE_LENGTH * n_vocab, sizeof(float));
+    float * state = calloc(state_len, sizeof(float));
+    float * logits = calloc(SEQUENCE_LENGTH * n_vocab, sizeof(float));
+
+    ASSERT(expected_state != NULL && expected_logits != NULL, "Failed to allocate expected results");
+    ASSERT(state != NULL && logits != NULL, "Failed to allocate results");
+
+    for (size_t i = 0; i < SEQUENCE_LENGTH; i++) {
+        ASSERT(rwkv_eval(ctx, tokens[i], i == 0 ? NULL : expected_state, expected_state, expected_logits + i * n_vocab), "Failed to evaluate token");
+    }
+
+    // All positions.
+    ASSERT(rwkv_eval_sequence_logits(ctx, tokens, SEQUENCE_LENGTH, NULL, 0, NULL, state, logits), "Failed to evaluate sequence");
+
+    for (size_t i = 0; i < SEQUENCE_LENGTH * n_vocab; i++) {
+        ASSERT(absolute(expected_logits[i] - logits[i]) <= 1e-4f, "Logit %zu differs: expected %f, got %f", i, (double) expected_logits[i], (double) logits[i]);
+    }
+
+    ASSERT(memcmp(expected_state, state, state_len * sizeof(float)) == 0, "States are not identical");
+
+    // Selected positions, in arbitrary order.
+    const uint32_t positions[3] = {SEQUENCE_LENGTH - 1, 0, 5};
+
+    ASSERT(rwkv_eval_sequence_logits(ctx, tokens, SEQUENCE_LENGTH, positions, 3, NULL, NULL, logits), "Failed to evaluate sequence");
+
+    for (size_t p = 0; p < 3; p++) {
+        for (size_t i = 0; i < n_vocab; i++) {
+            const float expected = expected_logits[positions[p] * n_vocab + i];
+            const float actual = logits[p * n_vocab + i];
+
+            ASSERT(absolute(expected - actual) <= 1e-4f, "Logit %zu at position %d differs: expected %f, got %f", i, (int) positions[p], (double) expected, (double) actual);
+        }
+    }
+
+    // Log-probabilities of the next tokens.
+    uint32_t targets[SEQUENCE_LENGTH];
+
+    for (size_t i = 0; i < SEQUENCE_LENGTH; i++) {
+        targets[i] = i + 1 < SEQUENCE_LENGTH ? tokens[i + 1] : tokens[0];
+    }
+
+    float logprobs[SEQUENCE_LENGTH];
+    double loss = 0.0;
+
+    ASSERT(rwkv_eval_sequence_logprobs(ctx, tokens, SEQUENCE_LENGTH, targets, NULL, state, logprobs, &loss), "Failed to evaluate log-probabilities");
+
+    ASSERT(memcmp(expected_state, state, state_len * sizeof(float)) == 0, "States are not identical");
+
+    double expected_loss = 0.0;
+
+    for (size_t p = 0; p < SEQUENCE_LENGTH; p++) {
+        const float * row = expected_logits + p * n_vocab;
+
+        double sum = 0.0;
+
+        for (size_t i = 0; i < n_vocab; i++) {
+            sum += exp((double) row[i]);
+        }
+
+        const double expected = (double) row[targets[p]] - log(sum);
+
+        ASSERT(fabs(expected - (double) logprobs[p]) <= 1e-4, "Log-probability at position %zu differs: expected %f, got %f", p, expected, (double) logprobs[p]);
+
+        expected_loss -= expected;
+    }
+
+    ASSERT(fabs(expected_loss - loss) <= 1e-3, "Loss differs: expected %f, got %f", expected_loss, loss);
+
+    // Chunked scoring gives the same results, including the remainder that does not fill a whole chunk.
+    float chunked_logprobs[SEQUENCE_LENGTH];
+    double chunked_loss = 0.0;
+
+    ASSERT(rwkv_eval_sequence_logprobs_in_chunks(ctx, tokens, SEQUENCE_LENGTH, targets, 5, NULL, state, chunked_logprobs, &chunked_loss), "Failed to evaluate log-probabilities in chunks");
+
+    ASSERT(memcmp(expected_state, state, state_len * sizeof(float)) == 0, "States are not identical");
+
+    for (size_t p = 0; p < SEQUENCE_LENGTH; p++) {
+        ASSERT(fabs((double) logprobs[p] - (double) chunked_logprobs[p]) <= 1e-4, "Chunked log-probability at position %zu differs: expected %f, got %f", p, (double) logprobs[p], (double) chunked_logprobs[p]);
+    }
+
+    ASSERT(fabs(loss - chunked_loss) <= 1e-3, "Chunked loss differs: expected %f, got %f", loss, chunked_loss);
+
+    // Out of range positions are rejected.
+    const uint32_t invalid_positions[1] = {SEQUENCE_LENGTH};
+
+    rwkv_set_print_errors(ctx, false);
+    ASSERT(!rwkv_eval_sequence_logits(ctx, tokens, SEQUENCE_LENGTH, invalid_positions, 1, NULL, NULL, logits), "Invalid position was accepted");
+    ASSERT(rwkv_get_last_error(ctx) & RWKV_ERROR_ARGS, "Unexpected error");
+
+    rwkv_free(ctx);
+
+    free(expected_state);
+    free(expected_logits);
+    free(state);
+    free(logits);
+}
+
+int main(void) {
+    test_model("tiny-rwkv-4v0-660K-FP32.bin");
+    test_model("tiny-rwkv-5v1-730K-FP32.bin");
+    test_model("tiny-rwkv-5v2-730K-FP32.bin");
+    test_model("tiny-rwkv-6v0-3m-Q5_1.bin");
+    test_model("tiny-rwkv-7v0-834K-FP32.bin");
+
+    return 0;
+}
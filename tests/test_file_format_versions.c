@@ -0,0 +1,163 @@
+// Tests that model files converted to another file format version give the same results, and that converting them back gives the original files.
+#include <stdlib.h>
+#include <stdio.h>
+#include <string.h>
+
+#include <rwkv.h>
+
+#include "assertions.inc"
+
+static float * eval_prompt(struct rwkv_context * ctx) {
+    const char * prompt = "hello world";
+
+    float * state = calloc(rwkv_get_state_len(ctx), sizeof(float));
+    float * logits = calloc(rwkv_get_logits_len(ctx), sizeof(float));
+
+    ASSERT(state != NULL && logits != NULL, "Failed to allocate buffers");
+
+    for (size_t i = 0; prompt[i] != 0; i++) {
+        ASSERT(rwkv_eval(ctx, (uint8_t) prompt[i], i == 0 ? NULL : state, state, logits), "Failed to evaluate token");
+    }
+
+    free(state);
+
+    return logits;
+}
+
+static float * eval_model(const char * model_path, const bool use_mmap) {
+    struct rwkv_load_params params;
+    rwkv_init_load_params(&params);
+    params.n_threads = 2;
+    params.use_mmap = use_mmap;
+
+    struct rwkv_context * ctx = rwkv_init_from_file_with_params(model_path, &params);
+
+    ASSERT(ctx != NULL, "Unexpected error 0x%.8X", rwkv_get_last_error(NULL));
+
+    float * logits = eval_prompt(ctx);
+
+    rwkv_free(ctx);
+
+    return logits;
+}
+
+static uint8_t * read_file(const char * path, size_t * size) {
+    FILE * file = fopen(path, "rb");
+
+    ASSERT(file != NULL, "Failed to open %s", path);
+
+    fseek(file, 0, SEEK_END);
+    *size = (size_t) ftell(file);
+    fseek(file, 0, SEEK_SET);
+
+    uint8_t * data = malloc(*size);
+
+    ASSERT(data != NULL, "Failed to allocate buffer");
+    ASSERT(fread(data, 1, *size, file) == *size, "Failed to read %s", path);
+
+    fclose(file);
+
+    return data;
+}
+
+// Checks the layout of a version 2 file: tensor data follows the directory and is aligned.
+static void check_aligned_layout(const char * path) {
+    size_t size;
+    uint8_t * data = read_file(path, &size);
+
+    uint32_t header[6];
+    uint32_t alignment;
+    uint32_t tensor_count;
+    uint64_t directory_size;
+    memcpy(header, data, sizeof(header));
+    memcpy(&alignment, data + 24, sizeof(uint32_t));
+    memcpy(&tensor_count, data + 28, sizeof(uint32_t));
+    memcpy(&directory_size, data + 32, sizeof(uint64_t));
+
+    ASSERT(header[1] == RWKV_FILE_VERSION_2, "Unexpected file version %d", (int) header[1]);
+    ASSERT(alignment == 64, "Unexpected alignment %d", (int) alignment);
+    ASSERT(tensor_count > 0, "No tensors in the directory");
+
+    size_t position = 40;
+    uint64_t previous_offset = 40 + directory_size;
+
+    for (uint32_t i = 0; i < tensor_count; i++) {
+        uint32_t key_length;
+        uint64_t data_offset;
+        memcpy(&key_length, data + position + 4, sizeof(uint32_t));
+        memcpy(&data_offset, data + position + 24, sizeof(uint64_t));
+
+        ASSERT(data_offset % alignment == 0, "Tensor %d is not aligned", (int) i);
+        ASSERT(data_offset >= previous_offset && data_offset < size, "Tensor %d is out of order", (int) i);
+
+        previous_offset = data_offset;
+        position += 32 + key_length;
+    }
+
+    ASSERT(position == 40 + directory_size, "Unexpected directory size");
+
+    free(data);
+}
+
+static void test_model(const char * model_path, const uint32_t original_version) {
+    fprintf(stderr, "Testing %s\n", model_path);
+
+    const char * upgraded_path = "converted-v2.bin";
+    const char * downgraded_path = "converted-back.bin";
+
+    float * expected_logits = eval_model(model_path, false);
+
+    ASSERT(rwkv_convert_model_file_version(model_path, upgraded_path, RWKV_FILE_VERSION_2), "Unexpected error 0x%.8X", rwkv_get_last_error(NULL));
+
+    check_aligned_layout(upgraded_path);
+
+    float * logits = eval_model(upgraded_path, false);
+    float * mapped_logits = eval_model(upgraded_path, true);
+
+    ASSERT(memcmp(expected_logits, logits, 256 * sizeof(float)) == 0, "Results are not identical after upgrade");
+    ASSERT(memcmp(expected_logits, mapped_logits, 256 * sizeof(float)) == 0, "Results are not identical after upgrade with mmap");
+
+    // Converting back gives the same file.
+    ASSERT(rwkv_convert_model_file_version(upgraded_path, downgraded_path, original_version), "Unexpected error 0x%.8X", rwkv_get_last_error(NULL));
+
+    size_t original_size;
+    size_t downgraded_size;
+    uint8_t * original = read_file(model_path, &original_size);
+    uint8_t * downgraded = read_file(downgraded_path, &downgraded_size);
+
+    ASSERT(original_size == downgraded_size && memcmp(original, downgraded, original_size) == 0, "Files are not identical after downgrade");
+
+    free(original);
+    free(downgraded);
+    free(expected_logits);
+    free(logits);
+    free(mapped_logits);
+
+    remove(upgraded_path);
+    remove(downgraded_path);
+}
+
+int main(void) {
+    test_model("tiny-rwkv-4v0-660K-FP32.bin", RWKV_FILE_VERSION_0);
+    test_model("tiny-rwkv-5v2-730K-FP16.bin", RWKV_FILE_VERSION_1);
+    test_model("tiny-rwkv-5v2-730K-Q5_1.bin", RWKV_FILE_VERSION_1);
+    test_model("tiny-rwkv-7v0-834K-Q5_0.bin", RWKV_FILE_VERSION_1);
+
+    // Quantized models are written in the latest version.
+    ASSERT(rwkv_quantize_model_file("tiny-rwkv-7v0-834K-FP32.bin", "quantized-v2.bin", "Q5_1"), "Unexpected error 0x%.8X", rwkv_get_last_error(NULL));
+    check_aligned_layout("quantized-v2.bin");
+    remove("quantized-v2.bin");
+
+    rwkv_set_print_errors(NULL, false);
+
+    // Quantized models can not be written in version 0.
+    ASSERT(!rwkv_convert_model_file_version("tiny-rwkv-5v2-730K-Q5_1.bin", "converted-v0.bin", RWKV_FILE_VERSION_0), "Quantized model was written in version 0");
+    ASSERT(rwkv_get_last_error(NULL) & RWKV_ERROR_DATA_TYPE, "Unexpected error");
+
+    ASSERT(!rwkv_convert_model_file_version("tiny-rwkv-5v2-730K-Q5_1.bin", "converted-v0.bin", RWKV_FILE_VERSION_MAX + 1), "Unknown version was written");
+    ASSERT(rwkv_get_last_error(NULL) & RWKV_ERROR_FILE_VERSION, "Unexpected error");
+
+    remove("converted-v0.bin");
+
+    return 0;
+}
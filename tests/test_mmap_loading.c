@@ -0,0 +1,88 @@
+// Tests that models loaded with the file mapped into memory give the same results as models loaded by reading the file.
+#include <stdlib.h>
+#include <stdio.h>
+#include <string.h>
+
+#include <rwkv.h>
+
+#include "assertions.inc"
+
+static float * eval_prompt(struct rwkv_context * ctx) {
+    const char * prompt = "hello world";
+
+    float * state = calloc(rwkv_get_state_len(ctx), sizeof(float));
+    float * logits = calloc(rwkv_get_logits_len(ctx), sizeof(float));
+
+    ASSERT(state != NULL && logits != NULL, "Failed to allocate buffers");
+
+    for (size_t i = 0; prompt[i] != 0; i++) {
+        ASSERT(rwkv_eval(ctx, (uint8_t) prompt[i], i == 0 ? NULL : state, state, logits), "Failed to evaluate token");
+    }
+
+    free(state);
+
+    return logits;
+}
+
+static void test_model(const char * model_path) {
+    fprintf(stderr, "Testing %s\n", model_path);
+
+    struct rwkv_context * ctx = rwkv_init_from_file(model_path, 2, 0);
+
+    ASSERT(ctx != NULL, "Unexpected error 0x%.8X", rwkv_get_last_error(NULL));
+
+    float * expected_logits = eval_prompt(ctx);
+    const size_t n_vocab = rwkv_get_logits_len(ctx);
+
+    rwkv_free(ctx);
+
+    const enum rwkv_mmap_hint hints[3] = {RWKV_MMAP_HINT_NONE, RWKV_MMAP_HINT_WILLNEED, RWKV_MMAP_HINT_POPULATE};
+
+    for (size_t i = 0; i < 3; i++) {
+        struct rwkv_load_params params;
+        rwkv_init_load_params(&params);
+        params.n_threads = 2;
+        params.use_mmap = true;
+        params.mmap_hint = hints[i];
+
+        ctx = rwkv_init_from_file_with_params(model_path, &params);
+
+        ASSERT(ctx != NULL, "Unexpected error 0x%.8X", rwkv_get_last_error(NULL));
+
+        // Mapped weights must stay valid in clones after the original context is freed.
+        struct rwkv_context * clone = rwkv_clone_context(ctx, 2);
+
+        ASSERT(clone != NULL, "Unexpected error 0x%.8X", rwkv_get_last_error(NULL));
+
+        rwkv_free(ctx);
+
+        float * logits = eval_prompt(clone);
+
+        ASSERT(memcmp(expected_logits, logits, n_vocab * sizeof(float)) == 0, "Results are not identical with hint %d", (int) hints[i]);
+
+        free(logits);
+        rwkv_free(clone);
+    }
+
+    free(expected_logits);
+}
+
+int main(void) {
+    test_model("tiny-rwkv-4v0-660K-FP32.bin");
+    test_model("tiny-rwkv-5v2-730K-FP16.bin");
+    test_model("tiny-rwkv-5v2-730K-Q5_1.bin");
+    test_model("tiny-rwkv-7v0-834K-FP32.bin");
+    test_model("tiny-rwkv-7v0-834K-Q5_0.bin");
+
+    // A missing file is reported as an error.
+    struct rwkv_load_params params;
+    rwkv_init_load_params(&params);
+    params.use_mmap = true;
+
+    rwkv_set_print_errors(NULL, false);
+
+    ASSERT(rwkv_init_from_file_with_params("nonexistent.bin", &params) == NULL, "Missing file was loaded");
+    ASSERT(rwkv_get_last_error(NULL) & RWKV_ERROR_FILE_OPEN, "Unexpected error");
+
+    return 0;
+}
@@ -0,0 +1,105 @@
+// Tests that models loaded by multiple threads give the same results as models loaded by one thread, and that loading progress is reported.
+#include <stdlib.h>
+#include <stdio.h>
+#include <string.h>
+
+#include <rwkv.h>
+
+#include "assertions.inc"
+
+struct progress {
+    int call_count;
+    float last_progress;
+};
+
+static void on_progress(float progress, void * user_data) {
+    struct progress * state = (struct progress *) user_data;
+
+    ASSERT(progress >= state->last_progress && progress <= 1.0F, "Unexpected progress %f after %f", (double) progress, (double) state->last_progress);
+
+    state->call_count++;
+    state->last_progress = progress;
+}
+
+static float * eval_prompt(struct rwkv_context * ctx) {
+    const char * prompt = "hello world";
+
+    float * state = calloc(rwkv_get_state_len(ctx), sizeof(float));
+    float * logits = calloc(rwkv_get_logits_len(ctx), sizeof(float));
+
+    ASSERT(state != NULL && logits != NULL, "Failed to allocate buffers");
+
+    for (size_t i = 0; prompt[i] != 0; i++) {
+        ASSERT(rwkv_eval(ctx, (uint8_t) prompt[i], i == 0 ? NULL : state, state, logits), "Failed to evaluate token");
+    }
+
+    free(state);
+
+    return logits;
+}
+
+static float * eval_model(const char * model_path, const uint32_t n_load_threads, const bool use_mmap, struct progress * progress) {
+    struct rwkv_load_params params;
+    rwkv_init_load_params(&params);
+    params.n_threads = 2;
+    params.n_load_threads = n_load_threads;
+    params.use_mmap = use_mmap;
+    params.progress_callback = on_progress;
+    params.progress_callback_user_data = progress;
+
+    struct rwkv_context * ctx = rwkv_init_from_file_with_params(model_path, &params);
+
+    ASSERT(ctx != NULL, "Unexpected error 0x%.8X", rwkv_get_last_error(NULL));
+
+    float * logits = eval_prompt(ctx);
+
+    rwkv_free(ctx);
+
+    return logits;
+}
+
+static void test_model(const char * model_path) {
+    fprintf(stderr, "Testing %s\n", model_path);
+
+    struct progress progress = { 0, 0.0F };
+    float * expected_logits = eval_model(model_path, 1, false, &progress);
+
+    ASSERT(progress.call_count > 1, "Progress was reported %d times", progress.call_count);
+    ASSERT(progress.last_progress == 1.0F, "Loading did not end with progress 1");
+
+    const uint32_t thread_counts[3] = { 0, 4, 64 };
+
+    for (size_t i = 0; i < 3; i++) {
+        for (int use_mmap = 0; use_mmap < 2; use_mmap++) {
+            progress.call_count = 0;
+            progress.last_progress = 0.0F;
+
+            float * logits = eval_model(model_path, thread_counts[i], use_mmap, &progress);
+
+            ASSERT(memcmp(expected_logits, logits, 256 * sizeof(float)) == 0, "Results are not identical with %d threads", (int) thread_counts[i]);
+            ASSERT(progress.call_count > 0 && progress.last_progress == 1.0F, "Loading did not end with progress 1");
+
+            free(logits);
+        }
+    }
+
+    free(expected_logits);
+}
+
+int main(void) {
+    test_model("tiny-rwkv-4v0-660K-FP32.bin");
+    test_model("tiny-rwkv-5v2-730K-Q5_1.bin");
+    test_model("tiny-rwkv-7v0-834K-FP16.bin");
+
+    // Tensors of aligned files are used in place in the mapping, so there may be nothing to read; progress is still reported.
+    ASSERT(rwkv_convert_model_file_version("tiny-rwkv-7v0-834K-FP32.bin", "aligned.bin", RWKV_FILE_VERSION_2), "Unexpected error 0x%.8X", rwkv_get_last_error(NULL));
+
+    struct progress progress = { 0, 0.0F };
+    free(eval_model("aligned.bin", 4, true, &progress));
+
+    ASSERT(progress.call_count > 0 && progress.last_progress == 1.0F, "Loading did not end with progress 1");
+
+    remove("aligned.bin");
+
+    return 0;
+}
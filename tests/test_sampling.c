@@ -0,0 +1,158 @@
+// Tests native sampling: greedy sampling, filters, logit bias, penalties, RNG seeding and equivalence of rwkv_eval_and_sample to rwkv_eval + rwkv_sample.
+#include <stdlib.h>
+#include <stdio.h>
+#include <string.h>
+
+#include <rwkv.h>
+
+#include "assertions.inc"
+
+#define SAMPLE_COUNT 64
+
+static uint32_t argmax(const float * logits, const size_t n_vocab) {
+    uint32_t result = 0;
+
+    for (size_t i = 1; i < n_vocab; i++) {
+        if (logits[i] > logits[result]) {
+            result = (uint32_t) i;
+        }
+    }
+
+    return result;
+}
+
+static void test_model(const char * model_path) {
+    fprintf(stderr, "Testing %s\n", model_path);
+
+    struct rwkv_context * ctx = rwkv_init_from_file(model_path, 2, 0);
+
+    ASSERT(ctx != NULL, "Unexpected error 0x%.8X", rwkv_get_last_error(NULL));
+
+    const size_t state_len = rwkv_get_state_len(ctx);
+    const size_t n_vocab = rwkv_get_logits_len(ctx);
+
+    float * state = calloc(state_len, sizeof(float));
+    float * logits = calloc(n_vocab, sizeof(float));
+    float * other_state = calloc(state_len, sizeof(float));
+    float * other_logits = calloc(n_vocab, sizeof(float));
+    float * bias = calloc(n_vocab, sizeof(float));
+    float * counts = calloc(n_vocab, sizeof(float));
+
+    ASSERT(state != NULL && logits != NULL && other_state != NULL && other_logits != NULL, "Failed to allocate buffers");
+    ASSERT(bias != NULL && counts != NULL, "Failed to allocate buffers");
+
+    ASSERT(rwkv_eval(ctx, 'a', NULL, state, logits), "Failed to evaluate token");
+
+    const uint32_t best = argmax(logits, n_vocab);
+
+    struct rwkv_sampler_params params;
+    rwkv_init_sampler_params(&params);
+
+    uint32_t token = 0;
+    uint64_t rng_state = 42;
+
+    // Zero temperature and top-k of 1 both select the most likely token.
+    params.temperature = 0.0f;
+    ASSERT(rwkv_sample(ctx, logits, &params, NULL, &token), "Failed to sample");
+    ASSERT(token == best, "Expected token %d, got %d", (int) best, (int) token);
+
+    params.temperature = 1.0f;
+    params.top_k = 1;
+    ASSERT(rwkv_sample(ctx, logits, &params, &rng_state, &token), "Failed to sample");
+    ASSERT(token == best, "Expected token %d, got %d", (int) best, (int) token);
+
+    // Tiny top-p keeps only the most likely token.
+    params.top_k = 0;
+    params.top_p = 1e-6f;
+    ASSERT(rwkv_sample(ctx, logits, &params, &rng_state, &token), "Failed to sample");
+    ASSERT(token == best, "Expected token %d, got %d", (int) best, (int) token);
+
+    // Top-k limits samples to the k most likely tokens.
+    params.top_p = 1.0f;
+    params.top_k = 3;
+    params.temperature = 2.0f;
+
+    for (int i = 0; i < SAMPLE_COUNT; i++) {
+        ASSERT(rwkv_sample(ctx, logits, &params, &rng_state, &token), "Failed to sample");
+
+        size_t higher = 0;
+
+        for (size_t j = 0; j < n_vocab; j++) {
+            higher += logits[j] > logits[token];
+        }
+
+        ASSERT(higher < 3, "Token %d is not in top 3", (int) token);
+    }
+
+    // The same seed produces the same tokens.
+    uint32_t tokens[SAMPLE_COUNT];
+
+    params.top_k = 0;
+    rng_state = 7;
+
+    for (int i = 0; i < SAMPLE_COUNT; i++) {
+        ASSERT(rwkv_sample(ctx, logits, &params, &rng_state, &tokens[i]), "Failed to sample");
+    }
+
+    rng_state = 7;
+
+    for (int i = 0; i < SAMPLE_COUNT; i++) {
+        ASSERT(rwkv_sample(ctx, logits, &params, &rng_state, &token), "Failed to sample");
+        ASSERT(token == tokens[i], "Token %d differs with the same seed", i);
+    }
+
+    // Logit bias and penalties change the most likely token.
+    params.temperature = 0.0f;
+    params.logit_bias = bias;
+    bias[(best + 1) % n_vocab] = 1000.0f;
+    ASSERT(rwkv_sample(ctx, logits, &params, NULL, &token), "Failed to sample");
+    ASSERT(token == (best + 1) % n_vocab, "Logit bias was not applied");
+
+    params.logit_bias = NULL;
+    params.presence_penalty = 1000.0f;
+    params.token_counts = counts;
+    counts[best] = 0.5f;
+    ASSERT(rwkv_sample(ctx, logits, &params, NULL, &token), "Failed to sample");
+    ASSERT(token != best, "Presence penalty was not applied");
+
+    // Penalties require token counts.
+    params.token_counts = NULL;
+    rwkv_set_print_errors(ctx, false);
+    ASSERT(!rwkv_sample(ctx, logits, &params, NULL, &token), "Penalty without token counts was accepted");
+    ASSERT(rwkv_get_last_error(ctx) & RWKV_ERROR_ARGS, "Unexpected error");
+    rwkv_set_print_errors(ctx, true);
+
+    // rwkv_eval_and_sample is equivalent to rwkv_eval followed by rwkv_sample.
+    rwkv_init_sampler_params(&params);
+    params.top_p = 0.9f;
+
+    uint64_t other_rng_state = rng_state = 123;
+    uint32_t other_token = 0;
+
+    ASSERT(rwkv_eval(ctx, best, state, other_state, other_logits), "Failed to evaluate token");
+    ASSERT(rwkv_sample(ctx, other_logits, &params, &other_rng_state, &other_token), "Failed to sample");
+
+    ASSERT(rwkv_eval_and_sample(ctx, best, state, state, NULL, &params, &rng_state, &token), "Failed to evaluate and sample");
+
+    ASSERT(token == other_token, "Expected token %d, got %d", (int) other_token, (int) token);
+    ASSERT(rng_state == other_rng_state, "RNG states differ");
+    ASSERT(memcmp(state, other_state, state_len * sizeof(float)) == 0, "States are not identical");
+
+    rwkv_free(ctx);
+
+    free(state);
+    free(logits);
+    free(other_state);
+    free(other_logits);
+    free(bias);
+    free(counts);
+}
+
+int main(void) {
+    test_model("tiny-rwkv-4v0-660K-FP32.bin");
+    test_model("tiny-rwkv-5v2-730K-FP32.bin");
+    test_model("tiny-rwkv-6v0-3m-Q5_1.bin");
+    test_model("tiny-rwkv-7v0-834K-FP32.bin");
+
+    return 0;
+}
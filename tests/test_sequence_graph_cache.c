@@ -0,0 +1,79 @@
+// Tests that sequence graphs are cached by length, and that steady-state chunked evaluation does not rebuild graphs.
+#include <stdlib.h>
+#include <stdio.h>
+#include <string.h>
+
+#include <rwkv.h>
+
+#include "assertions.inc"
+
+#define TOKEN_COUNT 100
+
+int main(void) {
+    struct rwkv_context * ctx = rwkv_init_from_file("tiny-rwkv-5v2-730K-FP32.bin", 2, 0);
+
+    ASSERT(ctx != NULL, "Unexpected error 0x%.8X", rwkv_get_last_error(NULL));
+
+    float * state = calloc(rwkv_get_state_len(ctx), sizeof(float));
+    float * logits = calloc(rwkv_get_logits_len(ctx), sizeof(float));
+
+    ASSERT(state != NULL, "Failed to allocate state");
+    ASSERT(logits != NULL, "Failed to allocate logits");
+
+    uint32_t tokens[TOKEN_COUNT];
+
+    for (size_t i = 0; i < TOKEN_COUNT; i++) {
+        tokens[i] = (uint32_t) (i * 7 % 256);
+    }
+
+    // Prompts of different lengths, as in alternating chat turns.
+    const size_t prompt_lengths[5] = {37, 16, 100, 5, 63};
+    const size_t chunk_size = 16;
+
+    struct rwkv_graph_stats stats;
+
+    for (int i = 0; i < 5; i++) {
+        ASSERT(rwkv_eval_sequence_in_chunks(ctx, tokens, prompt_lengths[i], chunk_size, NULL, state, logits), "Failed to evaluate");
+    }
+
+    rwkv_get_graph_stats(ctx, &stats);
+
+    // Whole chunks of 16, and remainders of 5, 4 and 15 evaluated in one pass each.
+    ASSERT(stats.sequence_graph_misses == 4, "Unexpected sequence graph miss count %d", (int) stats.sequence_graph_misses);
+    ASSERT(stats.build_count == 4, "Unexpected build count %d", (int) stats.build_count);
+
+    const uint64_t alloc_count = stats.alloc_count;
+
+    for (int i = 0; i < 5; i++) {
+        ASSERT(rwkv_eval_sequence_in_chunks(ctx, tokens, prompt_lengths[i], chunk_size, NULL, state, logits), "Failed to evaluate");
+    }
+
+    rwkv_get_graph_stats(ctx, &stats);
+
+    ASSERT(stats.sequence_graph_misses == 4, "Graphs were rebuilt in steady state");
+    ASSERT(stats.build_count == 4, "Graphs were rebuilt in steady state");
+    ASSERT(stats.alloc_count == alloc_count, "Graphs were reallocated in steady state");
+    ASSERT(stats.sequence_graph_hits > 0, "No cache hits");
+
+    // With capacity of 1, alternating lengths evict each other.
+    ASSERT(rwkv_set_sequence_graph_cache_capacity(ctx, 1), "Failed to set capacity");
+
+    ASSERT(rwkv_eval_sequence(ctx, tokens, 8, NULL, state, logits), "Failed to evaluate");
+    ASSERT(rwkv_eval_sequence(ctx, tokens, 4, NULL, state, logits), "Failed to evaluate");
+    ASSERT(rwkv_eval_sequence(ctx, tokens, 8, NULL, state, logits), "Failed to evaluate");
+
+    rwkv_get_graph_stats(ctx, &stats);
+
+    ASSERT(stats.sequence_graph_misses == 7, "Unexpected sequence graph miss count %d", (int) stats.sequence_graph_misses);
+
+    rwkv_set_print_errors(ctx, false);
+    ASSERT(!rwkv_set_sequence_graph_cache_capacity(ctx, 0), "Zero capacity was accepted");
+    ASSERT(rwkv_get_last_error(ctx) & RWKV_ERROR_ARGS, "Unexpected error");
+
+    rwkv_free(ctx);
+
+    free(logits);
+    free(state);
+
+    return 0;
+}
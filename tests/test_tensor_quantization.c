@@ -0,0 +1,106 @@
+// Tests that quantizing a single tensor gives the same data as quantizing the whole model file.
+#include <stdlib.h>
+#include <stdio.h>
+#include <string.h>
+
+#include <rwkv.h>
+
+#include "assertions.inc"
+
+static uint8_t * read_file(const char * path) {
+    FILE * file = fopen(path, "rb");
+
+    ASSERT(file != NULL, "Failed to open %s", path);
+
+    fseek(file, 0, SEEK_END);
+    size_t size = (size_t) ftell(file);
+    fseek(file, 0, SEEK_SET);
+
+    uint8_t * data = malloc(size);
+
+    ASSERT(data != NULL, "Failed to allocate buffer");
+    ASSERT(fread(data, 1, size, file) == size, "Failed to read %s", path);
+
+    fclose(file);
+
+    return data;
+}
+
+// Finds a tensor in the directory of a version 2 file; returns its data and sizes in ggml order.
+static const uint8_t * find_tensor(const uint8_t * file_data, const char * name, uint32_t * data_type, uint32_t * size0, uint32_t * size1) {
+    uint32_t tensor_count;
+    memcpy(&tensor_count, file_data + 28, sizeof(uint32_t));
+
+    size_t position = 40;
+
+    for (uint32_t i = 0; i < tensor_count; i++) {
+        uint32_t key_length;
+        uint64_t data_offset;
+        memcpy(&key_length, file_data + position + 4, sizeof(uint32_t));
+        memcpy(data_type, file_data + position + 8, sizeof(uint32_t));
+        memcpy(size0, file_data + position + 12, sizeof(uint32_t));
+        memcpy(size1, file_data + position + 16, sizeof(uint32_t));
+        memcpy(&data_offset, file_data + position + 24, sizeof(uint64_t));
+
+        if (key_length == strlen(name) && memcmp(file_data + position + 32, name, key_length) == 0) {
+            return file_data + data_offset;
+        }
+
+        position += 32 + key_length;
+    }
+
+    ASSERT(false, "Tensor %s not found", name);
+
+    return NULL;
+}
+
+int main(void) {
+    ASSERT(rwkv_tensor_needs_quantization("blocks.0.att.key.weight", 2), "Matrix is not quantized");
+    ASSERT(!rwkv_tensor_needs_quantization("blocks.0.att.key.weight", 1), "Vector is quantized");
+    ASSERT(!rwkv_tensor_needs_quantization("blocks.0.att.time_decay", 3), "3D tensor is quantized");
+    ASSERT(!rwkv_tensor_needs_quantization("emb.weight", 2), "Embedding is quantized");
+    ASSERT(!rwkv_tensor_needs_quantization("head.weight", 2), "Head is quantized");
+    ASSERT(!rwkv_tensor_needs_quantization("blocks.0.att.w1", 2), "Small matrix of v7 is quantized");
+
+    const char * name = "blocks.0.att.key.weight";
+
+    ASSERT(rwkv_convert_model_file_version("tiny-rwkv-7v0-834K-FP32.bin", "fp32-v2.bin", RWKV_FILE_VERSION_2), "Unexpected error 0x%.8X", rwkv_get_last_error(NULL));
+    ASSERT(rwkv_quantize_model_file("tiny-rwkv-7v0-834K-FP32.bin", "quantized-v2.bin", "Q5_1"), "Unexpected error 0x%.8X", rwkv_get_last_error(NULL));
+
+    uint8_t * fp32_file = read_file("fp32-v2.bin");
+    uint8_t * quantized_file = read_file("quantized-v2.bin");
+
+    uint32_t data_type;
+    uint32_t size0;
+    uint32_t size1;
+    const float * src = (const float *) find_tensor(fp32_file, name, &data_type, &size0, &size1);
+    const uint8_t * expected = find_tensor(quantized_file, name, &data_type, &size0, &size1);
+
+    const size_t size = rwkv_quantize_tensor_data("Q5_1", NULL, NULL, size1, size0);
+
+    // Q5_1 block of 32 values takes 24 bytes.
+    ASSERT(size == size0 / 32 * 24 * size1, "Unexpected size %d", (int) size);
+
+    uint8_t * quantized = malloc(size);
+
+    ASSERT(quantized != NULL, "Failed to allocate buffer");
+    ASSERT(rwkv_quantize_tensor_data("Q5_1", src, quantized, size1, size0) == size, "Unexpected error 0x%.8X", rwkv_get_last_error(NULL));
+    ASSERT(memcmp(expected, quantized, size) == 0, "Quantized data of %s is not identical", name);
+
+    rwkv_set_print_errors(NULL, false);
+
+    ASSERT(rwkv_quantize_tensor_data("FP16", src, quantized, size1, size0) == 0, "Tensor was quantized into FP16");
+    ASSERT(rwkv_get_last_error(NULL) & RWKV_ERROR_DATA_TYPE, "Unexpected error");
+
+    ASSERT(rwkv_quantize_tensor_data("Q5_1", src, quantized, size1 * 2, size0 / 2 + 1) == 0, "Tensor with incomplete blocks was quantized");
+    ASSERT(rwkv_get_last_error(NULL) & RWKV_ERROR_SHAPE, "Unexpected error");
+
+    free(quantized);
+    free(fp32_file);
+    free(quantized_file);
+
+    remove("fp32-v2.bin");
+    remove("quantized-v2.bin");
+
+    return 0;
+}